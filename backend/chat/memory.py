@@ -0,0 +1,182 @@
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver, Checkpoint, CheckpointMetadata, CheckpointTuple, empty_checkpoint
+)
+from sqlalchemy import update
+from sqlalchemy.future import select
+from db.main import async_session
+from db.models import Conversation, Message
+from config import Config
+import rag  # noqa: F401 - makes test_rags/ importable
+from agentic_workflow import summarize_conversation
+
+Summarizer = Callable[[str, List[BaseMessage]], Awaitable[str]]
+
+
+class ConversationCheckpointer(BaseCheckpointSaver):
+    """LangGraph checkpointer over the Conversation and Message tables.
+
+    A graph thread is a conversation (thread_id is the conversation_id).
+    Loading a thread gives the graph the conversation's rolling summary and
+    the messages not yet folded into it, capped at `window + summary_batch`,
+    so each turn reads a bounded amount whatever the conversation's length.
+    The turn itself is stored as Message rows by the chat service, so
+    checkpoints written during a run are not persisted; `compact` then folds
+    messages that have slid out of the window into the summary.
+
+    Everything lives in the database, so memory survives restarts and every
+    worker sees the same conversation.
+    """
+
+    def __init__(
+        self,
+        summarize: Summarizer = summarize_conversation,
+        window: int = Config.MEMORY_WINDOW_MESSAGES,
+        summary_batch: int = Config.MEMORY_SUMMARY_BATCH,
+        session_factory=async_session
+    ):
+        super().__init__()
+        self.summarize = summarize
+        self.window = window
+        self.summary_batch = summary_batch
+        self.session_factory = session_factory
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        conversation_id = _conversation_id(config)
+        if conversation_id is None:
+            return None
+        async with self.session_factory() as session:
+            conversation = await session.get(Conversation, conversation_id)
+            if conversation is None:
+                return None
+            messages = await self._recent_messages(session, conversation, self.window + self.summary_batch)
+
+        checkpoint = empty_checkpoint()
+        checkpoint["channel_values"] = {
+            "messages": [_to_message(message) for message in messages],
+            "summary": conversation.summary or ""
+        }
+        return CheckpointTuple(
+            config={"configurable": {
+                "thread_id": str(conversation_id),
+                "checkpoint_ns": "",
+                "checkpoint_id": checkpoint["id"]
+            }},
+            checkpoint=checkpoint,
+            metadata={"source": "input", "step": -1, "writes": None, "parents": {}},
+            parent_config=None,
+            pending_writes=[]
+        )
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None
+    ) -> AsyncIterator[CheckpointTuple]:
+        # Only the current state of a conversation is kept
+        checkpoint = await self.aget_tuple(config) if config else None
+        if checkpoint is not None:
+            yield checkpoint
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: Dict[str, Any]
+    ) -> RunnableConfig:
+        return {"configurable": {
+            "thread_id": config["configurable"]["thread_id"],
+            "checkpoint_ns": config["configurable"].get("checkpoint_ns", ""),
+            "checkpoint_id": checkpoint["id"]
+        }}
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = ""
+    ) -> None:
+        return None
+
+    async def compact(self, conversation_id: int) -> bool:
+        """Fold messages that slid out of the window into the rolling summary.
+
+        Waits until `summary_batch` messages are past the window, so the
+        summarizer runs once every few turns rather than on each one.
+        Returns whether the summary changed; another worker compacting the
+        same conversation concurrently wins, and this one's work is dropped.
+        """
+        async with self.session_factory() as session:
+            conversation = await session.get(Conversation, conversation_id)
+            if conversation is None:
+                return False
+            # A long backlog (a conversation older than its summary) is folded a few batches at a time
+            limit = self.window + 4 * self.summary_batch
+            messages = await self._recent_messages(session, conversation, limit, oldest_first=True)
+        if len(messages) < self.window + self.summary_batch:
+            return False
+
+        # No connection is held while the LLM writes the summary
+        folded = messages[:len(messages) - self.window]
+        summary = await self.summarize(conversation.summary or "", [_to_message(m) for m in folded])
+        async with self.session_factory() as session:
+            try:
+                result = await session.execute(
+                    update(Conversation)
+                    .where(Conversation.conversation_id == conversation_id)
+                    .where(
+                        Conversation.summarized_until.is_(None) if conversation.summarized_until is None
+                        else Conversation.summarized_until == conversation.summarized_until
+                    )
+                    # Summarizing is not activity; keep the conversation's place in the list
+                    .values(summary=summary, summarized_until=folded[-1].timestamp, updated_at=Conversation.updated_at)
+                )
+                await session.commit()
+                return result.rowcount > 0
+            except Exception as e:
+                await session.rollback()
+                logging.error(f"Error saving summary of conversation {conversation_id}: {str(e)}")
+                raise
+
+    async def _recent_messages(
+        self,
+        session,
+        conversation: Conversation,
+        limit: int,
+        oldest_first: bool = False
+    ) -> List[Message]:
+        """Messages after the summary in timestamp order: the latest `limit`, or the earliest if oldest_first"""
+        query = select(Message).where(Message.conversation_id == conversation.conversation_id)
+        if conversation.summarized_until is not None:
+            query = query.where(Message.timestamp > conversation.summarized_until)
+        if oldest_first:
+            result = await session.execute(query.order_by(Message.timestamp).limit(limit))
+            return list(result.scalars())
+        result = await session.execute(query.order_by(Message.timestamp.desc()).limit(limit))
+        return list(result.scalars())[::-1]
+
+
+def _conversation_id(config: RunnableConfig) -> Optional[int]:
+    thread_id = config.get("configurable", {}).get("thread_id")
+    try:
+        return int(thread_id)
+    except (TypeError, ValueError):
+        # Not a stored conversation (e.g. a one-off run): start empty
+        return None
+
+
+def _to_message(message: Message) -> BaseMessage:
+    kind = HumanMessage if message.role == "user" else AIMessage
+    return kind(content=message.content, id=str(message.message_id))
+
+
+# Shared by the chat service and the agent graph (compiled with it at startup)
+conversation_memory = ConversationCheckpointer()
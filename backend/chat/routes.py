@@ -1,3 +1,34 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from .schema import MessageCreate
+from .service import ChatService
+from db.main import get_session
+from db.models import User
+from auth.dependencies import get_current_user
+from docs_management.routes import document_service
 
-chat_router = APIRouter()
\ No newline at end of file
+chat_router = APIRouter()
+chat_service = ChatService()
+
+@chat_router.post("/chat/stream")
+async def stream_chat(
+    message: MessageCreate,
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session)
+):
+    """Answer a question as server-sent events: sources, tokens, then the saved message"""
+    conversation = await chat_service.get_or_create_conversation(
+        current_user.user_id, message.conversation_id, session
+    )
+    search_filter = await document_service.get_search_filter(
+        current_user.user_id, session, message.document_ids
+    )
+    return StreamingResponse(
+        chat_service.stream_reply(
+            current_user.user_id, conversation.conversation_id, message.query, search_filter
+        ),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
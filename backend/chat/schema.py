@@ -23,7 +23,7 @@ class MessageResponse(MessageBase):
     is_off_topic: bool = False
 
 class MessageSourceResponse(BaseModel):
-    source_id: int
+    source_id: Optional[int] = None  # None until the message is saved (early stream event)
     document_id: int
     document_name: str
     page: int
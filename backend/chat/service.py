@@ -0,0 +1,167 @@
+import json
+import logging
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+from fastapi import HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from db.main import async_session
+from db.models import Conversation, Document, Message, MessageSources
+from .schema import ChatResponse, MessageSourceResponse
+from .memory import conversation_memory
+import rag  # noqa: F401 - makes test_rags/ importable
+from vector_index import SearchFilter
+from agentic_workflow import stream_answer
+
+class ChatService:
+
+    async def get_or_create_conversation(
+        self,
+        user_id: int,
+        conversation_id: Optional[int],
+        session: AsyncSession
+    ) -> Conversation:
+        """The user's conversation `conversation_id`, or a new one if None"""
+        if conversation_id is None:
+            conversation = Conversation(user_id=user_id)
+            session.add(conversation)
+            await session.commit()
+            await session.refresh(conversation)
+            return conversation
+
+        conversation = await session.get(Conversation, conversation_id)
+        if not conversation or conversation.user_id != user_id:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversation not found")
+        return conversation
+
+    async def resolve_sources(
+        self,
+        user_id: int,
+        sources: List[Dict[str, Any]],
+        session: AsyncSession
+    ) -> List[Dict[str, Any]]:
+        """Map retrieved chunks to the user's own Document rows, as citations.
+
+        Vectors are shared between identical uploads, so a chunk's
+        document_id may be another user's copy; chunks are matched by
+        content hash to this user's document instead. Shared manuals have
+        no Document row and are not cited.
+        """
+        hashes = {source["content_hash"] for source in sources if source.get("content_hash")}
+        ids = {source["document_id"] for source in sources if source.get("document_id") and not source.get("content_hash")}
+        if not (hashes or ids):
+            return []
+        query = select(Document).where(Document.user_id == user_id)
+        by_hash, by_id = {}, {}
+        if hashes:
+            for document in (await session.execute(query.where(Document.content_hash.in_(hashes)))).scalars():
+                by_hash.setdefault(document.content_hash, document)
+        if ids:
+            for document in (await session.execute(query.where(Document.document_id.in_(ids)))).scalars():
+                by_id[document.document_id] = document
+
+        citations = []
+        for source in sources:
+            document = by_hash.get(source.get("content_hash")) or by_id.get(source.get("document_id"))
+            if document is None:
+                continue
+            citations.append({
+                "source_id": None,
+                "document_id": document.document_id,
+                "document_name": document.name,
+                "page": source.get("page") or 0,
+                "text": source.get("text", ""),
+                "relevance_score": source.get("score") or 0.0
+            })
+        return citations
+
+    async def save_reply(
+        self,
+        conversation_id: int,
+        query: str,
+        answer: str,
+        citations: List[Dict[str, Any]],
+        session: AsyncSession
+    ) -> Message:
+        """Store the question, the answer and its citations; fills in each citation's source_id"""
+        try:
+            session.add(Message(conversation_id=conversation_id, role="user", content=query))
+            message = Message(conversation_id=conversation_id, role="assistant", content=answer)
+            session.add(message)
+            await session.flush()
+
+            sources = [
+                MessageSources(
+                    message_id=message.message_id,
+                    document_id=citation["document_id"],
+                    page=citation["page"],
+                    text=citation["text"],
+                    relevance_score=citation["relevance_score"]
+                )
+                for citation in citations
+            ]
+            session.add_all(sources)
+            conversation = await session.get(Conversation, conversation_id)
+            conversation.updated_at = datetime.utcnow()
+            await session.commit()
+            for citation, source in zip(citations, sources):
+                citation["source_id"] = source.source_id
+            return message
+        except Exception as e:
+            await session.rollback()
+            logging.error(f"Error saving chat reply: {str(e)}")
+            raise
+
+    async def stream_reply(
+        self,
+        user_id: int,
+        conversation_id: int,
+        query: str,
+        search_filter: SearchFilter
+    ) -> AsyncIterator[str]:
+        """Server-sent events for one answer.
+
+        `sources` (citations, before any text), then `token` events as the
+        answer is generated, then `done` with the saved message, or `error`.
+        The request's session is closed by the time the body streams, so
+        this opens its own. The agent sees the conversation's memory, which
+        is compacted once the client has its answer.
+        """
+        citations = []
+        answer = None
+        try:
+            async with async_session() as session:
+                async for event in stream_answer(query, search_filter, conversation_id):
+                    if event["event"] == "sources":
+                        citations = await self.resolve_sources(user_id, event["sources"], session)
+                        yield _sse("sources", {
+                            "conversation_id": conversation_id,
+                            "sources": [MessageSourceResponse(**citation).model_dump() for citation in citations]
+                        })
+                    elif event["event"] == "token":
+                        yield _sse("token", {"content": event["content"]})
+                    elif event["event"] == "answer":
+                        answer = event["answer"]
+
+                message = await self.save_reply(conversation_id, query, answer or "", citations, session)
+                yield _sse("done", ChatResponse(
+                    message_id=message.message_id,
+                    conversation_id=conversation_id,
+                    response=message.content,
+                    sources=[MessageSourceResponse(**citation) for citation in citations],
+                    is_off_topic=message.is_off_topic or False
+                ).model_dump())
+        except Exception as e:
+            logging.error(f"Chat stream failed: {str(e)}")
+            yield _sse("error", {"detail": "Failed to generate a response"})
+            return
+
+        try:
+            await conversation_memory.compact(conversation_id)
+        except Exception as e:
+            # The reply is saved; the summary catches up on a later turn
+            logging.error(f"Conversation memory compaction failed: {str(e)}")
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import delete, func
+from sqlalchemy.future import select
+from db.main import async_session
+from db.models import AnswerInvalidation
+import rag  # noqa: F401 - makes test_rags/ importable
+from answer_cache import AnswerCache, ANSWER_CACHE_TTL_SECONDS, source_key
+
+
+async def invalidate_answers(source_keys: List[str], session_factory=async_session) -> None:
+    """Drop cached answers built from these documents, on every node.
+
+    Recorded in the database rather than applied to a cache file, since
+    the process that changes a document (any worker) is rarely the one
+    serving its cached answers.
+    """
+    if not source_keys:
+        return
+    async with session_factory() as session:
+        try:
+            session.add_all([AnswerInvalidation(source_key=key) for key in source_keys])
+            # Entries are gone after the TTL anyway, and so may their invalidations be
+            await session.execute(
+                delete(AnswerInvalidation).where(
+                    AnswerInvalidation.created_at < datetime.utcnow() - timedelta(seconds=ANSWER_CACHE_TTL_SECONDS)
+                )
+            )
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            logging.error(f"Error recording answer invalidation: {str(e)}")
+            raise
+
+
+class SharedAnswerCache(AnswerCache):
+    """AnswerCache that honours invalidations recorded by any node.
+
+    Entries stay in this node's cache file; before each lookup and store
+    it applies the invalidations recorded since it last looked (one
+    indexed query). An answer is not stored if one of its documents was
+    invalidated after the lookup that preceded it, so answers generated
+    from a document mid-re-index never enter the cache.
+    """
+
+    def __init__(self, session_factory=async_session, **kwargs):
+        super().__init__(**kwargs)
+        self.session_factory = session_factory
+        self._seen: Optional[int] = None
+        self._catch_up_lock = asyncio.Lock()
+
+    async def _catch_up(self) -> int:
+        """Apply new invalidations; returns the id of the latest one applied"""
+        async with self._catch_up_lock:
+            async with self.session_factory() as session:
+                if self._seen is None:
+                    # Invalidations missed while this process was down are unknown; start empty
+                    latest = await session.scalar(select(func.max(AnswerInvalidation.invalidation_id)))
+                    await asyncio.to_thread(self.clear)
+                    self._seen = latest or 0
+                    return self._seen
+                rows = (await session.execute(
+                    select(AnswerInvalidation.invalidation_id, AnswerInvalidation.source_key)
+                    .where(AnswerInvalidation.invalidation_id > self._seen)
+                    .order_by(AnswerInvalidation.invalidation_id)
+                )).all()
+            if rows:
+                await asyncio.to_thread(self.invalidate, sorted({key for _, key in rows}))
+                self._seen = rows[-1][0]
+            return self._seen
+
+    async def alookup(self, query_vector: np.ndarray, scope: str = "") -> Tuple[Optional[Dict[str, Any]], Any]:
+        token = await self._catch_up()
+        hit, _ = await super().alookup(query_vector, scope)
+        return hit, token
+
+    async def aput(
+        self,
+        query: str,
+        query_vector: np.ndarray,
+        answer: str,
+        sources: List[Dict[str, Any]],
+        scope: str = "",
+        token: Any = None
+    ) -> None:
+        await self._catch_up()
+        keys = sorted({source_key(source) for source in sources})
+        if token is not None:
+            async with self.session_factory() as session:
+                changed = await session.scalar(
+                    select(func.count())
+                    .select_from(AnswerInvalidation)
+                    .where(AnswerInvalidation.invalidation_id > token)
+                    .where(AnswerInvalidation.source_key.in_(keys))
+                )
+            if changed:
+                return
+        await super().aput(query, query_vector, answer, sources, scope)
@@ -17,6 +17,18 @@ class Settings(BaseSettings):
     B2_APPLICATION_KEY_ID: str
     B2_APPLICATION_KEY: str
     B2_BUCKET_NAME: str
+    B2_MAX_CONCURRENCY: int = 10
+    UPLOAD_PART_SIZE: int = 8 * 1024 * 1024  # B2 requires parts of at least 5 MB
+    INGEST_QUEUE_SIZE: int = 4
+    INGEST_EMBED_BATCH_SIZE: int = 96
+    INGEST_WORKER_CONCURRENCY: int = 2
+    INGEST_EMBEDDED_WORKER: bool = True  # run a worker inside the API process
+    INGEST_JOB_LEASE_SECONDS: int = 120
+    INGEST_JOB_MAX_ATTEMPTS: int = 3
+    INGEST_RETRY_BACKOFF_SECONDS: int = 30
+    INGEST_POLL_INTERVAL_SECONDS: float = 2.0
+    MEMORY_WINDOW_MESSAGES: int = 6  # recent messages the agent sees verbatim
+    MEMORY_SUMMARY_BATCH: int = 4  # messages past the window before they are summarized
     
     @property
     def MONGO_URI(self) -> str:
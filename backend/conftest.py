@@ -0,0 +1,39 @@
+import os
+import pytest
+import pytest_asyncio
+
+# Settings are read when config is imported; tests never reach the services
+# behind these, but Config needs them all set
+for name in (
+    "DOMAIN", "MONGO_USERNAME", "MONGO_PASSWORD", "MONGO_CLUSTER", "MONGO_DB_NAME",
+    "JWT_SECRET_KEY", "JWT_ALGORITHM", "GOOGLE_CLIENT_ID", "MAILGUN_API_KEY", "MAILGUN_DOMAIN",
+    "B2_ENDPOINT_URL", "B2_APPLICATION_KEY_ID", "B2_APPLICATION_KEY", "B2_BUCKET_NAME"
+):
+    os.environ.setdefault(name, "test")
+os.environ.setdefault("COHERE_API_KEY", "test")
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ.setdefault("TAVILY_API_KEY", "test")
+
+# Database tests run against a disposable Postgres database, e.g.
+#   TEST_DATABASE_URL=postgresql+asyncpg://postgres@localhost/chatbot_test pytest
+# Every table in it is dropped and recreated for each test.
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+else:
+    os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://localhost/unused")
+
+
+@pytest_asyncio.fixture
+async def database():
+    """A freshly created schema in the test database"""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL not set")
+    from db.main import Base, engine, init_db
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await init_db()
+    yield engine
+    # Pooled connections belong to this test's event loop
+    await engine.dispose()
@@ -2,6 +2,7 @@ from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 from typing import AsyncGenerator
 from config import Config
+from .migrations import apply_migrations
 
 DATABASE_URL=Config.DATABASE_URL
 
@@ -33,6 +34,9 @@ async def init_db():
         # Scans for any Base models & creates them
         await conn.run_sync(Base.metadata.create_all)
 
+        # Alters tables that predate the current models
+        await apply_migrations(conn)
+
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session() as session:
         yield session
\ No newline at end of file
@@ -0,0 +1,62 @@
+import logging
+from typing import List, Tuple
+from sqlalchemy import text
+
+# Schema changes for databases created before them. init_db's create_all
+# creates missing tables but never alters an existing one, so every column or
+# index added to an existing model gets an entry here, alongside the model
+# change. Each statement is idempotent: init_db runs them all on every start,
+# after create_all (a fresh database already has everything and they no-op).
+# They are plain SQL so an operator can also apply them by hand.
+MIGRATIONS: List[Tuple[str, List[str]]] = [
+    ("processing_jobs", [
+        """
+        DO $$ BEGIN
+            CREATE TYPE jobstatus AS ENUM ('QUEUED', 'RUNNING', 'COMPLETED', 'FAILED');
+        EXCEPTION WHEN duplicate_object THEN NULL;
+        END $$
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS processing_jobs (
+            job_id VARCHAR(36) PRIMARY KEY,
+            document_id INTEGER NOT NULL REFERENCES documents (document_id) ON DELETE CASCADE,
+            status jobstatus,
+            progress INTEGER,
+            attempts INTEGER,
+            max_attempts INTEGER NOT NULL,
+            run_after TIMESTAMP WITHOUT TIME ZONE,
+            locked_by VARCHAR(100),
+            lease_expires_at TIMESTAMP WITHOUT TIME ZONE,
+            last_error TEXT,
+            created_at TIMESTAMP WITHOUT TIME ZONE,
+            updated_at TIMESTAMP WITHOUT TIME ZONE
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_processing_jobs_status ON processing_jobs (status)",
+        "CREATE INDEX IF NOT EXISTS ix_processing_jobs_run_after ON processing_jobs (run_after)",
+    ]),
+    ("documents_content_hash", [
+        "ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+        "CREATE INDEX IF NOT EXISTS ix_documents_content_hash ON documents (content_hash)",
+    ]),
+    ("conversation_memory", [
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summary TEXT",
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summarized_until TIMESTAMP WITHOUT TIME ZONE",
+        "CREATE INDEX IF NOT EXISTS ix_messages_conversation_timestamp ON messages (conversation_id, timestamp)",
+    ]),
+]
+
+# Serialises migrations when several API processes start at once
+_MIGRATION_LOCK_ID = 0x6d696772
+
+
+async def apply_migrations(conn) -> None:
+    """Bring an existing database up to the current models, within the caller's transaction"""
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": _MIGRATION_LOCK_ID})
+    for name, statements in MIGRATIONS:
+        try:
+            for statement in statements:
+                await conn.execute(text(statement))
+        except Exception as e:
+            logging.error(f"Error applying migration {name}: {str(e)}")
+            raise
@@ -1,8 +1,9 @@
 from datetime import datetime
 from enum import Enum
-from sqlalchemy import (Column, String, Integer, ForeignKey, DateTime, Boolean, Float,
-    Enum as SQLEnum, Text
+from sqlalchemy import (Column, String, Integer, BigInteger, ForeignKey, DateTime, Boolean, Float,
+    Enum as SQLEnum, Text, Index, Computed
 )
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.orm import relationship
 from .main import Base
 import uuid
@@ -23,6 +24,12 @@ class DocumentStatus(str, Enum):
     COMPLETED = "completed"
     FAILED = "failed"
 
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
 class SubscriptionStatus(str, Enum):
     ACTIVE = "active"
     PAST_DUE = "past_due"
@@ -74,6 +81,7 @@ class Document(Base):
     size = Column(Integer)  # in bytes
     file_type = Column(String(50))
     s3_url = Column(String(512))
+    content_hash = Column(String(64), index=True)  # SHA-256 of the file content
     status = Column(SQLEnum(DocumentStatus), default=DocumentStatus.UPLOADED)
     upload_date = Column(DateTime, default=datetime.utcnow)
     processed_date = Column(DateTime)
@@ -82,6 +90,26 @@ class Document(Base):
     # Relationships
     user = relationship("User", back_populates="documents")
     message_sources = relationship("MessageSources", back_populates="document")
+    jobs = relationship("ProcessingJob", back_populates="document", passive_deletes=True)
+
+class ProcessingJob(Base):
+    __tablename__ = "processing_jobs"
+    
+    job_id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    document_id = Column(Integer, ForeignKey("documents.document_id", ondelete="CASCADE"), nullable=False)
+    status = Column(SQLEnum(JobStatus), default=JobStatus.QUEUED, index=True)
+    progress = Column(Integer, default=0)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, nullable=False)
+    run_after = Column(DateTime, default=datetime.utcnow, index=True)  # earliest (re)try time
+    locked_by = Column(String(100))  # worker holding the lease
+    lease_expires_at = Column(DateTime)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Relationships
+    document = relationship("Document", back_populates="jobs")
 
 class Conversation(Base):
     __tablename__ = "conversations"
@@ -90,6 +118,8 @@ class Conversation(Base):
     user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    summary = Column(Text)  # rolling summary of the messages outside the memory window
+    summarized_until = Column(DateTime)  # timestamp of the last message folded into the summary
     
     # Relationships
     user = relationship("User", back_populates="conversations")
@@ -97,6 +127,10 @@ class Conversation(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # The conversation memory reads a conversation's latest messages
+        Index("ix_messages_conversation_timestamp", "conversation_id", "timestamp"),
+    )
     
     message_id = Column(Integer, primary_key=True, default=uuid.uuid4)
     conversation_id = Column(Integer, ForeignKey("conversations.conversation_id"), nullable=False)
@@ -163,4 +197,25 @@ class Invoice(Base):
     pdf_url = Column(String(512))
     
     # Relationships
-    user = relationship("User", back_populates="invoices")
\ No newline at end of file
+    user = relationship("User", back_populates="invoices")
+
+class LexicalChunk(Base):
+    __tablename__ = "lexical_chunks"
+    __table_args__ = (
+        Index("ix_lexical_chunks_search", "search", postgresql_using="gin"),
+    )
+    
+    chunk_id = Column(String(255), primary_key=True)  # same id as the chunk's vector
+    prefix = Column(String(64), nullable=False, index=True)  # vector_prefix of its document, or "corpus"
+    document_id = Column(Integer, index=True)  # None for the shared manuals
+    content_hash = Column(String(64), index=True)
+    text = Column(Text, nullable=False)
+    chunk_metadata = Column("metadata", JSONB, nullable=False)
+    search = Column(TSVECTOR, Computed("to_tsvector('simple', text)", persisted=True))
+
+class AnswerInvalidation(Base):
+    __tablename__ = "answer_invalidations"
+    
+    invalidation_id = Column(BigInteger, primary_key=True, autoincrement=True)  # nodes catch up in id order
+    source_key = Column(String(255), nullable=False, index=True)  # answer_cache.source_key of the changed document
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
@@ -0,0 +1,45 @@
+import pytest
+from sqlalchemy import text
+from db.migrations import apply_migrations
+
+
+async def _columns(conn, table: str):
+    result = await conn.execute(
+        text("SELECT column_name FROM information_schema.columns WHERE table_name = :table"),
+        {"table": table}
+    )
+    return set(result.scalars())
+
+
+async def _indexes(conn, table: str):
+    result = await conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :table"), {"table": table})
+    return set(result.scalars())
+
+
+@pytest.mark.asyncio
+async def test_migrations_upgrade_tables_created_before_them(database):
+    async with database.begin() as conn:
+        # As left by the schema before content hashing and conversation memory
+        await conn.execute(text("DROP INDEX ix_documents_content_hash"))
+        await conn.execute(text("ALTER TABLE documents DROP COLUMN content_hash"))
+        await conn.execute(text("DROP INDEX ix_messages_conversation_timestamp"))
+        await conn.execute(text("ALTER TABLE conversations DROP COLUMN summary, DROP COLUMN summarized_until"))
+        await conn.execute(text("DROP TABLE processing_jobs"))
+        await conn.execute(text("DROP TYPE jobstatus"))
+
+    async with database.begin() as conn:
+        await apply_migrations(conn)
+
+    async with database.connect() as conn:
+        assert "content_hash" in await _columns(conn, "documents")
+        assert "ix_documents_content_hash" in await _indexes(conn, "documents")
+        assert {"summary", "summarized_until"} <= await _columns(conn, "conversations")
+        assert "ix_messages_conversation_timestamp" in await _indexes(conn, "messages")
+        assert {"locked_by", "lease_expires_at", "run_after"} <= await _columns(conn, "processing_jobs")
+
+
+@pytest.mark.asyncio
+async def test_migrations_are_idempotent(database):
+    for _ in range(2):
+        async with database.begin() as conn:
+            await apply_migrations(conn)
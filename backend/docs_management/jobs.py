@@ -0,0 +1,295 @@
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+from sqlalchemy import and_, or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from db.main import async_session
+from db.models import Document, DocumentStatus, ProcessingJob, JobStatus
+from config import Config
+
+ProgressCallback = Callable[[int], Awaitable[None]]
+JobHandler = Callable[[ProcessingJob, ProgressCallback], Awaitable[None]]
+
+
+class JobQueue:
+    """Document processing queue persisted in the processing_jobs table.
+
+    Workers claim jobs with ``SELECT ... FOR UPDATE SKIP LOCKED`` and hold a
+    time-limited lease that they keep renewing while they work. A job whose
+    lease runs out (crashed worker, lost node) becomes claimable again, and a
+    failed job is retried with exponential backoff until max_attempts.
+    """
+
+    def __init__(
+        self,
+        lease_seconds: int = Config.INGEST_JOB_LEASE_SECONDS,
+        max_attempts: int = Config.INGEST_JOB_MAX_ATTEMPTS,
+        backoff_seconds: int = Config.INGEST_RETRY_BACKOFF_SECONDS
+    ):
+        self.lease = timedelta(seconds=lease_seconds)
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+
+    async def enqueue(self, document_id: int, session: AsyncSession) -> ProcessingJob:
+        """Queue a document for processing"""
+        job = ProcessingJob(
+            document_id=document_id,
+            status=JobStatus.QUEUED,
+            progress=0,
+            attempts=0,
+            max_attempts=self.max_attempts,
+            run_after=datetime.utcnow()
+        )
+        session.add(job)
+        await session.commit()
+        await session.refresh(job)
+        return job
+
+    async def get_job(self, job_id: str, session: AsyncSession) -> Optional[ProcessingJob]:
+        return await session.get(ProcessingJob, job_id)
+
+    async def get_latest_job(self, document_id: int, session: AsyncSession) -> Optional[ProcessingJob]:
+        result = await session.execute(
+            select(ProcessingJob)
+            .where(ProcessingJob.document_id == document_id)
+            .order_by(ProcessingJob.created_at.desc())
+            .limit(1)
+        )
+        return result.scalar_one_or_none()
+
+    async def claim(self, worker_id: str) -> Optional[ProcessingJob]:
+        """Lease the next runnable job, or return None if there is none"""
+        async with async_session() as session:
+            now = datetime.utcnow()
+            result = await session.execute(
+                select(ProcessingJob)
+                .where(or_(
+                    and_(ProcessingJob.status == JobStatus.QUEUED, ProcessingJob.run_after <= now),
+                    and_(ProcessingJob.status == JobStatus.RUNNING, ProcessingJob.lease_expires_at < now)
+                ))
+                .order_by(ProcessingJob.run_after)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            job = result.scalar_one_or_none()
+            if job is None:
+                return None
+
+            if job.attempts >= job.max_attempts:
+                # Its last worker died mid-attempt; nothing left to retry
+                job.status = JobStatus.FAILED
+                job.last_error = job.last_error or "Lease expired on final attempt"
+                await self._mark_document_failed(job.document_id, session)
+                await session.commit()
+                return None
+
+            # Compare-and-set on attempts so two workers can never both
+            # win the same job, even without row locks
+            claimed = await session.execute(
+                update(ProcessingJob)
+                .where(ProcessingJob.job_id == job.job_id)
+                .where(ProcessingJob.attempts == job.attempts)
+                .values(
+                    status=JobStatus.RUNNING,
+                    attempts=job.attempts + 1,
+                    locked_by=worker_id,
+                    lease_expires_at=now + self.lease
+                )
+            )
+            await session.commit()
+            if claimed.rowcount == 0:
+                return None
+            await session.refresh(job)
+            return job
+
+    async def heartbeat(self, job_id: str, worker_id: str, progress: Optional[int] = None) -> bool:
+        """Renew the lease (and record progress); False if the lease was lost"""
+        values = {"lease_expires_at": datetime.utcnow() + self.lease}
+        if progress is not None:
+            values["progress"] = progress
+        async with async_session() as session:
+            result = await session.execute(
+                update(ProcessingJob)
+                .where(ProcessingJob.job_id == job_id)
+                .where(ProcessingJob.locked_by == worker_id)
+                .where(ProcessingJob.status == JobStatus.RUNNING)
+                .values(**values)
+            )
+            await session.commit()
+            return result.rowcount > 0
+
+    async def complete(self, job_id: str, worker_id: str) -> bool:
+        """Mark the job done; False (and no change) if the worker no longer holds its lease"""
+        async with async_session() as session:
+            result = await session.execute(
+                update(ProcessingJob)
+                .where(ProcessingJob.job_id == job_id)
+                .where(ProcessingJob.locked_by == worker_id)
+                .where(ProcessingJob.status == JobStatus.RUNNING)
+                .values(
+                    status=JobStatus.COMPLETED,
+                    progress=100,
+                    locked_by=None,
+                    lease_expires_at=None
+                )
+            )
+            await session.commit()
+            return result.rowcount > 0
+
+    async def fail(self, job_id: str, worker_id: str, error: str) -> None:
+        """Schedule a retry with exponential backoff, or fail for good"""
+        async with async_session() as session:
+            job = await session.get(ProcessingJob, job_id)
+            if job is None or job.locked_by != worker_id:
+                return
+
+            if job.attempts < job.max_attempts:
+                delay = self.backoff_seconds * 2 ** (job.attempts - 1)
+                values = {
+                    "status": JobStatus.QUEUED,
+                    "progress": 0,
+                    "run_after": datetime.utcnow() + timedelta(seconds=delay)
+                }
+            else:
+                values = {"status": JobStatus.FAILED}
+            # Conditional, like complete: the lease may have passed to another
+            # worker since the row was read
+            result = await session.execute(
+                update(ProcessingJob)
+                .where(ProcessingJob.job_id == job_id)
+                .where(ProcessingJob.locked_by == worker_id)
+                .where(ProcessingJob.status == JobStatus.RUNNING)
+                .values(last_error=error, locked_by=None, lease_expires_at=None, **values)
+            )
+            if result.rowcount == 0:
+                await session.rollback()
+                logging.warning(f"Job {job_id} failed after its lease was lost; leaving it to its new worker")
+                return
+            if values["status"] == JobStatus.QUEUED:
+                logging.warning(f"Job {job_id} failed (attempt {job.attempts}), retrying in {delay}s")
+            else:
+                await self._mark_document_failed(job.document_id, session)
+                logging.error(f"Job {job_id} failed after {job.attempts} attempts")
+            await session.commit()
+
+    async def _mark_document_failed(self, document_id: int, session: AsyncSession) -> None:
+        await session.execute(
+            update(Document)
+            .where(Document.document_id == document_id)
+            .values(status=DocumentStatus.FAILED)
+        )
+
+
+class JobWorker:
+    """Pool of coroutines that claim jobs from a JobQueue and run a handler.
+
+    Any number of workers can run against the same database, in the API
+    process or as separate ``python worker.py`` processes on other nodes.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handler: JobHandler,
+        concurrency: int = Config.INGEST_WORKER_CONCURRENCY,
+        poll_interval: float = Config.INGEST_POLL_INTERVAL_SECONDS
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._stopping = asyncio.Event()
+        self._slots: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._stopping.clear()
+        self._slots = [
+            asyncio.create_task(self._run_slot(f"{self.worker_id}/{slot}"))
+            for slot in range(self.concurrency)
+        ]
+        logging.info(f"Job worker {self.worker_id} started with {self.concurrency} slots")
+
+    async def stop(self) -> None:
+        """Stop claiming work; jobs cut short are re-claimed once their lease expires"""
+        self._stopping.set()
+        for slot in self._slots:
+            slot.cancel()
+        await asyncio.gather(*self._slots, return_exceptions=True)
+        self._slots = []
+
+    async def run(self) -> None:
+        """Run until cancelled"""
+        self.start()
+        try:
+            await asyncio.gather(*self._slots)
+        finally:
+            await self.stop()
+
+    async def _run_slot(self, worker_id: str) -> None:
+        while not self._stopping.is_set():
+            try:
+                job = await self.queue.claim(worker_id)
+            except Exception as e:
+                logging.error(f"Failed to claim job: {str(e)}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run_job(job, worker_id)
+
+    async def _run_job(self, job: ProcessingJob, worker_id: str) -> None:
+        """Run the handler while holding the job's lease.
+
+        If a renewal finds the lease gone (it expired and another worker
+        claimed the job), the handler is cancelled rather than left to run
+        alongside the new owner, and the job's row is left to that owner.
+        """
+        lease_lost = asyncio.Event()
+
+        async def on_progress(progress: int):
+            if not await self.queue.heartbeat(job.job_id, worker_id, progress):
+                lease_lost.set()
+
+        work = asyncio.create_task(self.handler(job, on_progress))
+        heartbeat = asyncio.create_task(self._keep_lease(job.job_id, worker_id, lease_lost))
+        lost = asyncio.create_task(lease_lost.wait())
+        try:
+            await asyncio.wait({work, lost}, return_when=asyncio.FIRST_COMPLETED)
+            if not work.done():
+                logging.warning(f"Lost lease on job {job.job_id}; stopping its processing")
+                work.cancel()
+                await asyncio.gather(work, return_exceptions=True)
+                return
+            work.result()
+            if not await self.queue.complete(job.job_id, worker_id):
+                logging.warning(f"Job {job.job_id} finished after its lease was lost")
+        except Exception as e:
+            logging.error(f"Document processing failed: {str(e)}")
+            await self.queue.fail(job.job_id, worker_id, str(e))
+        finally:
+            heartbeat.cancel()
+            lost.cancel()
+            # The slot itself was cancelled (worker stopping)
+            work.cancel()
+
+    async def _keep_lease(self, job_id: str, worker_id: str, lease_lost: asyncio.Event) -> None:
+        """Renew the lease while long stages run without reporting progress"""
+        interval = self.queue.lease.total_seconds() / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if not await self.queue.heartbeat(job_id, worker_id):
+                    lease_lost.set()
+                    return
+            except Exception as e:
+                logging.error(f"Failed to renew lease on job {job_id}: {str(e)}")
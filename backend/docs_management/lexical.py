@@ -0,0 +1,105 @@
+import logging
+from functools import reduce
+from typing import List, Optional
+from langchain_core.documents import Document as LCDocument
+from sqlalchemy import delete, func, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.future import select
+from db.main import async_session
+from db.models import LexicalChunk
+import rag  # noqa: F401 - makes test_rags/ importable
+from lexical_index import query_terms
+from vector_index import SearchFilter
+
+# Rows written per INSERT statement
+_INSERT_BATCH = 500
+
+
+class PostgresLexicalIndex:
+    """Keyword search over chunk text, kept in the application database.
+
+    The backend's counterpart of LexicalIndex: a document processed by a
+    worker on any node is searchable from every API node, and deleting it
+    removes its keyword entries everywhere. Matching uses a GIN-indexed
+    tsvector; ranking is ts_rank_cd normalised by document length, which
+    plays BM25's part in the reciprocal-rank fusion.
+    """
+
+    def __init__(self, session_factory=async_session):
+        self.session_factory = session_factory
+
+    async def add_many(self, chunk_ids: List[str], documents: List[LCDocument]) -> None:
+        """Index chunks, replacing any already stored under the same ids"""
+        rows = [
+            {
+                "chunk_id": chunk_id,
+                "prefix": chunk_id.split("#", 1)[0],
+                "document_id": doc.metadata.get("document_id"),
+                "content_hash": doc.metadata.get("content_hash"),
+                # Postgres text cannot hold NUL, which PDF extraction sometimes yields
+                "text": doc.page_content.replace("\x00", ""),
+                "metadata": doc.metadata
+            }
+            for chunk_id, doc in zip(chunk_ids, documents)
+        ]
+        async with self.session_factory() as session:
+            try:
+                for start in range(0, len(rows), _INSERT_BATCH):
+                    # On the table: "metadata" names the column there, not Base.metadata
+                    statement = insert(LexicalChunk.__table__).values(rows[start:start + _INSERT_BATCH])
+                    await session.execute(statement.on_conflict_do_update(
+                        index_elements=["chunk_id"],
+                        set_={
+                            "prefix": statement.excluded.prefix,
+                            "document_id": statement.excluded.document_id,
+                            "content_hash": statement.excluded.content_hash,
+                            "text": statement.excluded.text,
+                            "metadata": statement.excluded["metadata"]
+                        }
+                    ))
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                logging.error(f"Error indexing chunk text: {str(e)}")
+                raise
+
+    async def delete_prefix(self, prefix: str) -> None:
+        """Remove every chunk whose id starts with `prefix#`"""
+        async with self.session_factory() as session:
+            await session.execute(delete(LexicalChunk).where(LexicalChunk.prefix == prefix))
+            await session.commit()
+
+    async def asearch(self, query: str, top_k: int = 4, search_filter: Optional[SearchFilter] = None) -> List[LCDocument]:
+        terms = query_terms(query)
+        if not terms or (search_filter is not None and search_filter.is_empty):
+            return []
+        # Any term may match, as in LexicalIndex
+        tsquery = reduce(
+            lambda left, right: left.op("||")(right),
+            [func.plainto_tsquery("simple", term) for term in terms]
+        )
+        rank = func.ts_rank_cd(LexicalChunk.search, tsquery, 1)
+        statement = (
+            select(LexicalChunk.chunk_id, LexicalChunk.text, LexicalChunk.chunk_metadata, rank.label("rank"))
+            .where(LexicalChunk.search.op("@@")(tsquery))
+        )
+        if search_filter is not None:
+            statement = statement.where(or_(*_filter_clauses(search_filter)))
+        async with self.session_factory() as session:
+            rows = (await session.execute(statement.order_by(rank.desc()).limit(top_k))).all()
+        return [
+            LCDocument(page_content=text, metadata={**metadata, "chunk_id": chunk_id, "bm25": float(score)})
+            for chunk_id, text, metadata, score in rows
+        ]
+
+
+def _filter_clauses(search_filter: SearchFilter):
+    """SQL conditions equivalent to SearchFilter.matches, any of which admits a chunk"""
+    clauses = []
+    if search_filter.content_hashes:
+        clauses.append(LexicalChunk.content_hash.in_(search_filter.content_hashes))
+    if search_filter.document_ids:
+        clauses.append(LexicalChunk.document_id.in_(search_filter.document_ids))
+    if search_filter.include_shared:
+        clauses.append(LexicalChunk.document_id.is_(None))
+    return clauses
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import os
+import tempfile
+from typing import Awaitable, Callable, List
+from pypdf import PdfReader
+from pinecone import Pinecone
+from langchain_core.documents import Document as LCDocument
+from config import Config
+from db.models import Document
+from .storage import ObjectStorage
+from .lexical import PostgresLexicalIndex
+import rag  # noqa: F401 - makes test_rags/ importable
+from embed_n_store import text_splitter, PINECONE_API_KEY, PINECONE_INDEX_NAME
+from embedder import embedder
+from answer_cache import ANSWER_CACHE_ENABLED
+from chat.shared_cache import invalidate_answers
+
+ProgressCallback = Callable[[int], Awaitable[None]]
+
+# Share of the progress bar reserved for fetching the file from storage;
+# the rest (up to FINAL_PROGRESS) tracks pages that reached the index.
+DOWNLOAD_PROGRESS = 10
+FINAL_PROGRESS = 95
+
+# Marks the end of the stream on every inter-stage queue
+_DONE = object()
+
+
+def vector_prefix(document: Document) -> str:
+    """Prefix of a document's vector ids.
+
+    Vectors are keyed by content hash so that identical uploads share one
+    vector set; documents stored before hashing fall back to their id.
+    """
+    return document.content_hash or str(document.document_id)
+
+
+class IngestionPipeline:
+    """Streams a stored PDF through extract -> chunk -> embed -> upsert.
+
+    Each stage runs as its own task and hands work to the next one through a
+    bounded queue, so page N+1 is extracted while page N is being embedded and
+    memory is capped by the queue sizes instead of the page count.
+
+    Every run embeds the whole document. Content that changed has a new
+    content hash, hence a new vector prefix, so there is nothing to diff
+    against; chunk-level diffing (embed_n_store) applies only to the
+    offline shared manuals.
+    """
+
+    def __init__(
+        self,
+        storage: ObjectStorage,
+        queue_size: int = Config.INGEST_QUEUE_SIZE,
+        embed_batch_size: int = Config.INGEST_EMBED_BATCH_SIZE
+    ):
+        self.storage = storage
+        self.queue_size = queue_size
+        self.embed_batch_size = embed_batch_size
+        self._index = None
+        # In the database, so API nodes see what any worker indexed
+        self.lexical = PostgresLexicalIndex()
+
+    @property
+    def index(self):
+        """Pinecone index handle, created on first use"""
+        if self._index is None:
+            self._index = Pinecone(api_key=PINECONE_API_KEY).Index(PINECONE_INDEX_NAME)
+        return self._index
+
+    async def invalidate_answers(self, prefix: str) -> None:
+        """Drop cached chat answers built from a document's previous content, on every API node"""
+        if not ANSWER_CACHE_ENABLED:
+            return
+        # Chunks carry content_hash (or document_id), matching vector_prefix
+        await invalidate_answers([prefix])
+
+    async def run(self, document: Document, on_progress: ProgressCallback) -> int:
+        """Ingest a document into the vector index and return its page count"""
+        fd, tmp_path = tempfile.mkstemp(suffix=".pdf")
+        os.close(fd)
+        try:
+            await self.invalidate_answers(vector_prefix(document))
+            await self._download(document.s3_url, tmp_path)
+            await on_progress(DOWNLOAD_PROGRESS)
+            pages = await self._run_stages(document, tmp_path, on_progress)
+            # Answers cached while the index held only part of the document
+            await self.invalidate_answers(vector_prefix(document))
+            return pages
+        finally:
+            os.remove(tmp_path)
+
+    async def delete_vectors(self, prefix: str) -> None:
+        """Remove every vector (and keyword entry) whose id starts with a document's vector_prefix"""
+        def _delete():
+            for ids in self.index.list(prefix=f"{prefix}#"):
+                if ids:
+                    self.index.delete(ids=ids)
+
+        await asyncio.to_thread(_delete)
+        await self.lexical.delete_prefix(prefix)
+        await self.invalidate_answers(prefix)
+
+    async def _download(self, file_url: str, dest_path: str) -> None:
+        """Stream the stored file to a local path"""
+        await self.storage.download_file(self.storage.key_from_url(file_url), dest_path)
+
+    async def _run_stages(
+        self,
+        document: Document,
+        file_path: str,
+        on_progress: ProgressCallback
+    ) -> int:
+        reader = await asyncio.to_thread(PdfReader, file_path)
+        total_pages = len(reader.pages)
+
+        pages_queue = asyncio.Queue(maxsize=self.queue_size)
+        chunks_queue = asyncio.Queue(maxsize=self.queue_size)
+        vectors_queue = asyncio.Queue(maxsize=self.queue_size)
+
+        tasks = [
+            asyncio.create_task(self._extract(document, reader, pages_queue)),
+            asyncio.create_task(self._chunk(pages_queue, chunks_queue)),
+            asyncio.create_task(self._embed(chunks_queue, vectors_queue)),
+            asyncio.create_task(
+                self._upsert(document, vectors_queue, total_pages, on_progress)
+            ),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # One failed stage would leave its neighbours blocked on a queue
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return total_pages
+
+    async def _extract(
+        self,
+        document: Document,
+        reader: PdfReader,
+        out_queue: asyncio.Queue
+    ) -> None:
+        """Extract page text one page at a time"""
+        total_pages = len(reader.pages)
+        for page_number in range(total_pages):
+            text = await asyncio.to_thread(reader.pages[page_number].extract_text)
+            # Identical uploads share these vectors, so user_id/document_id
+            # name the first uploader; access is checked by content_hash
+            metadata = {
+                "source": document.name,
+                "user_id": document.user_id,
+                "document_id": document.document_id,
+                "page": page_number,
+                "total_pages": total_pages
+            }
+            if document.content_hash:
+                metadata["content_hash"] = document.content_hash
+            page = LCDocument(page_content=text or "", metadata=metadata)
+            await out_queue.put(page)
+        await out_queue.put(_DONE)
+
+    async def _chunk(self, in_queue: asyncio.Queue, out_queue: asyncio.Queue) -> None:
+        """Split each page into overlapping chunks"""
+        while (page := await in_queue.get()) is not _DONE:
+            chunks = text_splitter.split_documents([page]) if page.page_content.strip() else []
+            await out_queue.put((page.metadata["page"], chunks))
+        await out_queue.put(_DONE)
+
+    async def _embed(self, in_queue: asyncio.Queue, out_queue: asyncio.Queue) -> None:
+        """Embed chunks in batches that may span several pages"""
+        pages_in_batch = 0
+        batch: List[LCDocument] = []
+
+        async def flush():
+            nonlocal pages_in_batch, batch
+            embeddings = await embedder.aembed(
+                [chunk.page_content for chunk in batch], "search_document"
+            ) if batch else []
+            await out_queue.put((pages_in_batch, batch, embeddings))
+            pages_in_batch, batch = 0, []
+
+        while (item := await in_queue.get()) is not _DONE:
+            _, chunks = item
+            pages_in_batch += 1
+            batch.extend(chunks)
+            if len(batch) >= self.embed_batch_size:
+                await flush()
+        if pages_in_batch:
+            await flush()
+        await out_queue.put(_DONE)
+
+    async def _upsert(
+        self,
+        document: Document,
+        in_queue: asyncio.Queue,
+        total_pages: int,
+        on_progress: ProgressCallback
+    ) -> None:
+        """Write embedded chunks to the vector index and report progress"""
+        pages_done = 0
+        prefix = vector_prefix(document)
+        chunk_counts = {}
+        while (item := await in_queue.get()) is not _DONE:
+            page_count, chunks, embeddings = item
+            vectors = []
+            for chunk, embedding in zip(chunks, embeddings):
+                page = chunk.metadata["page"]
+                position = chunk_counts.get(page, 0)
+                chunk_counts[page] = position + 1
+                vectors.append({
+                    "id": f"{prefix}#{page}#{position}",
+                    "values": embedding.tolist(),
+                    "metadata": {**chunk.metadata, "text": chunk.page_content}
+                })
+            if vectors:
+                await asyncio.to_thread(self.index.upsert, vectors=vectors)
+                await self.lexical.add_many([vector["id"] for vector in vectors], chunks)
+
+            pages_done += page_count
+            logging.info(f"Document {document.document_id}: indexed {pages_done}/{total_pages} pages")
+            await on_progress(
+                DOWNLOAD_PROGRESS + (FINAL_PROGRESS - DOWNLOAD_PROGRESS) * pages_done // max(total_pages, 1)
+            )
@@ -2,7 +2,6 @@ from fastapi import (APIRouter, Depends, UploadFile,
     File, HTTPException, status, Query
 )
 from fastapi.responses import JSONResponse
-from fastapi import BackgroundTasks
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
 from .service import DocumentService
@@ -20,19 +19,16 @@ document_service = DocumentService()
 @docs_router.post("/upload", response_model=DocumentResponse, status_code=status.HTTP_202_ACCEPTED)
 async def upload_document(
     file: UploadFile = File(...),
-    background_tasks: BackgroundTasks = BackgroundTasks(),
     current_user: User = Depends(get_current_user),
     session: AsyncSession = Depends(get_session)
 ):
     """Upload a document for processing"""
     try:
-        file_data = await file.read()
         result = await document_service.upload_document(
             user_id=current_user.user_id,
-            file_data=file_data,
+            file=file,
             filename=file.filename,
             file_type=file.content_type,
-            background_tasks=background_tasks,
             session=session
         )
         
@@ -61,7 +57,7 @@ async def get_task_status(
     session: AsyncSession = Depends(get_session)
 ):
     """Check processing status"""
-    progress = await DocumentService().get_processing_progress(task_id)
+    progress = await document_service.get_processing_progress(task_id, session)
     if not progress:
         raise HTTPException(status_code=404, detail="Task not found")
     
@@ -1,54 +1,38 @@
-import asyncio
 import os
-import uuid
+import hashlib
 import logging
 from datetime import datetime
-from typing import Optional, List, Dict
-from fastapi import BackgroundTasks
+from typing import Awaitable, Callable, Optional, List, Dict
+from fastapi import UploadFile
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy import func, update
-from db.models import Document, DocumentStatus
+from db.main import async_session
+from db.models import Document, DocumentStatus, ProcessingJob
 import urllib.parse
-import boto3
 from botocore.exceptions import ClientError
 from config import Config
-from botocore.client import Config as BotoConfig
-
-processing_tasks: Dict[str, Dict[str, int]] = {}
+from .jobs import JobQueue, ProgressCallback
+from .pipeline import IngestionPipeline, vector_prefix
+from .storage import ObjectStorage
+import rag  # noqa: F401 - makes test_rags/ importable
+from vector_index import SearchFilter
 
 class DocumentService:
-    def __init__(self):
-        # Initialize B2 client
-        self.b2 = boto3.client(
-            's3',
-            endpoint_url=Config.B2_ENDPOINT_URL,
-            aws_access_key_id=Config.B2_APPLICATION_KEY_ID,
-            aws_secret_access_key=Config.B2_APPLICATION_KEY,
-            config=BotoConfig(
-                signature_version='s3v4',
-                s3={
-                    'addressing_style': 'path',
-                    'payload_signing_enabled': False,
-                    'disable_content_md5': True
-                },
-                connect_timeout=30,
-                read_timeout=30,
-                parameter_validation=False,
-                inject_host_prefix=False,
-                user_agent_extra=''
-            )
-        )
-        self.bucket_name = Config.B2_BUCKET_NAME
-        self.processing_tasks = processing_tasks
+    def __init__(self, storage: Optional[ObjectStorage] = None):
+        # Non-blocking client for the Backblaze B2 bucket
+        self.storage = storage or ObjectStorage()
+        self.bucket_name = self.storage.bucket_name
+        self.part_size = Config.UPLOAD_PART_SIZE
+        self.job_queue = JobQueue()
+        self.pipeline = IngestionPipeline(self.storage)
 
     async def upload_document(
         self, 
         user_id: int, 
-        file_data: bytes,
+        file: UploadFile,
         filename: str,
         file_type: str,
-        background_tasks: BackgroundTasks,
         session: AsyncSession
     ) -> Document:
         """Handle document upload to Backblaze B2 and processing initiation"""
@@ -56,34 +40,47 @@ class DocumentService:
             # Generate unique file path
             safe_filename = urllib.parse.quote(filename)
             file_path = f"user_{user_id}/{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{safe_filename}"
-            # Upload to Backblaze B2
-            b2_url = await self._upload_to_b2(file_data, file_path, file_type)
-            print(f"B2 URL: {b2_url}")
+            # Stream to Backblaze B2, unless the same content is already stored
+            upload = await self._upload_to_b2(
+                file, file_path, file_type,
+                find_duplicate=lambda content_hash: self._find_by_content_hash(content_hash, session)
+            )
+            duplicate = upload["duplicate"]
+            print(f"B2 URL: {upload['url']}")
             # Create document record
             document = Document(
                 user_id=user_id,
                 name=filename,
-                size=len(file_data),
+                size=upload["size"],
                 file_type=file_type,
-                s3_url=b2_url,
+                s3_url=upload["url"],
+                content_hash=upload["content_hash"],
                 status=DocumentStatus.UPLOADED,
                 upload_date=datetime.utcnow()
             )
+            if duplicate and duplicate.status == DocumentStatus.COMPLETED:
+                # Chunks and vectors are keyed by content hash, so the
+                # existing set already serves this document
+                document.status = DocumentStatus.COMPLETED
+                document.processed_date = datetime.utcnow()
+                document.pages = duplicate.pages
             
             session.add(document)
             await session.commit()
             await session.refresh(document)
             
-            # Start processing task
-            task_id = await self._start_processing_task(
-                document.document_id,
-                background_tasks,
-                session
-            )
+            if document.status == DocumentStatus.COMPLETED:
+                return {
+                    "document": document,
+                    "task_id": None
+                }
+            
+            # Queue processing; any worker attached to the database picks it up
+            job = await self.job_queue.enqueue(document.document_id, session)
             
             return {
                 "document": document, 
-                "task_id": task_id
+                "task_id": job.job_id
             }
             
         except Exception as e:
@@ -91,37 +88,98 @@ class DocumentService:
             await session.rollback()
             raise
 
-    async def _upload_to_b2(self, file_data: bytes, file_path: str, content_type: str) -> str:
-        """Upload file to Backblaze B2 and return public URL"""
+    async def _upload_to_b2(
+        self,
+        file: UploadFile,
+        file_path: str,
+        content_type: str,
+        find_duplicate: Callable[[str], Awaitable[Optional[Document]]]
+    ) -> dict:
+        """Stream file to Backblaze B2 in fixed-size parts.
+
+        Only one part is held in memory at a time; the size and SHA-256 of
+        the content are computed as the parts go past. Files smaller than a
+        single part are sent with a plain put_object. Once the hash is known,
+        ``find_duplicate`` is asked for a document with the same content; if
+        there is one the upload is dropped and its blob is reused.
+        """
+        if not content_type or content_type.lower() == 'auto':
+            content_type = 'b2/x-auto'
+
+        content_hash = hashlib.sha256()
+        size = 0
+        part = await file.read(self.part_size)
+        content_hash.update(part)
+        size += len(part)
+
         try:
-            if not content_type or content_type.lower() == 'auto':
-                content_type = 'b2/x-auto'
-            
-            # Remove unsupported parameters and add B2-specific headers
-            self.b2.put_object(
-                Bucket=self.bucket_name,
-                Key=file_path,
-                Body=file_data,
-                ContentType=content_type,
-            )
-            print(f"Here i am 2...")
-            # Return public URL (Backblaze B2 format)
-            return f"{self.b2.meta.endpoint_url}/{self.bucket_name}/{file_path}"
+            if len(part) < self.part_size:
+                duplicate = await find_duplicate(content_hash.hexdigest())
+                if not duplicate:
+                    await self.storage.put_object(file_path, part, content_type)
+            else:
+                upload_id = await self.storage.create_multipart_upload(file_path, content_type)
+                try:
+                    parts = []
+                    while part:
+                        parts.append(
+                            await self.storage.upload_part(file_path, upload_id, len(parts) + 1, part)
+                        )
+                        part = await file.read(self.part_size)
+                        content_hash.update(part)
+                        size += len(part)
+                    duplicate = await find_duplicate(content_hash.hexdigest())
+                    if duplicate:
+                        await self.storage.abort_multipart_upload(file_path, upload_id)
+                    else:
+                        await self.storage.complete_multipart_upload(file_path, upload_id, parts)
+                except Exception:
+                    # Don't leave orphaned parts billed in the bucket
+                    await self.storage.abort_multipart_upload(file_path, upload_id)
+                    raise
+
+            return {
+                "url": duplicate.s3_url if duplicate else self.storage.url_for(file_path),
+                "size": size,
+                "content_hash": content_hash.hexdigest(),
+                "duplicate": duplicate
+            }
             
         except ClientError as e:
             logging.error(f"B2 upload failed: {str(e)}")
             raise Exception("Failed to upload document to storage")
 
+    async def _find_by_content_hash(
+        self,
+        content_hash: str,
+        session: AsyncSession,
+        exclude_document_id: Optional[int] = None
+    ) -> Optional[Document]:
+        """Find a stored document with the same content, preferring processed ones"""
+        query = select(Document).where(Document.content_hash == content_hash)
+        if exclude_document_id is not None:
+            query = query.where(Document.document_id != exclude_document_id)
+        result = await session.execute(
+            query
+            .order_by((Document.status == DocumentStatus.COMPLETED).desc(), Document.upload_date)
+            .limit(1)
+        )
+        return result.scalar_one_or_none()
+
+    async def _is_shared(self, column, value, document_id: int, session: AsyncSession) -> bool:
+        """Whether another document references the same blob or vector set"""
+        result = await session.execute(
+            select(func.count())
+            .select_from(Document)
+            .where(column == value)
+            .where(Document.document_id != document_id)
+        )
+        return result.scalar_one() > 0
+
     async def _delete_from_b2(self, file_url: str) -> bool:
         """Delete file from Backblaze B2"""
         try:
-            # Extract the key from the URL
-            key = file_url.split(f"{self.bucket_name}/")[-1]
-            
-            self.b2.delete_object(
-                Bucket=self.bucket_name,
-                Key=key
-            )
+            await self.storage.delete_object(self.storage.key_from_url(file_url))
             return True
             
         except ClientError as e:
@@ -140,10 +198,17 @@ class DocumentService:
             if not document:
                 return False
                 
-            # Delete from Backblaze B2
-            success = await self._delete_from_b2(document.s3_url)
-            if not success:
-                raise Exception("Failed to delete file from storage")
+            # Delete from Backblaze B2 unless a duplicate upload still uses the blob
+            if not await self._is_shared(Document.s3_url, document.s3_url, document_id, session):
+                success = await self._delete_from_b2(document.s3_url)
+                if not success:
+                    raise Exception("Failed to delete file from storage")
+            
+            # Remove its chunks from the vector index, likewise
+            if not (document.content_hash and await self._is_shared(
+                Document.content_hash, document.content_hash, document_id, session
+            )):
+                await self.pipeline.delete_vectors(vector_prefix(document))
             
             # Delete from database
             await session.delete(document)
@@ -216,126 +281,92 @@ class DocumentService:
                 
             return {
                 "status": document.status,
-                "progress": self._get_processing_progress(document_id),
+                "progress": await self._get_processing_progress(document_id, session),
                 "message": None
             }
         except Exception as e:
             logging.error(f"Error getting document status: {str(e)}")
             raise
 
-    async def _start_processing_task(
-        self, 
-        document_id: int,
-        background_tasks: BackgroundTasks,
-        session: AsyncSession
-    ) -> str:
-        """Start document processing as a background task"""
+    async def get_search_filter(
+        self,
+        user_id: int,
+        session: AsyncSession,
+        document_ids: Optional[List[int]] = None
+    ) -> SearchFilter:
+        """Retrieval filter for the chunks a user may search.
+
+        Covers the user's own documents (only `document_ids`, if given) and,
+        when no documents are singled out, the shared manuals.
+        """
         try:
-            # Create a unique task ID
-            task_id = str(uuid.uuid4())
-            
-            # Initialize progress tracking
-            self.processing_tasks[task_id] = {
-                "document_id": document_id,
-                "progress": 0,
-                "status": "queued"
-            }
-            
-            # Add to background tasks
-            background_tasks.add_task(
-                self._process_document_task,
-                document_id=document_id,
-                task_id=task_id,
-                session=session
+            query = select(Document.document_id, Document.content_hash).where(Document.user_id == user_id)
+            if document_ids:
+                query = query.where(Document.document_id.in_(document_ids))
+            rows = (await session.execute(query)).all()
+
+            return SearchFilter(
+                content_hashes=frozenset(row.content_hash for row in rows if row.content_hash),
+                # Documents stored before hashing are indexed under their own id
+                document_ids=frozenset(row.document_id for row in rows if not row.content_hash),
+                include_shared=not document_ids
             )
-            
-            return task_id
-            
         except Exception as e:
-            logging.error(f"Error starting processing task: {str(e)}")
+            logging.error(f"Error building search filter: {str(e)}")
             raise
-        
-    async def _process_document_task(
-        self,
-        document_id: int,
-        task_id: str,
-        session: AsyncSession
-    ):
-        """Background task for document processing"""
-        try:
-            # Update status to processing
-            self._update_task_progress(task_id, 10, "processing")
-            
-            # Get document from database
-            document = await self.get_document(document_id, session=session)
+
+    async def process_document(self, job: ProcessingJob, on_progress: ProgressCallback):
+        """Job handler: download, extract, chunk, embed and index a document"""
+        async with async_session() as session:
+            document = await session.get(Document, job.document_id)
             if not document:
-                self._update_task_progress(task_id, 0, "failed")
+                logging.warning(f"Document {job.document_id} no longer exists, skipping job {job.job_id}")
                 return
-
-            # Simulate processing steps (replace with actual logic)
-            await self._simulate_processing_steps(document_id, task_id, session)
             
-            # Mark as completed
-            self._update_task_progress(task_id, 100, "completed")
+            indexed = document.content_hash and await self._find_by_content_hash(
+                document.content_hash, session, exclude_document_id=document.document_id
+            )
+            if indexed and indexed.status == DocumentStatus.COMPLETED:
+                # Identical content finished indexing meanwhile; reuse its vectors
+                pages = indexed.pages
+            else:
+                document.status = DocumentStatus.PROCESSING
+                await session.commit()
+
+                pages = await self.pipeline.run(document, on_progress)
             
             # Update database status
             await session.execute(
                 update(Document)
-                .where(Document.document_id == document_id)
+                .where(Document.document_id == job.document_id)
                 .values(
                     status=DocumentStatus.COMPLETED,
-                    processed_date=datetime.utcnow()
+                    processed_date=datetime.utcnow(),
+                    pages=pages
                 )
             )
             await session.commit()
-            
-        except Exception as e:
-            logging.error(f"Document processing failed: {str(e)}")
-            self._update_task_progress(task_id, 0, "failed")
-            
-            # Update database status
-            await session.execute(
-                update(Document)
-                .where(Document.document_id == document_id)
-                .values(status=DocumentStatus.FAILED)
-            )
-            await session.commit()
-            
-    async def _simulate_processing_steps(
+
+    async def _get_processing_progress(
         self,
         document_id: int,
-        task_id: str,
         session: AsyncSession
-    ):
-        """Simulate processing steps with progress updates"""
-        steps = [
-            ("Downloading file", 20),
-            ("Extracting text", 40),
-            ("Generating embeddings", 60),
-            ("Storing in vector DB", 80),
-            ("Finalizing", 95)
-        ]
-        
-        for step_name, progress in steps:
-            logging.info(f"Processing document {document_id}: {step_name}")
-            await asyncio.sleep(2)  # Simulate work
-            self._update_task_progress(task_id, progress, "processing")
-
-    def _update_task_progress(
-        self,
-        task_id: str,
-        progress: int,
-        status: str
-    ):
-        """Update task progress in shared state"""
-        if task_id in self.processing_tasks:
-            self.processing_tasks[task_id]["progress"] = progress
-            self.processing_tasks[task_id]["status"] = status
+    ) -> Optional[int]:
+        """Progress of the most recent processing job for a document"""
+        job = await self.job_queue.get_latest_job(document_id, session)
+        return job.progress if job else None
 
     async def get_processing_progress(
         self,
-        task_id: str
+        task_id: str,
+        session: AsyncSession
     ) -> Optional[Dict[str, int]]:
         """Get current processing progress"""
-        return self.processing_tasks.get(task_id)
-    
\ No newline at end of file
+        job = await self.job_queue.get_job(task_id, session)
+        if not job:
+            return None
+        return {
+            "document_id": job.document_id,
+            "progress": job.progress,
+            "status": job.status.value
+        }
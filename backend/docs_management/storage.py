@@ -0,0 +1,116 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.client import Config as BotoConfig
+from config import Config
+
+
+class ObjectStorage:
+    """Async wrapper around an S3-compatible bucket (Backblaze B2 by default).
+
+    boto3 is blocking, so every call runs on a dedicated thread pool sized to
+    the client's connection pool. The event loop never waits on a network
+    transfer and at most ``max_concurrency`` requests are in flight per
+    process. Point ``endpoint_url`` at MinIO or moto to run against a local
+    S3 stand-in.
+    """
+
+    def __init__(
+        self,
+        endpoint_url: str = Config.B2_ENDPOINT_URL,
+        access_key_id: str = Config.B2_APPLICATION_KEY_ID,
+        secret_access_key: str = Config.B2_APPLICATION_KEY,
+        bucket_name: str = Config.B2_BUCKET_NAME,
+        max_concurrency: int = Config.B2_MAX_CONCURRENCY
+    ):
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+            config=BotoConfig(
+                signature_version='s3v4',
+                s3={
+                    'addressing_style': 'path',
+                    'payload_signing_enabled': False,
+                    'disable_content_md5': True
+                },
+                connect_timeout=30,
+                read_timeout=30,
+                max_pool_connections=max_concurrency,
+                parameter_validation=False,
+                inject_host_prefix=False,
+                user_agent_extra=''
+            )
+        )
+        self.bucket_name = bucket_name
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency,
+            thread_name_prefix="object-storage"
+        )
+
+    def url_for(self, key: str) -> str:
+        """Public URL of an object (Backblaze B2 format)"""
+        return f"{self.client.meta.endpoint_url}/{self.bucket_name}/{key}"
+
+    def key_from_url(self, url: str) -> str:
+        """Object key of a URL returned by url_for"""
+        return url.split(f"{self.bucket_name}/")[-1]
+
+    async def _run(self, method, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(method, **kwargs)
+        )
+
+    async def put_object(self, key: str, body: bytes, content_type: str) -> dict:
+        return await self._run(
+            self.client.put_object,
+            Bucket=self.bucket_name, Key=key, Body=body, ContentType=content_type
+        )
+
+    async def create_multipart_upload(self, key: str, content_type: str) -> str:
+        response = await self._run(
+            self.client.create_multipart_upload,
+            Bucket=self.bucket_name, Key=key, ContentType=content_type
+        )
+        return response["UploadId"]
+
+    async def upload_part(self, key: str, upload_id: str, part_number: int, body: bytes) -> dict:
+        """Upload one part and return its entry for complete_multipart_upload"""
+        response = await self._run(
+            self.client.upload_part,
+            Bucket=self.bucket_name, Key=key, UploadId=upload_id,
+            PartNumber=part_number, Body=body
+        )
+        return {"ETag": response["ETag"], "PartNumber": part_number}
+
+    async def complete_multipart_upload(self, key: str, upload_id: str, parts: list) -> dict:
+        return await self._run(
+            self.client.complete_multipart_upload,
+            Bucket=self.bucket_name, Key=key, UploadId=upload_id,
+            MultipartUpload={"Parts": parts}
+        )
+
+    async def abort_multipart_upload(self, key: str, upload_id: str) -> dict:
+        return await self._run(
+            self.client.abort_multipart_upload,
+            Bucket=self.bucket_name, Key=key, UploadId=upload_id
+        )
+
+    async def download_file(self, key: str, dest_path: str) -> None:
+        await self._run(
+            self.client.download_file,
+            Bucket=self.bucket_name, Key=key, Filename=dest_path
+        )
+
+    async def delete_object(self, key: str) -> dict:
+        return await self._run(
+            self.client.delete_object,
+            Bucket=self.bucket_name, Key=key
+        )
+
+    def close(self) -> None:
+        """Wait for in-flight transfers and release the thread pool"""
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,192 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import update
+from sqlalchemy.future import select
+from db.main import async_session
+from db.models import Document, DocumentStatus, JobStatus, ProcessingJob, User
+from docs_management.jobs import JobQueue, JobWorker
+
+
+async def _queued_jobs(queue: JobQueue, count: int):
+    """`count` queued jobs, each for its own document, oldest first"""
+    async with async_session() as session:
+        session.add(User(user_id=1, email="owner@example.com"))
+        session.add_all([
+            Document(document_id=i, user_id=1, name=f"manual-{i}.pdf", status=DocumentStatus.PROCESSING)
+            for i in range(1, count + 1)
+        ])
+        await session.commit()
+        jobs = []
+        for i in range(1, count + 1):
+            job = await queue.enqueue(i, session)
+            # Distinct run_after values, so claim order is predictable
+            job.run_after = datetime.utcnow() - timedelta(minutes=count - i + 1)
+            await session.commit()
+            jobs.append(job)
+        return jobs
+
+
+async def _job(job_id: str) -> ProcessingJob:
+    async with async_session() as session:
+        return await session.get(ProcessingJob, job_id)
+
+
+async def _set(job_id: str, **values) -> None:
+    async with async_session() as session:
+        await session.execute(update(ProcessingJob).where(ProcessingJob.job_id == job_id).values(**values))
+        await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_claim_skips_jobs_locked_by_another_worker(database):
+    queue = JobQueue()
+    first, second = await _queued_jobs(queue, 2)
+
+    async with async_session() as other_worker:
+        # Another worker is mid-claim on the oldest job
+        await other_worker.execute(
+            select(ProcessingJob).where(ProcessingJob.job_id == first.job_id).with_for_update()
+        )
+        claimed = await queue.claim("worker-b")
+        await other_worker.rollback()
+
+    assert claimed.job_id == second.job_id
+    assert claimed.status == JobStatus.RUNNING
+    assert claimed.locked_by == "worker-b"
+    assert claimed.attempts == 1
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_reclaimed_and_the_old_worker_shut_out(database):
+    queue = JobQueue()
+    (job,) = await _queued_jobs(queue, 1)
+    await queue.claim("worker-a")
+
+    # A live lease keeps the job away from other workers
+    assert await queue.claim("worker-b") is None
+
+    await _set(job.job_id, lease_expires_at=datetime.utcnow() - timedelta(seconds=1))
+    reclaimed = await queue.claim("worker-b")
+
+    assert reclaimed.job_id == job.job_id
+    assert reclaimed.locked_by == "worker-b"
+    assert reclaimed.attempts == 2
+    assert not await queue.heartbeat(job.job_id, "worker-a")
+    assert not await queue.complete(job.job_id, "worker-a")
+    await queue.fail(job.job_id, "worker-a", "late failure")
+    assert (await _job(job.job_id)).status == JobStatus.RUNNING
+    assert await queue.complete(job.job_id, "worker-b")
+    assert (await _job(job.job_id)).status == JobStatus.COMPLETED
+
+
+@pytest.mark.asyncio
+async def test_fail_retries_with_backoff_then_fails_the_document(database):
+    queue = JobQueue(max_attempts=2, backoff_seconds=30)
+    (job,) = await _queued_jobs(queue, 1)
+
+    await queue.claim("worker-a")
+    before = datetime.utcnow()
+    await queue.fail(job.job_id, "worker-a", "embedding timed out")
+
+    retry = await _job(job.job_id)
+    assert retry.status == JobStatus.QUEUED
+    assert retry.locked_by is None
+    assert retry.last_error == "embedding timed out"
+    assert before + timedelta(seconds=29) <= retry.run_after <= datetime.utcnow() + timedelta(seconds=30)
+    # Not runnable until the backoff has passed
+    assert await queue.claim("worker-a") is None
+
+    await _set(job.job_id, run_after=datetime.utcnow() - timedelta(seconds=1))
+    assert (await queue.claim("worker-a")).attempts == 2
+    await queue.fail(job.job_id, "worker-a", "embedding timed out again")
+
+    assert (await _job(job.job_id)).status == JobStatus.FAILED
+    async with async_session() as session:
+        assert (await session.get(Document, job.document_id)).status == DocumentStatus.FAILED
+
+
+@pytest.mark.asyncio
+async def test_lease_expiring_on_the_final_attempt_fails_the_job(database):
+    queue = JobQueue(max_attempts=1)
+    (job,) = await _queued_jobs(queue, 1)
+    await queue.claim("worker-a")
+    await _set(job.job_id, lease_expires_at=datetime.utcnow() - timedelta(seconds=1))
+
+    assert await queue.claim("worker-b") is None
+
+    failed = await _job(job.job_id)
+    assert failed.status == JobStatus.FAILED
+    assert failed.last_error == "Lease expired on final attempt"
+
+
+class _LeaseQueue:
+    """Stands in for JobQueue in worker tests: renewals succeed while `held` is True"""
+
+    def __init__(self, held: bool = True, lease_seconds: float = 0.3):
+        self.lease = timedelta(seconds=lease_seconds)
+        self.held = held
+        self.outcomes = []
+
+    async def heartbeat(self, job_id, worker_id, progress=None):
+        return self.held
+
+    async def complete(self, job_id, worker_id):
+        self.outcomes.append("complete")
+        return True
+
+    async def fail(self, job_id, worker_id, error):
+        self.outcomes.append("fail")
+
+
+def _worker(queue, handler) -> JobWorker:
+    return JobWorker(queue, handler, concurrency=1)
+
+
+@pytest.mark.asyncio
+async def test_run_job_cancels_the_handler_when_the_lease_is_lost():
+    queue = _LeaseQueue(held=False)
+    cancelled = asyncio.Event()
+
+    async def handler(job, on_progress):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    await asyncio.wait_for(_worker(queue, handler)._run_job(ProcessingJob(job_id="j1"), "worker-a/0"), 2)
+
+    assert cancelled.is_set()
+    # The job now belongs to whoever took the lease over
+    assert queue.outcomes == []
+
+
+@pytest.mark.asyncio
+async def test_run_job_stops_when_a_progress_report_finds_the_lease_lost():
+    # Renewals come too slowly to matter; the progress report notices first
+    queue = _LeaseQueue(held=False, lease_seconds=60)
+
+    async def handler(job, on_progress):
+        await on_progress(50)
+        await asyncio.sleep(10)
+
+    await asyncio.wait_for(_worker(queue, handler)._run_job(ProcessingJob(job_id="j1"), "worker-a/0"), 2)
+
+    assert queue.outcomes == []
+
+
+@pytest.mark.asyncio
+async def test_run_job_completes_or_fails_while_the_lease_is_held():
+    queue = _LeaseQueue()
+
+    async def succeed(job, on_progress):
+        await asyncio.sleep(0.2)
+
+    async def crash(job, on_progress):
+        raise ValueError("bad pdf")
+
+    await _worker(queue, succeed)._run_job(ProcessingJob(job_id="j1"), "worker-a/0")
+    await _worker(queue, crash)._run_job(ProcessingJob(job_id="j2"), "worker-a/0")
+
+    assert queue.outcomes == ["complete", "fail"]
@@ -0,0 +1,61 @@
+import pytest
+from langchain_core.documents import Document as LCDocument
+from docs_management.lexical import PostgresLexicalIndex
+import rag  # noqa: F401 - makes test_rags/ importable
+from vector_index import SearchFilter
+
+
+def _chunk(text: str, **metadata) -> LCDocument:
+    return LCDocument(page_content=text, metadata=metadata)
+
+
+@pytest.mark.asyncio
+async def test_search_ranks_matches_and_returns_chunk_ids(database):
+    index = PostgresLexicalIndex()
+    await index.add_many(
+        ["manual#1", "manual#2", "manual#3"],
+        [
+            _chunk("Run the Disk Defragmenter from System Tools", page=5),
+            _chunk("Disk Cleanup removes temporary files", page=5),
+            _chunk("Replace the printer cartridge", page=9)
+        ]
+    )
+
+    results = await index.asearch("defragmenter disk", top_k=3)
+
+    assert [doc.metadata["chunk_id"] for doc in results] == ["manual#1", "manual#2"]
+    assert results[0].metadata["page"] == 5
+
+
+@pytest.mark.asyncio
+async def test_add_many_replaces_and_delete_prefix_removes(database):
+    index = PostgresLexicalIndex()
+    await index.add_many(["doc-1#a"], [_chunk("old wording", document_id=1)])
+    await index.add_many(["doc-1#a", "other#b"], [_chunk("new wording", document_id=1), _chunk("new wording")])
+
+    assert {doc.metadata["chunk_id"] for doc in await index.asearch("new")} == {"doc-1#a", "other#b"}
+    assert await index.asearch("old") == []
+
+    await index.delete_prefix("doc-1")
+    assert [doc.metadata["chunk_id"] for doc in await index.asearch("new")] == ["other#b"]
+
+
+@pytest.mark.asyncio
+async def test_search_filter_matches_vector_filter(database):
+    index = PostgresLexicalIndex()
+    await index.add_many(
+        ["shared#1", "doc-1#1", "doc-2#1"],
+        [
+            _chunk("router reset steps", shared=True),
+            _chunk("router reset steps", document_id=1, content_hash="a" * 64),
+            _chunk("router reset steps", document_id=2, content_hash="b" * 64)
+        ]
+    )
+
+    async def visible(search_filter):
+        return {doc.metadata["chunk_id"] for doc in await index.asearch("router", 10, search_filter)}
+
+    assert await visible(SearchFilter()) == {"shared#1"}
+    assert await visible(SearchFilter(document_ids=frozenset({1}), include_shared=False)) == {"doc-1#1"}
+    assert await visible(SearchFilter(content_hashes=frozenset({"b" * 64}))) == {"shared#1", "doc-2#1"}
+    assert await visible(SearchFilter(include_shared=False)) == set()
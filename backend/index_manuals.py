@@ -0,0 +1,41 @@
+import argparse
+import asyncio
+from pathlib import Path
+from langchain_core.documents import Document as LCDocument
+from db.main import init_db
+from docs_management.lexical import PostgresLexicalIndex
+import rag
+from corpus_store import open_corpus
+from embed_n_store import MANIFEST_PATH, corpus_chunk_ids, load_manifest
+
+# Load the shared manuals' chunk text into the database keyword index, so
+# hybrid search finds them on every node. Run once per deployment, and again
+# after the manuals are re-embedded. Chunks are keyed by their vector ids
+# (taken from embed_n_store's manifest), so keyword hits join their vectors.
+#
+#   python index_manuals.py
+
+async def main(corpus_path: Path, manifest_path: Path, batch_size: int):
+    await init_db()
+    corpus = open_corpus(corpus_path)
+    chunk_ids = corpus_chunk_ids(corpus, load_manifest(manifest_path))
+    index = PostgresLexicalIndex()
+    # Replace each manual's rows whole; earlier versions keyed them by corpus row
+    for prefix in {"corpus"} | {chunk_id.split("#", 1)[0] for chunk_id in chunk_ids}:
+        await index.delete_prefix(prefix)
+    items = list(chunk_ids.items())
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        await index.add_many(
+            [chunk_id for chunk_id, _ in batch],
+            [LCDocument(page_content=corpus.text(i), metadata=corpus.metadata(i)) for _, i in batch]
+        )
+    print(f"Indexed {len(chunk_ids)} shared chunks from {corpus_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index the shared manuals for keyword search")
+    parser.add_argument("corpus", type=Path, nargs="?", default=rag.RAG_DIR / "cohere_embedded_docs.json")
+    parser.add_argument("--manifest", type=Path, default=MANIFEST_PATH)
+    parser.add_argument("--batch-size", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(main(args.corpus, args.manifest, args.batch_size))
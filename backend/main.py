@@ -1,20 +1,49 @@
+import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from auth.routes import auth_router
 from admin.routes import admin_router
 from chat.routes import chat_router
-from docs_management.routes import docs_router
+from docs_management.routes import docs_router, document_service
 from user.routes import user_router
 from db.main import init_db
 from db.mongo import initialize_blocklist
+from docs_management.jobs import JobWorker
+from docs_management.lexical import PostgresLexicalIndex
+from config import Config
+import rag  # noqa: F401
+from embed_n_retrieve import document_retriever
+from agentic_workflow import compile_graph, use_answer_cache
+from answer_cache import ANSWER_CACHE_ENABLED
+from chat.memory import conversation_memory
+from chat.shared_cache import SharedAnswerCache
 
 @asynccontextmanager 
 async def life_span(app:FastAPI):
     print(f"Server is starting...")
     await init_db()
     await initialize_blocklist()
+    # Conversation history comes from the database, shared by every worker
+    compile_graph(conversation_memory)
+    # Cached answers are dropped when a worker on any node changes their documents
+    use_answer_cache(SharedAnswerCache() if ANSWER_CACHE_ENABLED else None)
+    worker = None
+    if Config.INGEST_EMBEDDED_WORKER:
+        worker = JobWorker(document_service.job_queue, document_service.process_document)
+        worker.start()
+    # Keyword hits come from the database, which every worker writes to
+    document_retriever.use_lexical(PostgresLexicalIndex())
+    try:
+        # Build the search backend and open pooled clients once, not per query
+        await document_retriever.start()
+    except Exception as e:
+        logging.error(f"Retriever initialisation failed, deferring to first query: {str(e)}")
     yield
+    await document_retriever.close()
+    if worker:
+        await worker.stop()
+    document_service.storage.close()
     print(f"Server has been stopped")
 
 app = FastAPI(
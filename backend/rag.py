@@ -0,0 +1,10 @@
+import sys
+from pathlib import Path
+
+# The RAG modules (embedding, vector store, agent graph) live in test_rags/
+# and import each other as top-level modules, so expose that directory on
+# the import path for the backend.
+RAG_DIR = Path(__file__).resolve().parent.parent / "test_rags"
+
+if str(RAG_DIR) not in sys.path:
+    sys.path.append(str(RAG_DIR))
@@ -0,0 +1,37 @@
+import argparse
+import asyncio
+import logging
+from config import Config
+from db.main import init_db
+from docs_management.jobs import JobWorker
+from docs_management.service import DocumentService
+
+# Standalone document processing worker. Start as many of these as needed,
+# on this host or others; they share the queue through the database.
+#
+#   python worker.py --concurrency 4
+
+async def main(concurrency: int):
+    await init_db()
+    document_service = DocumentService()
+    worker = JobWorker(
+        document_service.job_queue,
+        document_service.process_document,
+        concurrency=concurrency
+    )
+    try:
+        await worker.run()
+    finally:
+        document_service.storage.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Document processing worker")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=Config.INGEST_WORKER_CONCURRENCY,
+        help="Number of documents processed at the same time"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(args.concurrency))
@@ -1,24 +1,46 @@
+import asyncio
 import os
+import uuid
 from dotenv import load_dotenv
-from typing import Annotated, Literal
+from typing import Annotated, Any, AsyncIterator, Dict, List, Literal, Optional
 from typing_extensions import TypedDict
 from langgraph.graph import StateGraph, END, START
 from langgraph.graph.message import add_messages
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langchain_groq import ChatGroq
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
 from langchain_community.tools.tavily_search import TavilySearchResults
-from embed_n_retrieve import main_retriever
+from embed_n_retrieve import document_retriever
+from vector_index import SearchFilter
+from embedder import embedder
+from answer_cache import AnswerCache, ANSWER_CACHE_ENABLED
+from context_packer import count_tokens, pack_context
+from query_router import QueryRouter, ROUTER_ENABLED
+from speculation import SpeculativeSearches, SPECULATIVE_RETRIEVAL
 from langchain_core.runnables import RunnableConfig
+from langchain_core.callbacks import adispatch_custom_event
 from langchain_core.messages import ToolMessage, AIMessage, HumanMessage
 
 # Load environment variables
 load_dotenv()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
+# Earlier turns of the conversation included in answering prompts
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "800"))
 
-# Initialize memory for context retention
-memory = MemorySaver()
+# Answers to document questions, reused for near-duplicate queries
+answer_cache = AnswerCache() if ANSWER_CACHE_ENABLED else None
+
+def use_answer_cache(cache: Optional[AnswerCache]) -> None:
+    """Serve cached answers from `cache` (None disables the cache)"""
+    global answer_cache
+    answer_cache = cache
+
+# Local route classifier; the LLM decides (and is logged) when it is unsure
+query_router = QueryRouter() if ROUTER_ENABLED else None
+
+# Retrieval started alongside the LLM routing call, used if retrieval wins
+speculative_searches = SpeculativeSearches() if SPECULATIVE_RETRIEVAL else None
 
 # Define the possible destinations
 class RouteDecision(TypedDict):
@@ -29,6 +51,10 @@ class State(TypedDict):
     messages: Annotated[list, add_messages]
     destination: RouteDecision
     answer: str
+    sources: list
+    dropped_context: list
+    speculation: Optional[str]
+    summary: str  # rolling summary of the conversation before `messages`
 
 graph_builder = StateGraph(State)
 
@@ -47,8 +73,16 @@ tools = [online_search_tool]
 llm_with_tools = rag_llm.bind_tools(tools)
 
 # Define the decision maker
-def decide_retrieval(state: State, config: RunnableConfig):
+async def decide_retrieval(state: State, config: RunnableConfig):
     user_query = state["messages"][-1].content
+    if query_router is not None and query_router.ready:
+        # The embedding is cached, so retrieval reuses it
+        query_vector = (await embedder.aembed([user_query], "search_query"))[0]
+        decision, confidence = query_router.predict(user_query, query_vector)
+        if decision:
+            print(f"Decision: {decision} (router, p={confidence:.2f})")
+            return {"destination": {"destination": decision}, "sources": [], "dropped_context": [], "speculation": None}
+
     decision_prompt = f"""
     Given the user query: "{user_query}", determine the next step.
     1. If the query requires information from the organization's documents, return "retrieval".
@@ -58,19 +92,60 @@ def decide_retrieval(state: State, config: RunnableConfig):
     Decision:
     """
     
-    response = llm_with_tools.invoke(
-        [HumanMessage(content=decision_prompt)],
-        config=config
-    )
+    # Most queries end up on the retrieval branch; search while the LLM decides
+    speculation = None
+    if speculative_searches is not None:
+        search_filter = config.get("configurable", {}).get("search_filter")
+        speculation = speculative_searches.start(
+            document_retriever.asearch(user_query, search_filter=search_filter)
+        )
+    try:
+        response = await llm_with_tools.ainvoke(
+            [HumanMessage(content=decision_prompt)],
+            config=config
+        )
+    except Exception:
+        if speculation:
+            speculative_searches.discard(speculation)
+        raise
     decision = response.content.strip().lower()
     print(f"Decision: {decision}")
-    return {"destination": {"destination": decision}}
+    if speculation and decision != "retrieval":
+        speculative_searches.discard(speculation)
+        speculation = None
+        print(f"Speculative retrieval discarded: {speculative_searches.stats()}")
+    if query_router is not None:
+        await asyncio.to_thread(query_router.record, user_query, decision)
+    # Sources are per turn; clear the previous turn's before routing
+    return {"destination": {"destination": decision}, "sources": [], "dropped_context": [], "speculation": speculation}
 
 # Define the nodes
-def retrieval_node(state: State, config: RunnableConfig):
+async def retrieval_node(state: State, config: RunnableConfig):
     user_query = state["messages"][-1].content
-    relevant_docs = main_retriever(user_query)
-    context = "\n\n".join(relevant_docs)
+    # The caller's visible documents, passed in through the run config
+    search_filter = config.get("configurable", {}).get("search_filter")
+    relevant_docs = None
+    if speculative_searches is not None and state.get("speculation"):
+        relevant_docs = await speculative_searches.claim(state["speculation"])
+        if relevant_docs is not None:
+            print(f"Speculative retrieval used: {speculative_searches.stats()}")
+    if relevant_docs is None:
+        relevant_docs = await document_retriever.asearch(user_query, search_filter=search_filter)
+    # Keep the prompt within a fixed token budget, most relevant chunks first
+    packed = pack_context(relevant_docs)
+    context = packed.text
+    if packed.dropped:
+        print(f"Context packed to {packed.tokens}/{packed.budget} tokens, left out: {packed.dropped}")
+    sources = [
+        {
+            **{key: doc.metadata[key] for key in ("source", "page", "document_id", "content_hash") if key in doc.metadata},
+            "text": doc.page_content,
+            "score": doc.metadata.get("score", doc.metadata.get("rrf_score"))
+        }
+        for doc in packed.included
+    ]
+    # Lets streaming callers show citations before the answer is generated
+    await adispatch_custom_event("sources", {"sources": sources}, config=config)
 
     augmented_query = f"""
     You are an Engineering Support AI Chatbot, a specialized assistant designed to provide
@@ -81,15 +156,22 @@ def retrieval_node(state: State, config: RunnableConfig):
     ---------------------
     Context: {context}
     ---------------------
+    Conversation so far: {_history(state) or "(none)"}
+    ---------------------
     Question: {user_query}"""
 
-    response = rag_llm.invoke(
+    response = await rag_llm.ainvoke(
         [HumanMessage(content=augmented_query)],
         config=config
     )
-    return {"messages": [response], "answer": response.content}
+    return {
+        "messages": [response],
+        "answer": response.content,
+        "sources": sources,
+        "dropped_context": packed.dropped
+    }
 
-def chatbot_node(state: State, config: RunnableConfig):
+async def chatbot_node(state: State, config: RunnableConfig):
     user_query = None
     # Find the last human message (original query)
     for msg in reversed(state["messages"]):
@@ -113,44 +195,56 @@ def chatbot_node(state: State, config: RunnableConfig):
         """
     else:
         augmented_query = user_query
+    history = _history(state)
+    if history:
+        augmented_query = f"""
+        Conversation so far:
+        {history}
+
+        {augmented_query}
+        """
 
-    response = rag_llm.invoke(
+    response = await rag_llm.ainvoke(
         [HumanMessage(content=augmented_query)],
         config=config
     )
     return {"messages": [response], "answer": response.content}
 
-def generate_tool_calls(state: State, config: RunnableConfig):
+async def generate_tool_calls(state: State, config: RunnableConfig):
     user_query = state["messages"][-1].content
-    response = llm_with_tools.invoke(
+    response = await llm_with_tools.ainvoke(
         [HumanMessage(content=user_query)],
         config=config
     )
     return {"messages": [response]}
 
-def tool_node(state: State):
+async def tool_node(state: State):
     # Get the last AI message which should contain tool calls
     last_message = state["messages"][-1]
     if not isinstance(last_message, AIMessage) or not last_message.tool_calls:
         raise ValueError("Last message must be an AIMessage with tool calls")
     
-    # Call the tools and collect results
+    # Call the tools concurrently and collect results
+    search_calls = [
+        tool_call for tool_call in last_message.tool_calls
+        if tool_call["name"] == "tavily_search_results_json"
+    ]
+    results = await asyncio.gather(
+        *(online_search_tool.ainvoke(tool_call["args"]) for tool_call in search_calls)
+    )
     tool_messages = []
     search_results = []
-    for tool_call in last_message.tool_calls:
-        if tool_call["name"] == "tavily_search_results_json":
-            # Call the search tool
-            result = online_search_tool.invoke(tool_call["args"])
-            print(f"SEARCH RESULT: {result}\n")
-            search_results.extend(result)
-            # Create proper ToolMessage objects
-            tool_messages.append(
-                ToolMessage(
-                    content=str(result),
-                    name=tool_call["name"],
-                    tool_call_id=tool_call["id"]
-                )
+    for tool_call, result in zip(search_calls, results):
+        print(f"SEARCH RESULT: {result}\n")
+        search_results.extend(result)
+        # Create proper ToolMessage objects
+        tool_messages.append(
+            ToolMessage(
+                content=str(result),
+                name=tool_call["name"],
+                tool_call_id=tool_call["id"]
             )
+        )
     
     # Return both the tool messages and search results
     return {
@@ -158,6 +252,47 @@ def tool_node(state: State):
         "search_results": search_results
     }
 
+def _history(state: State) -> str:
+    """Earlier turns for the prompt: the rolling summary, then the most recent
+    exchanges that fit in HISTORY_TOKEN_BUDGET (tool traffic left out)"""
+    messages = state["messages"]
+    current = max(
+        (i for i, msg in enumerate(messages) if isinstance(msg, HumanMessage)),
+        default=len(messages)
+    )
+    summary = state.get("summary") or ""
+    budget = HISTORY_TOKEN_BUDGET - (count_tokens(summary) if summary else 0)
+    turns = []
+    for msg in reversed(messages[:current]):
+        if isinstance(msg, HumanMessage):
+            line = f"User: {msg.content}"
+        elif isinstance(msg, AIMessage) and msg.content and not msg.tool_calls:
+            line = f"Assistant: {msg.content}"
+        else:
+            continue
+        budget -= count_tokens(line)
+        if budget < 0:
+            break
+        turns.append(line)
+    lines = ([f"(Summary of earlier messages) {summary}"] if summary else []) + turns[::-1]
+    return "\n".join(lines)
+
+async def summarize_conversation(summary: str, messages: List[BaseMessage]) -> str:
+    """`summary` extended with `messages`, for conversation memory to keep in place of them"""
+    transcript = "\n".join(
+        f"{'User' if isinstance(msg, HumanMessage) else 'Assistant'}: {msg.content}"
+        for msg in messages
+    )
+    summary_prompt = f"""
+    Summary of the conversation so far: {summary or "(none)"}
+    New messages:
+    {transcript}
+    Rewrite the summary to include the new messages in at most 150 words. Keep the equipment,
+    error codes, steps already tried and open questions; drop pleasantries. Only respond with the summary.
+    """
+    response = await rag_llm.ainvoke([HumanMessage(content=summary_prompt)])
+    return response.content.strip()
+
 # Define the routing logic
 def select_node(state: State) -> Literal["retrieval_node", "chatbot_node", "generate_tool_calls"]:
     dest = state["destination"]["destination"]
@@ -185,26 +320,158 @@ graph_builder.add_edge("tools", "chatbot_node")
 graph_builder.add_edge("retrieval_node", END)
 graph_builder.add_edge("chatbot_node", END)
 
+def compile_graph(checkpointer: Optional[BaseCheckpointSaver] = None):
+    """(Re)compile the graph with conversation memory from `checkpointer`.
+
+    Without one every run starts from just the question; the backend
+    compiles it with its database-backed conversation memory at startup.
+    """
+    global graph
+    graph = graph_builder.compile(checkpointer=checkpointer)
+    return graph
+
 # Compile the graph
-graph = graph_builder.compile(checkpointer=memory)
+graph = compile_graph()
 
 # Simplified run function
 # Run function
-def run_agent(input_message):
-    config = {"configurable": {"thread_id": "user_1"}}
+async def run_agent(input_message, search_filter: Optional[SearchFilter] = None, conversation_id: Optional[int] = None):
+    return (await answer_query(input_message, search_filter, conversation_id))["answer"]
+
+async def answer_query(
+    input_message,
+    search_filter: Optional[SearchFilter] = None,
+    conversation_id: Optional[int] = None
+) -> Dict[str, Any]:
+    """Run the agent and return its answer with the document chunks it used.
+
+    Retrieval only sees the documents `search_filter` allows. Answers
+    grounded in documents (the retrieval route) depend only on the query
+    and those documents, so they are cached per visible set; a later query
+    whose embedding is close enough gets the stored answer without running
+    the graph.
+
+    With a checkpointer compiled in, the graph sees the earlier turns of
+    `conversation_id` (summary plus recent messages); without an id the
+    run has no history. An answer written with history in its prompt may
+    depend on it, so the cache is neither read nor written for a
+    conversation that has any.
+
+    Every LLM call, search and cache access is awaited or run in a worker
+    thread, so one event loop can serve many conversations at once.
+    """
+    cacheable = not await _has_history(conversation_id)
+    hit, query_vector, token = await _cached_answer(input_message, search_filter, cacheable)
+    if hit:
+        return hit
+
+    answer = await _run_graph(input_message, search_filter, conversation_id)
+    if isinstance(answer, dict):
+        await _cache_answer(input_message, query_vector, answer, search_filter, token)
+        return {**answer, "cached": False}
+    return {"answer": answer, "sources": [], "cached": False}
+
+async def stream_answer(
+    input_message,
+    search_filter: Optional[SearchFilter] = None,
+    conversation_id: Optional[int] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """Run the agent, yielding its answer as it is generated.
+
+    Yields {"event": "sources", "sources": [...]} as soon as retrieval has
+    picked the chunks, {"event": "token", "content": ...} for each piece
+    of the answer, and finally {"event": "answer", ...} with the same
+    fields answer_query returns. Cached answers arrive as one token, and
+    are only used as answer_query uses them.
+    """
+    cacheable = not await _has_history(conversation_id)
+    hit, query_vector, token = await _cached_answer(input_message, search_filter, cacheable)
+    if hit:
+        yield {"event": "sources", "sources": hit["sources"]}
+        yield {"event": "token", "content": hit["answer"]}
+        yield {"event": "answer", **hit}
+        return
+
+    config = _graph_config(search_filter, conversation_id)
+    state = {"messages": [HumanMessage(content=input_message)]}
+    output = {}
+    async for event in graph.astream_events(state, config=config, version="v2"):
+        if event["event"] == "on_chain_end" and not event["parent_ids"]:
+            # The graph's own run ends last, with the final state
+            output = event["data"].get("output") or {}
+        elif event["event"] == "on_custom_event" and event["name"] == "sources":
+            yield {"event": "sources", "sources": event["data"]["sources"]}
+        elif (
+            event["event"] == "on_chat_model_stream"
+            # Routing and tool-call generation also run the LLM; only the answering nodes speak
+            and event["metadata"].get("langgraph_node") in ("retrieval_node", "chatbot_node")
+            and event["data"]["chunk"].content
+        ):
+            yield {"event": "token", "content": event["data"]["chunk"].content}
+
+    answer = {"answer": output.get("answer", ""), "sources": output.get("sources") or []}
+    await _cache_answer(input_message, query_vector, answer, search_filter, token)
+    yield {"event": "answer", **answer, "cached": False}
+
+async def _has_history(conversation_id: Optional[int]) -> bool:
+    """Whether the graph will see earlier turns of this conversation"""
+    if conversation_id is None or graph.checkpointer is None:
+        return False
+    saved = await graph.checkpointer.aget_tuple(_graph_config(None, conversation_id))
+    values = saved.checkpoint["channel_values"] if saved else {}
+    return bool(values.get("messages") or values.get("summary"))
+
+async def _cached_answer(input_message, search_filter: Optional[SearchFilter], cacheable: bool = True):
+    """Cached answer for a near-duplicate query (or None), the query's embedding
+    (None when not cacheable) and the cache's token for storing the new answer"""
+    if answer_cache is None or not cacheable:
+        return None, None, None
+    scope = search_filter.key if search_filter is not None else ""
+    query_vector = (await embedder.aembed([input_message], "search_query"))[0]
+    hit, token = await answer_cache.alookup(query_vector, scope)
+    if not hit:
+        return None, query_vector, token
+    print(f"Answer cache hit ({hit['similarity']:.3f}): {hit['matched_query']}")
+    return {"answer": hit["answer"], "sources": hit["sources"], "cached": True}, query_vector, token
+
+async def _cache_answer(
+    input_message,
+    query_vector,
+    answer: Dict[str, Any],
+    search_filter: Optional[SearchFilter],
+    token: Any = None
+):
+    # No embedding means the lookup was skipped, and the answer must not be stored either
+    if answer_cache is not None and query_vector is not None and answer["sources"]:
+        scope = search_filter.key if search_filter is not None else ""
+        await answer_cache.aput(
+            input_message, query_vector, answer["answer"], answer["sources"], scope, token
+        )
+
+def _graph_config(search_filter: Optional[SearchFilter] = None, conversation_id: Optional[int] = None) -> Dict[str, Any]:
+    # One thread per conversation; a run outside any conversation gets a throwaway thread
+    thread_id = str(conversation_id) if conversation_id is not None else f"run-{uuid.uuid4()}"
+    return {"configurable": {"thread_id": thread_id, "search_filter": search_filter}}
+
+async def _run_graph(
+    input_message,
+    search_filter: Optional[SearchFilter] = None,
+    conversation_id: Optional[int] = None
+):
+    config = _graph_config(search_filter, conversation_id)
     state = {"messages": [HumanMessage(content=input_message)]}
     while True:
-        output = graph.invoke(state, config=config)
+        output = await graph.ainvoke(state, config=config)
         # print("Output:", output)
         if "answer" in output:
-            return output["answer"]
+            return {"answer": output["answer"], "sources": output.get("sources") or []}
         elif "tool_code" in output:
             return f"Tool Result: {output['tool_code']}"
         elif isinstance(output, dict) and "messages" in output and isinstance(output["messages"][-1], AIMessage):
             return output["messages"][-1].content
         elif isinstance(output, dict) and "destination" in output and output["destination"]["destination"] == "tools":
             # LLM needs to decide which tool to use
-            llm_response = llm_with_tools.invoke(state["messages"])
+            llm_response = await llm_with_tools.ainvoke(state["messages"])
             state["messages"].append(llm_response)
         elif isinstance(output, dict) and "destination" in output:
             state["destination"] = output["destination"]
@@ -226,7 +493,7 @@ if __name__ == "__main__":
         "Who is Davido?"
     ]
     for user_input in test_cases:
-        response = run_agent(user_input)
+        response = asyncio.run(run_agent(user_input))
         print("\nUser Question:", user_input)
         print("Response:", response)
         print("\n")
\ No newline at end of file
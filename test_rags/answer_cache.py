@@ -0,0 +1,212 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import numpy as np
+from dotenv import load_dotenv
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+load_dotenv()
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_PATH = Path(os.getenv(
+    "ANSWER_CACHE_PATH", Path(__file__).parent / "answer_cache.sqlite"
+))
+ANSWER_CACHE_CAPACITY = int(os.getenv("ANSWER_CACHE_CAPACITY", "1000"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+# Cosine similarity a new query needs with a cached one to reuse its answer
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+
+def source_key(metadata: Dict[str, Any]) -> str:
+    """Identity of the document a chunk came from, as used for invalidation.
+
+    Uploaded documents are keyed like their vectors (content hash, else
+    document id); files ingested by embed_n_store by their path.
+    """
+    return str(metadata.get("content_hash") or metadata.get("document_id") or metadata.get("source"))
+
+
+class AnswerCache:
+    """Answers to earlier questions, looked up by query-embedding similarity.
+
+    Entries live in SQLite so ingestion scripts in other processes can
+    invalidate them; queries are matched against an in-memory matrix of the
+    cached query embeddings, reloaded only when the file changes (SQLite's
+    data_version) or this process adds or removes entries. An entry is
+    dropped when any document it was answered from changes, when it is
+    older than `ttl_seconds`, or when it is the least recently used one
+    beyond `capacity`. Entries are partitioned by `scope` (e.g. the
+    documents a caller may see) and never served across scopes.
+    """
+
+    def __init__(
+        self,
+        path: Path = ANSWER_CACHE_PATH,
+        capacity: int = ANSWER_CACHE_CAPACITY,
+        ttl_seconds: int = ANSWER_CACHE_TTL_SECONDS,
+        threshold: float = ANSWER_CACHE_THRESHOLD
+    ):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS answers (
+                answer_id TEXT PRIMARY KEY,
+                scope TEXT NOT NULL,
+                query TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used);
+            CREATE TABLE IF NOT EXISTS answer_sources (
+                answer_id TEXT NOT NULL REFERENCES answers (answer_id) ON DELETE CASCADE,
+                source_key TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS answer_sources_key ON answer_sources (source_key);
+        """)
+        self._db.commit()
+        self._version = None
+        self._ids: List[str] = []
+        self._scopes = np.empty(0, dtype=object)
+        self._created = np.empty(0)
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _refresh(self) -> None:
+        """Reload the embedding matrix if the table changed since the last load"""
+        version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._version:
+            return
+        rows = self._db.execute("SELECT answer_id, scope, embedding, created_at FROM answers").fetchall()
+        self._ids = [row[0] for row in rows]
+        self._scopes = np.array([row[1] for row in rows], dtype=object)
+        self._created = np.array([row[3] for row in rows])
+        self._matrix = (
+            np.stack([np.frombuffer(row[2], dtype=np.float32) for row in rows])
+            if rows else np.empty((0, 0), dtype=np.float32)
+        )
+        self._version = version
+
+    def _changed(self) -> None:
+        # data_version only reflects other connections' commits
+        self._version = None
+
+    def lookup(self, query_vector: np.ndarray, scope: str = "") -> Optional[Dict[str, Any]]:
+        """Return the cached answer and sources for a near-duplicate query, if any"""
+        query = self._normalize(query_vector)
+        with self._lock:
+            self._refresh()
+            if not self._ids:
+                return None
+            scores = self._matrix @ query
+            fresh = self._created > time.time() - self.ttl_seconds
+            scores[~fresh | (self._scopes != scope)] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+
+            answer_id = self._ids[best]
+            row = self._db.execute(
+                "SELECT query, answer, sources FROM answers WHERE answer_id = ?", (answer_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE answers SET last_used = ? WHERE answer_id = ?", (time.time(), answer_id))
+            self._db.commit()
+        return {
+            "answer": row[1],
+            "sources": json.loads(row[2]),
+            "matched_query": row[0],
+            "similarity": float(scores[best])
+        }
+
+    def put(
+        self,
+        query: str,
+        query_vector: np.ndarray,
+        answer: str,
+        sources: List[Dict[str, Any]],
+        scope: str = ""
+    ) -> None:
+        now = time.time()
+        answer_id = str(uuid.uuid4())
+        keys = sorted({source_key(source) for source in sources})
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (answer_id, scope, query, self._normalize(query_vector).tobytes(),
+                 answer, json.dumps(sources), now, now)
+            )
+            self._db.executemany(
+                "INSERT INTO answer_sources (answer_id, source_key) VALUES (?, ?)",
+                [(answer_id, key) for key in keys]
+            )
+            self._db.execute("DELETE FROM answers WHERE created_at <= ?", (now - self.ttl_seconds,))
+            self._db.execute(
+                "DELETE FROM answers WHERE answer_id IN ("
+                "SELECT answer_id FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.capacity,)
+            )
+            self._db.commit()
+            self._changed()
+
+    async def alookup(self, query_vector: np.ndarray, scope: str = "") -> Tuple[Optional[Dict[str, Any]], Any]:
+        """lookup without blocking the event loop, plus a token to hand to aput.
+
+        The token marks what the cache knew when the answer was looked up,
+        so a subclass can refuse an answer whose documents changed while it
+        was being generated.
+        """
+        return await asyncio.to_thread(self.lookup, query_vector, scope), None
+
+    async def aput(
+        self,
+        query: str,
+        query_vector: np.ndarray,
+        answer: str,
+        sources: List[Dict[str, Any]],
+        scope: str = "",
+        token: Any = None
+    ) -> None:
+        await asyncio.to_thread(self.put, query, query_vector, answer, sources, scope)
+
+    def invalidate(self, source_keys: List[str]) -> int:
+        """Drop every answer built from any of these documents; returns how many"""
+        if not source_keys:
+            return 0
+        with self._lock:
+            placeholders = ",".join("?" * len(source_keys))
+            deleted = self._db.execute(
+                f"DELETE FROM answers WHERE answer_id IN ("
+                f"SELECT answer_id FROM answer_sources WHERE source_key IN ({placeholders}))",
+                list(source_keys)
+            ).rowcount
+            self._db.commit()
+            self._changed()
+        return deleted
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM answers")
+            self._db.commit()
+            self._changed()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,6 @@
+import os
+
+# Modules build their API clients at import; tests stub every call, but the
+# clients still need keys to construct
+for name in ("COHERE_API_KEY", "GROQ_API_KEY", "TAVILY_API_KEY", "PINECONE_API_KEY"):
+    os.environ.setdefault(name, "test")
@@ -0,0 +1,107 @@
+import os
+import re
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+from typing import Any, Callable, Dict, List
+from langchain_core.documents import Document
+from rerank import overlapping_spans
+
+load_dotenv()
+
+# Tokens of retrieved context allowed in the RAG prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# A chunk is cut to fit the remaining budget only if at least this much is left
+MIN_PARTIAL_TOKENS = 100
+SEPARATOR = "\n\n"
+
+
+def count_tokens(text: str) -> int:
+    """Approximate token count (~4 characters per token for English technical prose).
+
+    The generation model's tokenizer is not available offline; pass a
+    real counter to pack_context where exact counts matter.
+    """
+    return len(text) // 4 + 1
+
+
+@dataclass
+class PackedContext:
+    """Context text for the prompt and an account of what did not fit"""
+    text: str
+    tokens: int
+    budget: int
+    included: List[Document] = field(default_factory=list)
+    dropped: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def _describe(doc: Document, tokens: int, reason: str) -> Dict[str, Any]:
+    return {
+        "source": doc.metadata.get("source"),
+        "page": doc.metadata.get("page"),
+        "tokens": tokens,
+        "reason": reason
+    }
+
+
+def _truncate(text: str, max_tokens: int, count: Callable[[str], int]) -> str:
+    """Longest prefix within max_tokens, cut at a sentence (else word) boundary"""
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    prefix = text[:low]
+    sentence_ends = [m.end() for m in re.finditer(r"[.!?](\s|$)", prefix)]
+    if sentence_ends and sentence_ends[-1] > len(prefix) // 2:
+        return prefix[:sentence_ends[-1]].rstrip()
+    return prefix.rsplit(" ", 1)[0] if " " in prefix else prefix
+
+
+def pack_context(
+    documents: List[Document],
+    budget: int = CONTEXT_TOKEN_BUDGET,
+    count: Callable[[str], int] = count_tokens
+) -> PackedContext:
+    """Fill a token budget with retrieved chunks, most relevant first.
+
+    `documents` must be in relevance order. Overlapping or nested windows
+    of the same page are first merged into one span so shared text is paid
+    for once. Spans are then taken in that order: a span that fits is added
+    whole; one that does not is cut at a sentence boundary if at least
+    MIN_PARTIAL_TOKENS remain, and otherwise dropped, while later (smaller)
+    spans may still fill what is left. Cut and dropped spans are reported.
+    """
+    packed = PackedContext(text="", tokens=0, budget=budget)
+    separator_tokens = count(SEPARATOR)
+    parts = []
+    for text, members in overlapping_spans(documents):
+        lead = documents[min(members)]
+        metadata = dict(lead.metadata)
+        if len(members) > 1:
+            metadata["merged_chunks"] = len(members)
+        span = Document(page_content=text, metadata=metadata)
+
+        tokens = count(text)
+        cost = tokens + (separator_tokens if parts else 0)
+        remaining = budget - packed.tokens
+        if cost <= remaining:
+            parts.append(text)
+            packed.tokens += cost
+            packed.included.append(span)
+            continue
+
+        room = remaining - (separator_tokens if parts else 0)
+        if room >= MIN_PARTIAL_TOKENS:
+            cut = _truncate(text, room, count)
+            if cut:
+                parts.append(cut)
+                packed.tokens += count(cut) + (separator_tokens if len(parts) > 1 else 0)
+                packed.included.append(Document(page_content=cut, metadata={**metadata, "truncated": True}))
+                packed.dropped.append(_describe(span, tokens - count(cut), "truncated"))
+                continue
+        packed.dropped.append(_describe(span, tokens, "over budget"))
+
+    packed.text = SEPARATOR.join(parts)
+    return packed
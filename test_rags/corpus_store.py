@@ -0,0 +1,334 @@
+import argparse
+import json
+import mmap
+import os
+import shutil
+import time
+import numpy as np
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+# Binary corpus layout (one directory per corpus):
+#   manifest.json        counts, dtype, dimension, per-document shared metadata
+#   embeddings.npy       (count, dimension) float16/float32 matrix, memory-mapped on load
+#   documents.npy        int32 document index of every chunk
+#   pages.npy            int32 page of every chunk
+#   texts.bin            UTF-8 chunk texts back to back
+#   text_offsets.npy     int64 offsets into texts.bin (count + 1 entries)
+#   extras.bin           JSON of per-chunk metadata that differs from its document's
+#   extra_offsets.npy    int64 offsets into extras.bin (count + 1 entries)
+CORPUS_VERSION = 1
+
+# Metadata that varies chunk to chunk and is never folded into the document
+_PER_CHUNK_KEYS = {"page", "page_label", "embedding", "embedding_time"}
+
+
+class CorpusWriter:
+    """Appends chunks to a binary corpus one at a time, in constant memory"""
+
+    def __init__(self, path: Path, dimension: int, dtype: str = "float16", metadata: Dict[str, Any] = None):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dimension = dimension
+        self.dtype = np.dtype(dtype)
+        self.metadata = metadata or {}
+        self.count = 0
+        self.documents = []
+        self._document_of_chunk = []
+        self._pages = []
+        self._embeddings = open(self.path / "embeddings.raw", "wb")
+        self._texts = open(self.path / "texts.bin", "wb")
+        self._extras = open(self.path / "extras.bin", "wb")
+        self._text_offsets = [0]
+        self._extra_offsets = [0]
+
+    def add_document(self, file: str, page_count: Optional[int] = None, metadata: Dict[str, Any] = None) -> int:
+        self.documents.append({
+            "file": file,
+            "page_count": page_count,
+            "chunk_count": 0,
+            "metadata": metadata
+        })
+        return len(self.documents) - 1
+
+    def append(self, document: int, text: str, metadata: Dict[str, Any], embedding) -> None:
+        doc = self.documents[document]
+        if doc["metadata"] is None:
+            # The first chunk defines what the document's chunks share
+            doc["metadata"] = {k: v for k, v in metadata.items() if k not in _PER_CHUNK_KEYS}
+        extras = {
+            k: v for k, v in metadata.items()
+            if k not in ("page", "embedding") and doc["metadata"].get(k, object()) != v
+        }
+
+        vector = np.asarray(embedding, dtype=self.dtype)
+        if vector.shape != (self.dimension,):
+            raise ValueError(f"Expected a {self.dimension}-d embedding, got shape {vector.shape}")
+        self._embeddings.write(vector.tobytes())
+
+        text_bytes = text.encode("utf-8")
+        self._texts.write(text_bytes)
+        self._text_offsets.append(self._text_offsets[-1] + len(text_bytes))
+
+        extra_bytes = json.dumps(extras, separators=(",", ":")).encode("utf-8") if extras else b""
+        self._extras.write(extra_bytes)
+        self._extra_offsets.append(self._extra_offsets[-1] + len(extra_bytes))
+
+        self._document_of_chunk.append(document)
+        self._pages.append(metadata.get("page", -1))
+        doc["chunk_count"] += 1
+        self.count += 1
+
+    def close(self) -> None:
+        self._embeddings.close()
+        self._texts.close()
+        self._extras.close()
+
+        # Prepend an .npy header to the raw matrix so np.load can memory-map it
+        raw_path = self.path / "embeddings.raw"
+        header = {
+            "descr": np.lib.format.dtype_to_descr(self.dtype),
+            "fortran_order": False,
+            "shape": (self.count, self.dimension)
+        }
+        with open(self.path / "embeddings.npy", "wb") as out, open(raw_path, "rb") as raw:
+            np.lib.format.write_array_header_1_0(out, header)
+            shutil.copyfileobj(raw, out, length=1 << 20)
+        os.remove(raw_path)
+
+        np.save(self.path / "documents.npy", np.asarray(self._document_of_chunk, dtype=np.int32))
+        np.save(self.path / "pages.npy", np.asarray(self._pages, dtype=np.int32))
+        np.save(self.path / "text_offsets.npy", np.asarray(self._text_offsets, dtype=np.int64))
+        np.save(self.path / "extra_offsets.npy", np.asarray(self._extra_offsets, dtype=np.int64))
+        with open(self.path / "manifest.json", "w") as f:
+            json.dump({
+                "version": CORPUS_VERSION,
+                "count": self.count,
+                "dimension": self.dimension,
+                "dtype": self.dtype.name,
+                "metadata": self.metadata,
+                "documents": self.documents
+            }, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Corpus:
+    """Read-only view of a binary corpus.
+
+    Opening one reads only the manifest; the embedding matrix, the offset
+    tables and the text blobs are memory-mapped, so loading takes
+    milliseconds and no array is copied until it is used.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path / "manifest.json") as f:
+            self.manifest = json.load(f)
+        if self.manifest["version"] != CORPUS_VERSION:
+            raise ValueError(f"Unsupported corpus version {self.manifest['version']}")
+        self.documents = self.manifest["documents"]
+        self.embeddings = np.load(self.path / "embeddings.npy", mmap_mode="r")
+        self.document_index = np.load(self.path / "documents.npy", mmap_mode="r")
+        self.pages = np.load(self.path / "pages.npy", mmap_mode="r")
+        self._text_offsets = np.load(self.path / "text_offsets.npy", mmap_mode="r")
+        self._extra_offsets = np.load(self.path / "extra_offsets.npy", mmap_mode="r")
+        self._texts = self._map(self.path / "texts.bin")
+        self._extras = self._map(self.path / "extras.bin")
+
+    @staticmethod
+    def _map(path: Path):
+        with open(path, "rb") as f:
+            # mmap rejects empty files
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b""
+
+    def __len__(self) -> int:
+        return self.manifest["count"]
+
+    def text(self, i: int) -> str:
+        return self._texts[self._text_offsets[i]:self._text_offsets[i + 1]].decode("utf-8")
+
+    def metadata(self, i: int) -> Dict[str, Any]:
+        document = self.documents[self.document_index[i]]
+        metadata = {**document["metadata"], "page": int(self.pages[i])}
+        extra = self._extras[self._extra_offsets[i]:self._extra_offsets[i + 1]]
+        if extra:
+            metadata.update(json.loads(extra))
+        return metadata
+
+
+class _JsonStream:
+    """Minimal incremental reader for documents shaped like cohere_embedded_docs.json.
+
+    Walks the outer objects and arrays by hand and decodes each inner value
+    with json.raw_decode, so memory holds one chunk at a time rather than
+    the whole file.
+    """
+
+    def __init__(self, f, block_size: int = 1 << 20):
+        self.f = f
+        self.block_size = block_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        block = self.f.read(self.block_size)
+        if not block:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON input")
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos}, found {self.buffer[self.pos]!r}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number at the very end of the buffer may continue in the next block
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def members(self) -> Iterator[str]:
+        """Iterate over the keys of an object; the caller consumes each value"""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+    def items(self) -> Iterator[None]:
+        """Iterate over the elements of an array; the caller consumes each one"""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("]")
+            return
+
+
+def iter_embedded_json(json_path: Path) -> Iterator[Tuple[str, Any]]:
+    """Stream ("metadata", dict), ("document", dict) and ("chunk", dict) events"""
+    with open(json_path, encoding="utf-8") as f:
+        stream = _JsonStream(f)
+        for key in stream.members():
+            if key != "documents":
+                value = stream.value()
+                if key == "metadata":
+                    yield "metadata", value
+                continue
+            for _ in stream.items():
+                document = {}
+                for doc_key in stream.members():
+                    if doc_key != "chunks":
+                        document[doc_key] = stream.value()
+                        continue
+                    # Document fields precede its chunks in files written by embed_n_store
+                    yield "document", document
+                    for _ in stream.items():
+                        yield "chunk", stream.value()
+
+
+def convert_json(json_path: Path, out_path: Path, dtype: str = "float16") -> Corpus:
+    """Convert an embedded-docs JSON file to a binary corpus without loading it whole"""
+    writer = None
+    corpus_metadata = {}
+    document = None
+    for kind, value in iter_embedded_json(json_path):
+        if kind == "metadata":
+            corpus_metadata = value
+        elif kind == "document":
+            document = value
+            document_index = None
+        else:
+            metadata = value["metadata"]
+            if writer is None:
+                writer = CorpusWriter(out_path, len(metadata["embedding"]), dtype, corpus_metadata)
+            if document_index is None:
+                document_index = writer.add_document(document.get("file"), document.get("page_count"))
+            writer.append(document_index, value["page_content"], metadata, metadata["embedding"])
+    if writer is None:
+        raise ValueError(f"No embedded chunks found in {json_path}")
+    writer.close()
+    return Corpus(out_path)
+
+
+def open_corpus(path: Path) -> Corpus:
+    """Open a binary corpus, converting an embedded-docs JSON file on first use.
+
+    The converted corpus is kept next to the JSON file and rebuilt whenever
+    the JSON is newer.
+    """
+    path = Path(path)
+    if path.is_dir():
+        return Corpus(path)
+    corpus_path = path.with_suffix(".corpus")
+    manifest_path = corpus_path / "manifest.json"
+    if not manifest_path.exists() or manifest_path.stat().st_mtime < path.stat().st_mtime:
+        return convert_json(path, corpus_path)
+    return Corpus(corpus_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert embedded-docs JSON to a binary corpus")
+    parser.add_argument("json_path", type=Path, nargs="?", default=Path("cohere_embedded_docs.json"))
+    parser.add_argument("out_path", type=Path, nargs="?", default=Path("cohere_embedded_docs.corpus"))
+    parser.add_argument("--dtype", choices=["float16", "float32"], default="float16")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    convert_json(args.json_path, args.out_path, args.dtype)
+    convert_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    corpus = Corpus(args.out_path)
+    load_seconds = time.perf_counter() - start
+
+    size = sum(p.stat().st_size for p in args.out_path.iterdir())
+    print(f"Converted {len(corpus)} chunks in {convert_seconds:.2f}s")
+    print(f"- JSON: {args.json_path.stat().st_size / 1e6:.2f} MB")
+    print(f"- Binary: {size / 1e6:.2f} MB ({args.dtype})")
+    print(f"- Load time: {load_seconds * 1000:.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,27 @@
+import asyncio
 import numpy as np
 import os
-import requests
+import threading
 from dotenv import load_dotenv
-from pinecone import Pinecone
-from langchain_pinecone import PineconeVectorStore
 from langchain_cohere import CohereEmbeddings
-from typing import List
+from langchain_core.documents import Document
+from typing import List, Optional, Tuple
+from embedder import BatchedEmbedder, embedder
+from vector_index import Retriever, SearchFilter, RETRIEVER_BACKEND, build_retriever
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from rerank import MMR_LAMBDA, collapse_overlaps, mmr_select
 
 load_dotenv()
 
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = "tech-docs-index"
+# Fuse BM25 keyword matches with vector search results
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true"
+# Results taken from each search before fusion and diversification
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+# Collapse overlapping windows and pick results by maximal marginal relevance
+MMR_ENABLED = os.getenv("MMR_ENABLED", "true").lower() == "true"
 
 embeddings_model = CohereEmbeddings(
     model="embed-english-v3.0",
@@ -20,33 +30,223 @@ embeddings_model = CohereEmbeddings(
 )
 
 def embed_query_cohere(query: str) -> np.ndarray:
-    try:
-        response = requests.post(
-            "https://api.cohere.ai/v1/embed",
-            headers={
-                "Authorization": f"Bearer {COHERE_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "texts": [query],
-                "model": "embed-english-v3.0",
-                "input_type": "search_query",
-                "truncate": "END"
-            }
+    """Embed a search query, served from the on-disk cache when seen before"""
+    return embedder.embed([query], "search_query")[0]
+
+class DocumentRetriever:
+    """Query-side retrieval, built once per process and shared by every query.
+
+    Owns the search backend (Pinecone client or local index) and keeps the
+    embedder's pooled HTTP client open between `start()` and `close()`, so
+    a query costs one embedding request and one search. Used without
+    `start()`, the backend is built on first use.
+
+    With `hybrid`, a BM25 search over the lexical index runs concurrently
+    with the vector search and the two rankings are merged by
+    reciprocal-rank fusion, so exact part numbers and headings rank first.
+
+    With `diversify`, the top_k are chosen from the candidates by maximal
+    marginal relevance and any selected windows that overlap on the same
+    page are merged into one span, so near-duplicate chunks neither crowd
+    out distinct context nor repeat text in the prompt.
+    """
+
+    def __init__(
+        self,
+        backend: str = RETRIEVER_BACKEND,
+        query_embedder: BatchedEmbedder = embedder,
+        hybrid: bool = HYBRID_RETRIEVAL,
+        diversify: bool = MMR_ENABLED,
+        mmr_lambda: float = MMR_LAMBDA,
+        retriever: Optional[Retriever] = None,
+        lexical: Optional[LexicalIndex] = None
+    ):
+        self.backend = backend
+        self.embedder = query_embedder
+        self.hybrid = hybrid
+        self.diversify = diversify
+        self.mmr_lambda = mmr_lambda
+        # Prebuilt indexes (e.g. benchmarks) take the place of the configured backend
+        self._retriever: Optional[Retriever] = retriever
+        self._lexical: Optional[LexicalIndex] = lexical
+        self._lock = threading.Lock()
+
+    @property
+    def retriever(self) -> Retriever:
+        if self._retriever is None:
+            with self._lock:
+                if self._retriever is None:
+                    self._retriever = build_retriever(self.backend)
+        return self._retriever
+
+    @property
+    def lexical(self) -> LexicalIndex:
+        if self._lexical is None:
+            with self._lock:
+                if self._lexical is None:
+                    self._lexical = LexicalIndex()
+        return self._lexical
+
+    def use_lexical(self, lexical) -> None:
+        """Search keywords in `lexical` (anything with LexicalIndex.asearch) instead of the local file"""
+        self._lexical = lexical
+
+    async def start(self) -> None:
+        await asyncio.to_thread(lambda: self.retriever)
+        if self.hybrid:
+            await asyncio.to_thread(lambda: self.lexical)
+        await self.embedder.open()
+
+    async def close(self) -> None:
+        await self.embedder.aclose()
+
+    def search(self, query: str, top_k: int = 4, search_filter: Optional[SearchFilter] = None) -> List[Document]:
+        return asyncio.run(self.asearch(query, top_k, search_filter))
+
+    async def asearch(self, query: str, top_k: int = 4, search_filter: Optional[SearchFilter] = None) -> List[Document]:
+        """Search the chunks visible through `search_filter` (all chunks if None)"""
+        return (await self.asearch_many([query], top_k, search_filter))[0]
+
+    def search_many(
+        self,
+        queries: List[str],
+        top_k: int = 4,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[List[Document]]:
+        return asyncio.run(self.asearch_many(queries, top_k, search_filter))
+
+    async def asearch_many(
+        self,
+        queries: List[str],
+        top_k: int = 4,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[List[Document]]:
+        """Top_k results for each query, as asearch would return them.
+
+        The queries are embedded together (as few API requests as the batch
+        limits allow, cached ones skipped) and searched as one batch: a
+        matrix product on local indexes, concurrent requests on Pinecone.
+        """
+        if not queries:
+            return []
+        query_vectors = await self.embedder.aembed(queries, "search_query")
+        return await self.asearch_embedded(queries, query_vectors, top_k, search_filter)
+
+    async def asearch_embedded(
+        self,
+        queries: List[str],
+        query_vectors: np.ndarray,
+        top_k: int = 4,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[List[Document]]:
+        """asearch_many for queries already embedded (one row of `query_vectors` each)"""
+        if not (self.hybrid or self.diversify):
+            return await asyncio.to_thread(self.retriever.search_many, query_vectors, top_k, search_filter)
+
+        depth = max(top_k, HYBRID_CANDIDATES)
+        dense_search = asyncio.to_thread(
+            self.retriever.search_many_with_vectors, query_vectors, depth, search_filter
         )
-        response.raise_for_status()
-        data = response.json()
-        return np.array(data['embeddings'][0])
-    except requests.exceptions.RequestException as e:
-        print(f"Embedding error: {str(e)}")
-        return np.zeros(1024)
-    except KeyError as e:
-        print(f"Embedding response format error: {str(e)}")
-        return np.zeros(1024)
+        if self.hybrid:
+            dense, lexical = await asyncio.gather(
+                dense_search,
+                asyncio.gather(*(self.lexical.asearch(query, depth, search_filter) for query in queries))
+            )
+            candidates = [
+                reciprocal_rank_fusion([documents, keyword], depth)
+                for (documents, _), keyword in zip(dense, lexical)
+            ]
+            relevance = [
+                np.array([doc.metadata["rrf_score"] for doc in documents], dtype=np.float32)
+                for documents in candidates
+            ]
+        else:
+            dense = await dense_search
+            candidates = [documents for documents, _ in dense]
+            relevance = [
+                np.array([doc.metadata["score"] for doc in documents], dtype=np.float32)
+                for documents in candidates
+            ]
+        if not self.diversify:
+            return [documents[:top_k] for documents in candidates]
+
+        vectors = await self._candidate_vectors(candidates, dense) if self.hybrid else [v for _, v in dense]
+        return [
+            self._diversify(documents, scores, matrix, top_k)
+            for documents, scores, matrix in zip(candidates, relevance, vectors)
+        ]
+
+    def _diversify(
+        self,
+        candidates: List[Document],
+        relevance: np.ndarray,
+        vectors: np.ndarray,
+        top_k: int
+    ) -> List[Document]:
+        if len(candidates) <= 1:
+            return candidates[:top_k]
+        # Rescale relevance to [0, 1] so mmr_lambda means the same for cosine and RRF scores
+        spread = relevance.max() - relevance.min()
+        relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones_like(relevance)
+        selected = mmr_select(relevance, vectors, top_k, self.mmr_lambda)
+        # Selected windows that still overlap on a page become one span
+        documents, _, _ = collapse_overlaps(
+            [candidates[i] for i in selected], vectors[selected], relevance[selected]
+        )
+        return documents
+
+    async def _candidate_vectors(
+        self,
+        candidates: List[List[Document]],
+        dense: List[Tuple[List[Document], np.ndarray]]
+    ) -> List[np.ndarray]:
+        """Embeddings of each query's fused candidates, one normalized row per candidate.
+
+        Vector hits come with theirs; keyword-only hits take the embedding
+        stored under their chunk id, fetched for the whole batch at once
+        (nothing is embedded at query time). A keyword hit whose vector
+        cannot be found gets a zero row: it competes on relevance alone and
+        never counts as redundant with another result.
+        """
+        by_text = {
+            doc.page_content: vector
+            for documents, vectors in dense
+            for doc, vector in zip(documents, vectors)
+        }
+        missing = list(dict.fromkeys(
+            doc.metadata["chunk_id"]
+            for documents in candidates for doc in documents
+            if doc.page_content not in by_text and "chunk_id" in doc.metadata
+        ))
+        by_id = await asyncio.to_thread(self.retriever.vectors_for, missing) if missing else {}
+        dimension = next(
+            (len(vector) for vector in [*by_text.values(), *by_id.values()]),
+            getattr(self.embedder, "dimension", 1)
+        )
+
+        unmatched = 0
+        result = []
+        for documents in candidates:
+            vectors = np.zeros((len(documents), dimension), dtype=np.float32)
+            for i, doc in enumerate(documents):
+                vector = by_text.get(doc.page_content)
+                if vector is None:
+                    vector = by_id.get(doc.metadata.get("chunk_id"))
+                if vector is None:
+                    unmatched += 1
+                    continue
+                vectors[i] = vector
+            result.append(vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12))
+        if unmatched:
+            print(f"{unmatched} keyword hits have no stored vector; diversified by relevance only")
+        return result
+
+
+document_retriever = DocumentRetriever()
 
 def retrieve_relevant_documents(query: str, top_k: int = 4) -> List[str]:
     """
-    Retrieves relevant documents from Pinecone based on a query.
+    Retrieves relevant documents based on a query.
 
     Args:
         query: The query string.
@@ -55,14 +255,25 @@ def retrieve_relevant_documents(query: str, top_k: int = 4) -> List[str]:
     Returns:
         A list of relevant document content strings.
     """
-    pc = Pinecone(api_key=PINECONE_API_KEY)
-    index = pc.Index(PINECONE_INDEX_NAME)
-    vector_store = PineconeVectorStore(index=index, embedding=embeddings_model)
-
-    retrieved_docs = vector_store.similarity_search(query, k=top_k)
+    retrieved_docs = document_retriever.search(query, top_k)
 
     return [doc.page_content for doc in retrieved_docs]
 
+def retrieve_relevant_documents_batch(queries: List[str], top_k: int = 4) -> List[List[str]]:
+    """
+    Retrieves relevant documents for many queries in one batch.
+
+    Args:
+        queries: The query strings.
+        top_k: The number of top results to retrieve per query.
+
+    Returns:
+        For each query, a list of relevant document content strings.
+    """
+    retrieved = document_retriever.search_many(queries, top_k)
+
+    return [[doc.page_content for doc in docs] for docs in retrieved]
+
 def main_retriever(query_text: str):
     """
     Example usage of the retrieve_relevant_documents function.
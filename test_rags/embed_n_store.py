@@ -1,24 +1,35 @@
 import time
+import asyncio
+import argparse
 import numpy as np
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_cohere import CohereEmbeddings
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Set, Tuple
+from concurrent.futures import ProcessPoolExecutor
 import os
+import json
+import hashlib
 import datetime
-import requests
 from dotenv import load_dotenv
 from pinecone import Pinecone, ServerlessSpec
-from langchain_pinecone import PineconeVectorStore
-from uuid import uuid4
 from langchain_core.documents import Document
+from embedder import embedder
+from lexical_index import LexicalIndex
+from answer_cache import AnswerCache, ANSWER_CACHE_ENABLED
 
 load_dotenv()
 
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = "tech-docs-index"
+BASE_DIR = Path(__file__).parent
+GUIDES_DIR = BASE_DIR / "guides"
+# Chunk fingerprints of every ingested file, used to re-embed only what changed
+MANIFEST_PATH = Path(os.getenv("CHUNK_MANIFEST_PATH", BASE_DIR / "chunk_manifest.json"))
+# Share of a vanished file's chunks a new file must contain to be taken for it (renamed or moved)
+RENAME_MIN_OVERLAP = 0.5
 
 text_splitter = RecursiveCharacterTextSplitter(
     chunk_size=1000,
@@ -32,94 +43,399 @@ embeddings_model = CohereEmbeddings(
     max_retries=3,
 )
 
-def embed_chunks_cohere(chunks: List[Any]) -> List[np.ndarray]:
-    texts = [chunk.page_content for chunk in chunks]
-    try:
-        response = requests.post(
-            "https://api.cohere.ai/v1/embed",
-            headers={
-                "Authorization": f"Bearer {COHERE_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "texts": texts,
-                "model": "embed-english-v3.0",
-                "input_type": "search_document",
-                "truncate": "END"
-            }
-        )
-        response.raise_for_status()
-        data = response.json()
-        return np.array(data['embeddings'])
-    except requests.exceptions.RequestException as e:
-        print(f"Embedding error: {str(e)}")
-        return [np.zeros(1024) for _ in chunks]
-    except KeyError as e:
-        print(f"Embedding response format error: {str(e)}")
-        return [np.zeros(1024) for _ in chunks]
-
-def process_pdf(file_path: Path) -> Dict[str, Any]:
+def embed_chunks_cohere(chunks: List[Any]) -> np.ndarray:
+    """Embed chunks in concurrent, size-bounded batches.
+
+    Raises EmbeddingError if any batch still fails after its retries, so a
+    failed file is reported as failed instead of indexed with zero vectors.
+    """
+    return embedder.embed([chunk.page_content for chunk in chunks], "search_document")
+
+def chunk_fingerprint(chunk: Any) -> str:
+    return hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+
+def document_identity(file_path: Path) -> str:
+    """Name of a manual whatever directory the script runs from, e.g. "guides/HPguide.pdf".
+
+    Also used as the chunks' "source", so citations and cache
+    invalidation do not depend on the working directory either.
+    """
+    file_path = Path(file_path).resolve()
     try:
-        loader = PyPDFLoader(str(file_path))
-        pages = loader.load()
-        chunks = []
-        for page in pages:
-            chunks.extend(text_splitter.split_documents([page]))
-
-        max_retries = 3
-        embeddings = None
-        for attempt in range(max_retries):
-            try:
-                embeddings = embed_chunks_cohere(chunks)
-                break
-            except Exception as e:
-                print(f"Attempt {attempt + 1} embedding error for {file_path.name}: {e}")
-                if attempt == max_retries - 1:
-                    raise
-                time.sleep(2 ** attempt)
-        if embeddings is None:
-            print(f"Failed to get embeddings for {file_path.name} after multiple retries.")
-            return None
-
-        serialized_chunks = []
-        langchain_documents = []
-        for chunk, embedding in zip(chunks, embeddings):
-            chunk_data = {
-                "page_content": chunk.page_content,
-                "metadata": {
-                    **chunk.metadata,
-                    "embedding": embedding.tolist(),
-                    "embedding_model": "cohere-embed-english-v3.0",
-                    "embedding_time": datetime.datetime.now().isoformat()
-                }
+        return file_path.relative_to(BASE_DIR.resolve()).as_posix()
+    except ValueError:
+        return file_path.as_posix()
+
+def document_key(identity: str) -> str:
+    """Stable, id-safe key for a document across revisions"""
+    return hashlib.sha1(identity.encode("utf-8")).hexdigest()[:16]
+
+def load_manifest(path: Path = MANIFEST_PATH) -> Dict[str, Dict[str, Any]]:
+    """Maps each document identity to {"key": vector id prefix, "fingerprints": {chunk fingerprint: page}}"""
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        manifest = json.load(f)
+    # Older manifests map the path straight to its fingerprints; the key was derived from it
+    return {
+        identity: entry if "fingerprints" in entry else {"key": document_key(identity), "fingerprints": entry}
+        for identity, entry in manifest.items()
+    }
+
+def corpus_chunk_ids(corpus, manifest: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+    """Vector id of each chunk in an embedded corpus (see corpus_store), mapped to its row.
+
+    The ids are the ones this script upserts the chunks under, so keyword
+    indexes built from the corpus join their vectors. Repeated text within
+    a document shares one id, kept at its first row.
+    """
+    ids = {}
+    for i in range(len(corpus)):
+        identity = corpus.metadata(i).get("source", "")
+        key = manifest[identity]["key"] if identity in manifest else document_key(identity)
+        fingerprint = hashlib.sha256(corpus.text(i).encode("utf-8")).hexdigest()
+        ids.setdefault(f"{key}#{fingerprint}", i)
+    return ids
+
+def save_manifest(manifest: Dict[str, Dict[str, Any]], path: Path = MANIFEST_PATH):
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+def load_and_split(file_path: Path) -> Tuple[int, List[Any]]:
+    """Parse a PDF and split it into chunks (CPU-bound, safe to run in a worker process)"""
+    loader = PyPDFLoader(str(file_path))
+    pages = loader.load()
+    chunks = []
+    for page in pages:
+        chunks.extend(text_splitter.split_documents([page]))
+    return len(pages), chunks
+
+def previous_entry(
+    manifest: Dict[str, Dict[str, Any]],
+    identity: str,
+    chunks: List[Any],
+    current: Set[str],
+    claimed: Set[str]
+) -> Optional[Dict[str, Any]]:
+    """The manifest entry a file was last ingested under.
+
+    Its own entry if it has one; otherwise the entry of a file that is no
+    longer in `current` and whose chunks this one mostly contains, i.e.
+    the same manual renamed or moved, perhaps also revised. Entries taken
+    that way are added to `claimed` so no two files take the same one.
+    """
+    if identity in manifest:
+        return {**manifest[identity], "identity": identity}
+    fingerprints = {chunk_fingerprint(chunk) for chunk in chunks}
+    best, best_overlap = None, RENAME_MIN_OVERLAP
+    for other, entry in manifest.items():
+        if other in current or other in claimed or not entry["fingerprints"]:
+            continue
+        overlap = len(fingerprints.intersection(entry["fingerprints"])) / len(entry["fingerprints"])
+        if overlap >= best_overlap:
+            best, best_overlap = other, overlap
+    if best is None:
+        return None
+    claimed.add(best)
+    print(f"{identity}: taken as {best} renamed ({best_overlap:.0%} of its chunks unchanged)")
+    return {**manifest[best], "identity": best}
+
+def diff_chunks(
+    file_path: Path,
+    page_count: int,
+    chunks: List[Any],
+    previous: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """Work out which chunks are not already indexed.
+
+    `previous` is the manifest entry from the document's last ingestion
+    (see previous_entry). Unchanged chunks keep their vectors, with their
+    page and source updated if the text moved or the file was renamed;
+    new or edited chunks are returned under "new_chunks" to be embedded
+    (see attach_embeddings), and fingerprints that disappeared are
+    returned as stale ids.
+    """
+    identity = document_identity(file_path)
+    renamed_from = previous["identity"] if previous and previous["identity"] != identity else None
+    doc_key = previous["key"] if previous else document_key(identity)
+    previous = previous["fingerprints"] if previous else {}
+
+    fingerprints = {}
+    new_chunks = []
+    moved = {}
+    for chunk in chunks:
+        fingerprint = chunk_fingerprint(chunk)
+        if fingerprint in fingerprints:
+            continue  # identical text elsewhere in the file
+        page = chunk.metadata.get("page")
+        fingerprints[fingerprint] = page
+        if fingerprint not in previous:
+            new_chunks.append((fingerprint, chunk))
+            continue
+        changes = {}
+        if previous[fingerprint] != page:
+            changes["page"] = page
+        if renamed_from:
+            changes["source"] = identity
+        if changes:
+            moved[f"{doc_key}#{fingerprint}"] = changes
+    stale_ids = [f"{doc_key}#{fingerprint}" for fingerprint in previous if fingerprint not in fingerprints]
+
+    print(
+        f"{file_path.name}: {len(new_chunks)} new, {len(stale_ids)} stale, "
+        f"{len(fingerprints) - len(new_chunks)} unchanged chunks"
+    )
+    return {
+        "file": identity,
+        "key": doc_key,
+        "renamed_from": renamed_from,
+        "page_count": page_count,
+        "chunk_count": len(chunks),
+        "new_chunks": new_chunks,
+        "stale_ids": stale_ids,
+        "moved": moved,
+        "fingerprints": fingerprints
+    }
+
+def attach_embeddings(diff: Dict[str, Any], embeddings) -> Dict[str, Any]:
+    """Complete a diff_chunks result with its new chunks' embeddings, ready to sync"""
+    serialized_chunks = []
+    langchain_documents = []
+    vector_ids = []
+    for (fingerprint, chunk), embedding in zip(diff["new_chunks"], embeddings):
+        # Manuals ingested here are visible to every user (see SearchFilter)
+        metadata = {**chunk.metadata, "source": diff["file"], "shared": True}
+        chunk_data = {
+            "page_content": chunk.page_content,
+            "metadata": {
+                **metadata,
+                "embedding": embedding.tolist(),
+                "embedding_model": "cohere-embed-english-v3.0",
+                "embedding_time": datetime.datetime.now().isoformat()
             }
-            serialized_chunks.append(chunk_data)
-            # Create LangChain Document for Pinecone
-            langchain_documents.append(Document(page_content=chunk.page_content, metadata=chunk.metadata))
-
-        return {
-            "file": str(file_path),
-            "page_count": len(pages),
-            "chunk_count": len(chunks),
-            "chunks": serialized_chunks,
-            "langchain_documents": langchain_documents
         }
+        serialized_chunks.append(chunk_data)
+        langchain_documents.append(Document(page_content=chunk.page_content, metadata=metadata))
+        vector_ids.append(f"{diff['key']}#{fingerprint}")
+    result = {key: value for key, value in diff.items() if key != "new_chunks"}
+    return {
+        **result,
+        "chunks": serialized_chunks,
+        "langchain_documents": langchain_documents,
+        "vector_ids": vector_ids,
+        "embeddings": embeddings
+    }
+
+def embed_chunk_diff(
+    file_path: Path,
+    page_count: int,
+    chunks: List[Any],
+    previous: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """Embed the chunks that are not already indexed (see diff_chunks)"""
+    diff = diff_chunks(file_path, page_count, chunks, previous)
+    new_chunks = [chunk for _, chunk in diff["new_chunks"]]
+    return attach_embeddings(diff, embed_chunks_cohere(new_chunks) if new_chunks else [])
+
+async def aembed_chunk_diff(
+    file_path: Path,
+    page_count: int,
+    chunks: List[Any],
+    previous: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """embed_chunk_diff on the caller's event loop, sharing its embedding client and limit"""
+    diff = diff_chunks(file_path, page_count, chunks, previous)
+    texts = [chunk.page_content for _, chunk in diff["new_chunks"]]
+    return attach_embeddings(diff, await embedder.aembed(texts, "search_document") if texts else [])
+
+def process_pdf(
+    file_path: Path,
+    manifest: Dict[str, Dict[str, Any]],
+    current: Set[str],
+    claimed: Set[str] = None
+) -> Dict[str, Any]:
+    """Parse, split and embed one file against its manifest entry.
+
+    `current` is the identity of every file in this run: a manifest entry
+    is only taken for a rename when its file is not among them.
+    """
+    try:
+        start = time.perf_counter()
+        page_count, chunks = load_and_split(file_path)
+        parse_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        previous = previous_entry(
+            manifest, document_identity(file_path), chunks, current, claimed if claimed is not None else set()
+        )
+        result = embed_chunk_diff(file_path, page_count, chunks, previous)
+        if result:
+            result["parse_seconds"] = parse_seconds
+            result["embed_seconds"] = time.perf_counter() - start
+        return result
     except Exception as e:
         print(f"Failed processing {file_path.name}: {str(e)}")
         return None
 
-def process_all_pdfs(pdf_files: List[Path]) -> List[Dict[str, Any]]:
+def sync_vectors(index, result: Dict[str, Any], batch_size: int = 100):
+    """Apply one file's chunk diff to the Pinecone index"""
+    vectors = [
+        {
+            # "text" is the key PineconeVectorStore reads page_content from
+            "id": vector_id,
+            "values": embedding.tolist(),
+            "metadata": {**doc.metadata, "text": doc.page_content}
+        }
+        for vector_id, doc, embedding in zip(
+            result["vector_ids"], result["langchain_documents"], result["embeddings"]
+        )
+    ]
+    for i in range(0, len(vectors), batch_size):
+        index.upsert(vectors=vectors[i:i + batch_size])
+    for vector_id, changes in result["moved"].items():
+        index.update(id=vector_id, set_metadata=changes)
+    stale_ids = result["stale_ids"]
+    for i in range(0, len(stale_ids), 1000):
+        index.delete(ids=stale_ids[i:i + 1000])
+
+def delete_vanished(index, lexical_index: LexicalIndex, entry: Dict[str, Any]) -> List[str]:
+    """Remove the vectors and keyword entries of a file that is gone; returns their ids"""
+    ids = [f"{entry['key']}#{fingerprint}" for fingerprint in entry["fingerprints"]]
+    for i in range(0, len(ids), 1000):
+        index.delete(ids=ids[i:i + 1000])
+    lexical_index.delete(ids)
+    return ids
+
+def mark_shared(index, manifest: Dict[str, Dict[str, Any]]):
+    """Tag the vectors of every file in the manifest as shared manuals.
+
+    For vectors upserted before chunks carried the `shared` marker; search
+    filters select shared manuals by it, so untagged ones are invisible to
+    filtered queries until this has run once.
+    """
+    for identity, entry in manifest.items():
+        for fingerprint in entry["fingerprints"]:
+            index.update(id=f"{entry['key']}#{fingerprint}", set_metadata={"shared": True})
+        print(f"Marked {len(entry['fingerprints'])} vectors of {identity} as shared")
+
+def sync_lexical(lexical_index: LexicalIndex, result: Dict[str, Any]):
+    """Apply one file's chunk diff to the BM25 index, under the same ids as its vectors"""
+    lexical_index.add_many(result["vector_ids"], result["langchain_documents"])
+    for vector_id, changes in result["moved"].items():
+        lexical_index.update_metadata(vector_id, changes)
+    lexical_index.delete(result["stale_ids"])
+
+def process_all_pdfs(
+    pdf_files: List[Path],
+    manifest: Dict[str, Dict[str, Any]] = None,
+    workers: int = 1,
+    embed_concurrency: int = 4
+) -> List[Dict[str, Any]]:
+    manifest = manifest or {}
+    current = {document_identity(pdf_file) for pdf_file in pdf_files}
+    claimed = set()
+    if workers > 1:
+        return asyncio.run(
+            process_all_pdfs_parallel(pdf_files, manifest, workers, embed_concurrency, current, claimed)
+        )
     results = []
     for pdf_file in pdf_files:
-        result = process_pdf(pdf_file)
+        result = process_pdf(pdf_file, manifest, current, claimed)
         results.append(result)
     return results
 
+async def process_all_pdfs_parallel(
+    pdf_files: List[Path],
+    manifest: Dict[str, Dict[str, Any]],
+    workers: int,
+    embed_concurrency: int,
+    current: Set[str],
+    claimed: Set[str] = None
+) -> List[Dict[str, Any]]:
+    """Parse and split in a process pool while embedding runs concurrently.
+
+    At most `workers * 2` files are in flight (parsed or being parsed), which
+    keeps memory bounded however large the library is. Embedding runs on
+    this loop, so at most the embedder's `max_concurrency` requests are out
+    at once across all `embed_concurrency` files.
+    """
+    claimed = claimed if claimed is not None else set()
+    loop = asyncio.get_running_loop()
+    in_flight = asyncio.Semaphore(workers * 2)
+    embed_slots = asyncio.Semaphore(embed_concurrency)
+
+    async def process(pdf_file: Path, pool: ProcessPoolExecutor):
+        async with in_flight:
+            try:
+                start = time.perf_counter()
+                page_count, chunks = await loop.run_in_executor(pool, load_and_split, pdf_file)
+                parse_seconds = time.perf_counter() - start
+
+                # Matched on the loop thread, so two files never claim the same entry
+                previous = previous_entry(manifest, document_identity(pdf_file), chunks, current, claimed)
+                async with embed_slots:
+                    start = time.perf_counter()
+                    result = await aembed_chunk_diff(pdf_file, page_count, chunks, previous)
+                    embed_seconds = time.perf_counter() - start
+            except Exception as e:
+                print(f"Failed processing {pdf_file.name}: {str(e)}")
+                return None
+        if result:
+            result["parse_seconds"] = parse_seconds
+            result["embed_seconds"] = embed_seconds
+        return result
+
+    # Every file's batches go through one pooled client and one adaptive limit
+    await embedder.open()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return await asyncio.gather(*(process(pdf_file, pool) for pdf_file in pdf_files))
+    finally:
+        await embedder.aclose()
+
+def report_throughput(results: List[Dict[str, Any]], wall_seconds: float):
+    successful = [r for r in results if isinstance(r, dict)]
+    print("\nThroughput:")
+    for result in successful:
+        seconds = result["parse_seconds"] + result["embed_seconds"]
+        print(
+            f"- {Path(result['file']).name}: {result['page_count']} pages, "
+            f"{result['chunk_count']} chunks in {seconds:.2f}s "
+            f"(parse {result['parse_seconds']:.2f}s, embed {result['embed_seconds']:.2f}s, "
+            f"{result['page_count'] / max(seconds, 1e-9):.1f} pages/s)"
+        )
+    pages = sum(r["page_count"] for r in successful)
+    chunks = sum(r["chunk_count"] for r in successful)
+    wall_seconds = max(wall_seconds, 1e-9)
+    print(
+        f"- Aggregate: {len(successful)} files, {pages} pages, {chunks} chunks "
+        f"in {wall_seconds:.2f}s ({len(successful) / wall_seconds:.2f} files/s, "
+        f"{pages / wall_seconds:.1f} pages/s, {chunks / wall_seconds:.1f} chunks/s)"
+    )
+
 def main():
-    pdf_files = list(set(Path("guides/").rglob("*.[pP][dD][fF]")))
+    parser = argparse.ArgumentParser(description="Embed PDFs into the Pinecone index")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Processes used for PDF parsing and splitting (1 = sequential)")
+    parser.add_argument("--embed-concurrency", type=int, default=4,
+                        help="Files embedded at the same time")
+    parser.add_argument("--mark-shared", action="store_true",
+                        help="Tag already indexed vectors as shared manuals, then exit")
+    args = parser.parse_args()
+
+    if args.mark_shared:
+        mark_shared(Pinecone(api_key=PINECONE_API_KEY).Index(PINECONE_INDEX_NAME), load_manifest())
+        return
+
+    pdf_files = list(set(GUIDES_DIR.rglob("*.[pP][dD][fF]")))
     print(f"Found {len(pdf_files)} PDF files to process")
 
-    results = process_all_pdfs(pdf_files)
+    manifest = load_manifest()
+    start = time.perf_counter()
+    results = process_all_pdfs(pdf_files, manifest, args.workers, args.embed_concurrency)
+    report_throughput(results, time.perf_counter() - start)
 
     successful = [r for r in results if isinstance(r, dict)]
     failed = len(results) - len(successful)
@@ -131,7 +447,7 @@ def main():
     print(f"- Failed: {failed} files")
     print(f"- Total chunks embedded: {total_embedded}")
 
-    # Initialize Pinecone and Vector Store
+    # Initialize Pinecone
     pc = Pinecone(api_key=PINECONE_API_KEY)
     existing_indexes = [index_info["name"] for index_info in pc.list_indexes()]
 
@@ -146,18 +462,36 @@ def main():
             time.sleep(1)
 
     index = pc.Index(PINECONE_INDEX_NAME)
-    vector_store = PineconeVectorStore(index=index, embedding=embeddings_model)
+    lexical_index = LexicalIndex()
+    answer_cache = AnswerCache() if ANSWER_CACHE_ENABLED else None
 
-    # Add documents to Pinecone
+    # Upsert new chunks with the embeddings computed above, drop stale ones
     for result in successful:
-        if result and "langchain_documents" in result:
-            documents = result["langchain_documents"]
-            uuids = [str(uuid4()) for _ in range(len(documents))]
-            vector_store.add_documents(documents=documents, ids=uuids)
-        else:
-            print(f"Skipping adding documents for a failed file: {result['file'] if result else 'Unknown'}")
+        sync_vectors(index, result)
+        sync_lexical(lexical_index, result)
+        manifest[result["file"]] = {"key": result["key"], "fingerprints": result["fingerprints"]}
+        if result["renamed_from"]:
+            del manifest[result["renamed_from"]]
+        save_manifest(manifest)
+        if answer_cache and (result["vector_ids"] or result["stale_ids"] or result["moved"]):
+            # Chunk metadata "source" is the document identity, the key answers were cached under
+            answer_cache.invalidate([result["file"]] + ([result["renamed_from"]] if result["renamed_from"] else []))
+
+    # Files that disappeared without being renamed take their vectors with them; a
+    # failed file might have been one of them renamed, so wait for a clean run
+    seen = {document_identity(pdf_file) for pdf_file in pdf_files}
+    vanished = [identity for identity in manifest if identity not in seen] if not failed else []
+    for identity in vanished:
+        ids = delete_vanished(index, lexical_index, manifest.pop(identity))
+        save_manifest(manifest)
+        if answer_cache:
+            answer_cache.invalidate([identity])
+        print(f"{identity}: removed, deleted {len(ids)} vectors")
+    lexical_index.close()
+    if answer_cache:
+        answer_cache.close()
 
-    print("Documents added to Pinecone.")
+    print("Documents synced to Pinecone and the keyword index.")
 
     if 'COHERE_API_KEY' in os.environ:
         del os.environ['COHERE_API_KEY']
@@ -165,4 +499,4 @@ def main():
         del os.environ['PINECONE_API_KEY']
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
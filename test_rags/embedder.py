@@ -0,0 +1,302 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import httpx
+import numpy as np
+from collections import deque
+from dotenv import load_dotenv
+from typing import Deque, Iterator, List, Optional, Tuple
+from embedding_cache import EmbeddingCache, EMBEDDING_CACHE_DIR
+
+load_dotenv()
+
+COHERE_API_KEY = os.getenv("COHERE_API_KEY")
+COHERE_EMBED_URL = "https://api.cohere.ai/v1/embed"
+EMBED_MODEL = "embed-english-v3.0"
+EMBED_DIMENSION = 1024
+MAX_BATCH_ITEMS = 96        # Cohere's per-request limit on texts
+MAX_TOKENS_PER_TEXT = 512   # longer inputs are truncated server-side (truncate=END)
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingError(Exception):
+    """A batch could not be embedded; no placeholder vectors are returned"""
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English technical prose
+    return min(len(text) // 4 + 1, MAX_TOKENS_PER_TEXT)
+
+
+class _AdaptiveLimit:
+    """Cap on in-flight requests that backs off when the provider throttles.
+
+    Halves on every 429 and grows by one per successful request
+    (additive increase, multiplicative decrease), so concurrency settles
+    just under the provider's rate limit.
+
+    One limit serves every caller of an embedder, whichever thread or event
+    loop it runs on: the count is guarded by a thread lock and a waiter is
+    woken on its own loop.
+    """
+
+    def __init__(self, maximum: int):
+        self.maximum = maximum
+        self.limit = maximum
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self._lock:
+                    if (loop, waiter) in self._waiters:
+                        self._waiters.remove((loop, waiter))
+                    else:
+                        # Woken for a free slot it will not take; pass it on
+                        self._wake()
+                raise
+
+    async def __aexit__(self, *exc_info):
+        with self._lock:
+            self.in_flight -= 1
+            self._wake()
+
+    def record(self, throttled: bool):
+        with self._lock:
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+            else:
+                self.limit = min(self.maximum, self.limit + 1)
+            self._wake()
+
+    def _wake(self):
+        """Wake as many waiters as there are free slots (called holding the lock)"""
+        free = self.limit - self.in_flight
+        while free > 0 and self._waiters:
+            loop, waiter = self._waiters.popleft()
+            loop.call_soon_threadsafe(_resolve, waiter)
+            free -= 1
+
+
+def _resolve(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class BatchedEmbedder:
+    """Cohere embedding client that splits input into concurrent batches.
+
+    Batches are cut by item count and by an estimated token budget and up to
+    `max_concurrency` of them are in flight at once. Each batch is retried on
+    its own (network errors, 429, 5xx) with exponential backoff, and a batch
+    rejected as too large is split in half. If a batch still fails an
+    EmbeddingError is raised - callers never get zero vectors back.
+
+    With a `cache`, texts embedded before are served from disk and only the
+    misses go over the network. Long-running services call `open()` once so
+    every request reuses one pooled HTTP client instead of reconnecting.
+
+    All calls share one adaptive limit, including blocking embed() calls
+    from different threads (each on its own event loop), so a 429 seen by
+    one caller slows every caller down.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = COHERE_API_KEY,
+        model: str = EMBED_MODEL,
+        dimension: int = EMBED_DIMENSION,
+        max_batch_items: int = MAX_BATCH_ITEMS,
+        max_batch_tokens: int = 32_000,
+        max_concurrency: int = 4,
+        max_retries: int = 5,
+        backoff_seconds: float = 1.0,
+        timeout: float = 60.0,
+        cache: Optional[EmbeddingCache] = None
+    ):
+        self.api_key = api_key
+        self.model = model
+        self.dimension = dimension
+        self.max_batch_items = max_batch_items
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        self.cache = cache
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop = None
+        self._limit = _AdaptiveLimit(max_concurrency)
+
+    def _new_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            timeout=self.timeout,
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            },
+            limits=httpx.Limits(max_connections=self.max_concurrency)
+        )
+
+    async def open(self) -> None:
+        """Keep a pooled client for aembed calls made on the current event loop"""
+        if self._client is None:
+            self._client = self._new_client()
+            self._client_loop = asyncio.get_running_loop()
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._client_loop = None
+
+    def batches(self, texts: List[str]) -> Iterator[Tuple[int, int]]:
+        """Yield [start, end) ranges within the item and token limits"""
+        start, tokens = 0, 0
+        for i, text in enumerate(texts):
+            cost = estimate_tokens(text)
+            if i > start and (i - start >= self.max_batch_items or tokens + cost > self.max_batch_tokens):
+                yield start, i
+                start, tokens = i, 0
+            tokens += cost
+        if start < len(texts):
+            yield start, len(texts)
+
+    def embed(self, texts: List[str], input_type: str) -> np.ndarray:
+        """Blocking wrapper around aembed, for synchronous code only (scripts, worker threads).
+
+        It runs its own event loop, so it cannot be called from a coroutine;
+        async code awaits aembed instead.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.aembed(texts, input_type))
+        raise RuntimeError("BatchedEmbedder.embed() called from a running event loop; await aembed() instead")
+
+    async def aembed(self, texts: List[str], input_type: str) -> np.ndarray:
+        """Embed texts, returning a (len(texts), dimension) float32 matrix"""
+        if self.cache is None or not texts:
+            return await self._aembed_uncached(texts, input_type)
+
+        embeddings, missing = await asyncio.to_thread(
+            self.cache.get_many, self.model, input_type, texts
+        )
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            fresh = await self._aembed_uncached(missing_texts, input_type)
+            embeddings[missing] = fresh
+            await asyncio.to_thread(
+                self.cache.put_many, self.model, input_type, missing_texts, fresh
+            )
+        return embeddings
+
+    async def _aembed_uncached(self, texts: List[str], input_type: str) -> np.ndarray:
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        if not texts:
+            return embeddings
+
+        limiter = self._limit
+        # The pooled client is bound to the loop that opened it; blocking
+        # embed() calls run on a fresh loop and get a short-lived client
+        if self._client is not None and self._client_loop is asyncio.get_running_loop():
+            client = self._client
+            close_client = False
+        else:
+            client = self._new_client()
+            close_client = True
+        try:
+            tasks = [
+                asyncio.create_task(
+                    self._embed_batch(client, limiter, texts, start, end, input_type, embeddings)
+                )
+                for start, end in self.batches(texts)
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+        finally:
+            if close_client:
+                await client.aclose()
+        return embeddings
+
+    async def _embed_batch(
+        self,
+        client: httpx.AsyncClient,
+        limiter: _AdaptiveLimit,
+        texts: List[str],
+        start: int,
+        end: int,
+        input_type: str,
+        out: np.ndarray
+    ):
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                async with limiter:
+                    response = await client.post(
+                        COHERE_EMBED_URL,
+                        json={
+                            "texts": texts[start:end],
+                            "model": self.model,
+                            "input_type": input_type,
+                            "truncate": "END"
+                        }
+                    )
+                    limiter.record(throttled=response.status_code == 429)
+            except httpx.TransportError as e:
+                reason = f"{type(e).__name__}: {e}"
+            else:
+                if response.status_code == 200:
+                    batch = response.json().get("embeddings")
+                    if not batch or len(batch) != end - start:
+                        raise EmbeddingError(f"Embedding response format error for items {start}-{end}")
+                    out[start:end] = batch
+                    return
+                if response.status_code == 413 and end - start > 1:
+                    middle = (start + end) // 2
+                    await asyncio.gather(
+                        self._embed_batch(client, limiter, texts, start, middle, input_type, out),
+                        self._embed_batch(client, limiter, texts, middle, end, input_type, out)
+                    )
+                    return
+                if response.status_code != 429 and response.status_code < 500:
+                    raise EmbeddingError(
+                        f"Embedding request failed ({response.status_code}): {response.text}"
+                    )
+                reason = f"HTTP {response.status_code}"
+                retry_after = response.headers.get("Retry-After")
+
+            if attempt == self.max_retries:
+                raise EmbeddingError(
+                    f"Embedding items {start}-{end} failed after {attempt + 1} attempts: {reason}"
+                )
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = self.backoff_seconds * 2 ** attempt * (0.5 + random.random())
+            logger.warning(f"Embedding items {start}-{end} failed ({reason}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+embedder = BatchedEmbedder(
+    cache=EmbeddingCache(dimension=EMBED_DIMENSION) if EMBEDDING_CACHE_DIR else None
+)
@@ -0,0 +1,181 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from dotenv import load_dotenv
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+load_dotenv()
+
+# Set to an empty string to disable the cache
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", str(Path(__file__).parent / ".embedding_cache"))
+EMBEDDING_CACHE_CAPACITY = int(os.getenv("EMBEDDING_CACHE_CAPACITY", "50000"))
+
+
+class EmbeddingCache:
+    """On-disk embedding cache keyed by (model, input_type, text hash).
+
+    Vectors live in a fixed-size, memory-mapped float32 matrix with one row
+    per slot, so the cache never grows past `capacity` rows
+    (capacity x dimension x 4 bytes on disk) and lookups read straight from
+    the page cache. A small SQLite table maps keys to slots and tracks last
+    use; once every slot is taken the least recently used entries are
+    overwritten. SQLite's locking lets several processes share one cache;
+    reads use a snapshot and take the write lock only to mark their hits used.
+    Nothing is created on disk until the cache is first used.
+    """
+
+    def __init__(
+        self,
+        path: str = EMBEDDING_CACHE_DIR,
+        capacity: int = EMBEDDING_CACHE_CAPACITY,
+        dimension: int = 1024
+    ):
+        self.path = Path(path)
+        self.capacity = capacity
+        self.dimension = dimension
+        self.vectors = None
+        self._index_path = None
+        # One connection per thread, so concurrent readers do not queue on a
+        # shared connection; SQLite arbitrates between them
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _open(self) -> None:
+        """Create or open the vector file and its index (call with the lock held)"""
+        if self.vectors is not None:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        # Files are named by shape so a resized cache starts afresh
+        shape_tag = f"{self.capacity}x{self.dimension}"
+        vectors_path = self.path / f"vectors_{shape_tag}.f32"
+        self._index_path = self.path / f"index_{shape_tag}.sqlite"
+        db = sqlite3.connect(self._index_path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, slot INTEGER UNIQUE NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        db.commit()
+        db.close()
+        self.vectors = np.memmap(
+            vectors_path,
+            dtype=np.float32,
+            mode="r+" if vectors_path.exists() else "w+",
+            shape=(self.capacity, self.dimension)
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        """This thread's connection to the index, opening the cache on first use"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            with self._lock:
+                self._open()
+                db = sqlite3.connect(self._index_path, check_same_thread=False, timeout=30)
+                self._connections.append(db)
+            self._local.db = db
+        return db
+
+    @staticmethod
+    def key(model: str, input_type: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{input_type}\0{text}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _lookup(db: sqlite3.Connection, keys: List[str]) -> Dict[str, int]:
+        slots = {}
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            slots.update(db.execute(
+                f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(batch))})",
+                batch
+            ).fetchall())
+        return slots
+
+    def get_many(self, model: str, input_type: str, texts: List[str]) -> Tuple[np.ndarray, List[int]]:
+        """Return cached vectors (rows for misses are left empty) and the indices of the misses"""
+        keys = [self.key(model, input_type, text) for text in texts]
+        found = np.empty((len(texts), self.dimension), dtype=np.float32)
+        db = self._connection()
+        # Look up and copy the hits in a deferred transaction: under WAL it
+        # reads one snapshot of the index without taking the write lock
+        db.execute("BEGIN")
+        try:
+            slots = self._lookup(db, keys)
+            for i, key in enumerate(keys):
+                if key in slots:
+                    found[i] = self.vectors[slots[key]]
+        finally:
+            db.commit()
+
+        if slots:
+            # The write lock is taken only to mark the hits as used. put_many
+            # holds it while it recycles slots, so once we have it any recycle
+            # has either committed (and remapped the slot) or not started. A hit
+            # whose slot has been remapped since the snapshot may have been read
+            # mid-overwrite, so it is served as a miss instead.
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                current = self._lookup(db, list(slots))
+                slots = {key: slot for key, slot in slots.items() if current.get(key) == slot}
+                now = time.time_ns()
+                db.executemany(
+                    "UPDATE entries SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in slots]
+                )
+                db.commit()
+            except BaseException:
+                db.rollback()
+                raise
+        missing = [i for i, key in enumerate(keys) if key not in slots]
+        return found, missing
+
+    def put_many(self, model: str, input_type: str, texts: List[str], vectors: np.ndarray) -> None:
+        entries = {self.key(model, input_type, text): vector for text, vector in zip(texts, vectors)}
+        db = self._connection()
+        # BEGIN IMMEDIATE serialises slot allocation across threads and processes
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            existing = self._lookup(db, list(entries))
+            new_keys = [key for key in entries if key not in existing][:self.capacity]
+
+            # Slots fill up densely from 0; after that, recycle the least recently used
+            next_slot = db.execute("SELECT COALESCE(MAX(slot) + 1, 0) FROM entries").fetchone()[0]
+            slots = list(range(next_slot, min(next_slot + len(new_keys), self.capacity)))
+            evict = len(new_keys) - len(slots)
+            if evict > 0:
+                victims = db.execute(
+                    "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (evict,)
+                ).fetchall()
+                db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in victims])
+                slots.extend(slot for _, slot in victims)
+
+            now = time.time_ns()
+            rows = []
+            for key, slot in zip(new_keys, slots):
+                self.vectors[slot] = entries[key]
+                rows.append((key, slot, now))
+            self.vectors.flush()
+            db.executemany(
+                "INSERT INTO entries (key, slot, last_used) VALUES (?, ?, ?)", rows
+            )
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+
+    def close(self) -> None:
+        with self._lock:
+            if self.vectors is None:
+                return
+            for db in self._connections:
+                db.close()
+            self.vectors.flush()
+            self.vectors = None
+            self._connections = []
+            # Threads that used the old connections open fresh ones next time
+            self._local = threading.local()
@@ -0,0 +1,203 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+from dotenv import load_dotenv
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from langchain_core.documents import Document
+from vector_index import SearchFilter
+
+load_dotenv()
+
+LEXICAL_INDEX_PATH = Path(os.getenv(
+    "LEXICAL_INDEX_PATH", Path(__file__).parent / "lexical_index.sqlite"
+))
+
+# Keep hyphenated part numbers and error codes ("F-1234", "0x8007_0005") whole
+_TOKENIZER = "unicode61 tokenchars '-_'"
+_TOKEN = re.compile(r"[\w-]+")
+
+
+def query_terms(query: str) -> List[str]:
+    """Distinct lower-cased query terms, hyphenated codes kept whole"""
+    return list(dict.fromkeys(token.lower() for token in _TOKEN.findall(query)))
+
+
+def match_expression(query: str) -> str:
+    """FTS5 query matching any query term, each quoted so punctuation is literal"""
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in query_terms(query))
+
+
+class LexicalIndex:
+    """BM25 keyword search over chunk text.
+
+    Chunks live in a plain table keyed by the same ids as their vectors; an
+    external-content FTS5 table over it is the inverted index, kept in step
+    by triggers, and ranks matches with SQLite's built-in bm25(). The file
+    is shared by the processes of one host (WAL does not work over network
+    filesystems); the backend, whose workers may run elsewhere, keeps its
+    keyword index in the database instead.
+    """
+
+    def __init__(self, path: Path = LEXICAL_INDEX_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(f"""
+            CREATE TABLE IF NOT EXISTS chunks (
+                rowid INTEGER PRIMARY KEY,
+                chunk_id TEXT UNIQUE NOT NULL,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                text, content='chunks', content_rowid='rowid', tokenize="{_TOKENIZER}"
+            );
+            CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts (rowid, text) VALUES (new.rowid, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+            END;
+        """)
+        self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def add_many(self, chunk_ids: List[str], documents: List[Document]) -> None:
+        """Index chunks, replacing any already stored under the same ids"""
+        rows = [
+            (chunk_id, doc.page_content, json.dumps(doc.metadata))
+            for chunk_id, doc in zip(chunk_ids, documents)
+        ]
+        with self._lock:
+            self._db.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(row[0],) for row in rows])
+            self._db.executemany("INSERT INTO chunks (chunk_id, text, metadata) VALUES (?, ?, ?)", rows)
+            self._db.commit()
+
+    def delete(self, chunk_ids: List[str]) -> None:
+        with self._lock:
+            self._db.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(i,) for i in chunk_ids])
+            self._db.commit()
+
+    def delete_prefix(self, prefix: str) -> None:
+        """Remove every chunk whose id starts with `prefix#`"""
+        with self._lock:
+            # '$' sorts right after '#', so this is a range scan on the id index
+            self._db.execute(
+                "DELETE FROM chunks WHERE chunk_id >= ? AND chunk_id < ?",
+                (f"{prefix}#", f"{prefix}$")
+            )
+            self._db.commit()
+
+    def update_metadata(self, chunk_id: str, values: Dict[str, Any]) -> None:
+        with self._lock:
+            row = self._db.execute("SELECT metadata FROM chunks WHERE chunk_id = ?", (chunk_id,)).fetchone()
+            if row:
+                self._db.execute(
+                    "UPDATE chunks SET metadata = ? WHERE chunk_id = ?",
+                    (json.dumps({**json.loads(row[0]), **values}), chunk_id)
+                )
+                self._db.commit()
+
+    @staticmethod
+    def _filter_clause(search_filter: SearchFilter):
+        """SQL condition equivalent to SearchFilter.matches, with its parameters"""
+        clauses, params = [], []
+        if search_filter.content_hashes:
+            clauses.append(
+                f"json_extract(c.metadata, '$.content_hash') IN ({','.join('?' * len(search_filter.content_hashes))})"
+            )
+            params.extend(search_filter.content_hashes)
+        if search_filter.document_ids:
+            clauses.append(
+                f"json_extract(c.metadata, '$.document_id') IN ({','.join('?' * len(search_filter.document_ids))})"
+            )
+            params.extend(search_filter.document_ids)
+        if search_filter.include_shared:
+            clauses.append("json_extract(c.metadata, '$.document_id') IS NULL")
+        return " OR ".join(clauses), params
+
+    def search(self, query: str, top_k: int = 4, search_filter: Optional[SearchFilter] = None) -> List[Document]:
+        expression = match_expression(query)
+        if not expression or (search_filter is not None and search_filter.is_empty):
+            return []
+        sql = (
+            "SELECT c.chunk_id, c.text, c.metadata, bm25(chunks_fts) AS rank "
+            "FROM chunks_fts JOIN chunks c ON c.rowid = chunks_fts.rowid "
+            "WHERE chunks_fts MATCH ?"
+        )
+        params = [expression]
+        if search_filter is not None:
+            clause, filter_params = self._filter_clause(search_filter)
+            sql += f" AND ({clause})"
+            params.extend(filter_params)
+        with self._lock:
+            rows = self._db.execute(sql + " ORDER BY rank LIMIT ?", (*params, top_k)).fetchall()
+        # bm25() is negative, lower is better
+        return [
+            Document(
+                page_content=text,
+                metadata={**json.loads(metadata), "chunk_id": chunk_id, "bm25": -rank}
+            )
+            for chunk_id, text, metadata, rank in rows
+        ]
+
+    async def asearch(self, query: str, top_k: int = 4, search_filter: Optional[SearchFilter] = None) -> List[Document]:
+        return await asyncio.to_thread(self.search, query, top_k, search_filter)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], top_k: int, k: int = 60) -> List[Document]:
+    """Merge ranked lists, scoring each chunk by the sum of 1 / (k + rank).
+
+    Chunks are matched across lists by their text, which is identical
+    whichever index returned them.
+    """
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            scores[doc.page_content] = scores.get(doc.page_content, 0.0) + 1.0 / (k + rank)
+            documents.setdefault(doc.page_content, doc)
+    best = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return [
+        Document(page_content=text, metadata={**documents[text].metadata, "rrf_score": scores[text]})
+        for text in best
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the BM25 index from an embedded corpus")
+    parser.add_argument("corpus", type=Path, nargs="?", default=Path("cohere_embedded_docs.json"))
+    parser.add_argument("--index", type=Path, default=LEXICAL_INDEX_PATH)
+    args = parser.parse_args()
+
+    from corpus_store import open_corpus
+    from embed_n_store import corpus_chunk_ids, load_manifest
+    corpus = open_corpus(args.corpus)
+    # Keyed like the chunks' vectors, so hybrid search can join the two
+    chunk_ids = corpus_chunk_ids(corpus, load_manifest())
+    index = LexicalIndex(args.index)
+    # Earlier builds keyed chunks by corpus row
+    for prefix in {"corpus"} | {chunk_id.split("#", 1)[0] for chunk_id in chunk_ids}:
+        index.delete_prefix(prefix)
+    index.add_many(
+        list(chunk_ids),
+        [Document(page_content=corpus.text(i), metadata=corpus.metadata(i)) for i in chunk_ids.values()]
+    )
+    print(f"Indexed {len(chunk_ids)} chunks into {args.index} ({len(index)} total)")
+    index.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import argparse
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+import numpy as np
+from dotenv import load_dotenv
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+load_dotenv()
+
+ROUTES = ("retrieval", "naive", "tools")
+
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "true").lower() == "true"
+ROUTER_MODEL_PATH = Path(os.getenv(
+    "ROUTER_MODEL_PATH", Path(__file__).parent / "query_router.npz"
+))
+ROUTER_LOG_PATH = Path(os.getenv(
+    "ROUTER_LOG_PATH", Path(__file__).parent / "routing_log.sqlite"
+))
+# Below this probability for its best route the router defers to the LLM
+ROUTER_CONFIDENCE = float(os.getenv("ROUTER_CONFIDENCE", "0.8"))
+
+# Hashed unigram and bigram counts alongside the query embedding
+HASH_BUCKETS = 512
+_TOKEN = re.compile(r"[a-z0-9']+")
+
+
+def lexical_features(query: str) -> np.ndarray:
+    """Hashed word and word-pair counts (unit length), plus query length and '?'"""
+    tokens = _TOKEN.findall(query.lower())
+    features = np.zeros(HASH_BUCKETS + 2, dtype=np.float32)
+    for term in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+        # crc32 rather than hash(): buckets must agree across processes
+        features[zlib.crc32(term.encode("utf-8")) % HASH_BUCKETS] += 1
+    features[:HASH_BUCKETS] /= max(float(np.linalg.norm(features[:HASH_BUCKETS])), 1.0)
+    features[HASH_BUCKETS] = math.log1p(len(tokens)) / 4
+    features[HASH_BUCKETS + 1] = float("?" in query)
+    return features
+
+
+def route_features(query: str, query_vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(query_vector, dtype=np.float32)
+    vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+    return np.concatenate([vector, lexical_features(query)])
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def fit(features: np.ndarray, labels: np.ndarray, iterations: int = 500, rate: float = 1.0, l2: float = 1e-3):
+    """Multinomial logistic regression by full-batch gradient descent; returns (weights, bias)"""
+    targets = np.eye(len(ROUTES), dtype=np.float32)[labels]
+    # Weight classes inversely to frequency so rare routes are not ignored
+    counts = np.bincount(labels, minlength=len(ROUTES)).astype(np.float32)
+    sample_weights = (len(labels) / (len(ROUTES) * np.maximum(counts, 1)))[labels][:, None]
+    weights = np.zeros((features.shape[1], len(ROUTES)), dtype=np.float32)
+    bias = np.zeros(len(ROUTES), dtype=np.float32)
+    for _ in range(iterations):
+        error = (_softmax(features @ weights + bias) - targets) * sample_weights / len(labels)
+        weights -= rate * (features.T @ error + l2 * weights)
+        bias -= rate * error.sum(axis=0)
+    return weights, bias
+
+
+class RoutingLog:
+    """Routing decisions made by the LLM, kept as training data for the router"""
+
+    def __init__(self, path: Path = ROUTER_LOG_PATH):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS decisions (
+                query TEXT NOT NULL,
+                route TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._db.commit()
+
+    def record(self, query: str, route: str) -> None:
+        if route not in ROUTES:
+            return
+        with self._lock:
+            self._db.execute("INSERT INTO decisions VALUES (?, ?, ?)", (query, route, time.time()))
+            self._db.commit()
+
+    def decisions(self) -> List[Tuple[str, str]]:
+        """Latest route per distinct query"""
+        with self._lock:
+            rows = self._db.execute("SELECT query, route FROM decisions ORDER BY created_at").fetchall()
+        return list(dict(rows).items())
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class QueryRouter:
+    """Picks a route from the query embedding and words, without an LLM call.
+
+    A linear softmax model over route_features, trained offline (see main)
+    from the LLM's logged decisions. Until a model file exists, or when the
+    best route's probability is under `confidence`, `predict` returns None
+    and the caller asks the LLM, whose answer is logged for the next
+    training run.
+    """
+
+    def __init__(
+        self,
+        model_path: Path = ROUTER_MODEL_PATH,
+        log_path: Path = ROUTER_LOG_PATH,
+        confidence: float = ROUTER_CONFIDENCE
+    ):
+        self.confidence = confidence
+        self.log = RoutingLog(log_path)
+        self.weights = self.bias = None
+        if Path(model_path).exists():
+            model = np.load(model_path)
+            self.weights, self.bias = model["weights"], model["bias"]
+
+    @property
+    def ready(self) -> bool:
+        return self.weights is not None
+
+    def probabilities(self, query: str, query_vector: np.ndarray) -> np.ndarray:
+        return _softmax(route_features(query, query_vector) @ self.weights + self.bias)
+
+    def predict(self, query: str, query_vector: np.ndarray) -> Tuple[Optional[str], float]:
+        """(route, probability), with route None when the LLM should decide"""
+        if not self.ready:
+            return None, 0.0
+        probabilities = self.probabilities(query, query_vector)
+        best = int(np.argmax(probabilities))
+        confidence = float(probabilities[best])
+        return (ROUTES[best] if confidence >= self.confidence else None), confidence
+
+    def record(self, query: str, route: str) -> None:
+        self.log.record(query, route)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the query router from logged LLM routing decisions")
+    parser.add_argument("--log", type=Path, default=ROUTER_LOG_PATH)
+    parser.add_argument("--model", type=Path, default=ROUTER_MODEL_PATH)
+    parser.add_argument("--confidence", type=float, default=ROUTER_CONFIDENCE)
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of decisions kept aside for evaluation")
+    args = parser.parse_args()
+
+    log = RoutingLog(args.log)
+    decisions = log.decisions()
+    log.close()
+    if len(decisions) < 20:
+        print(f"Only {len(decisions)} logged decisions; keep serving with the LLM router for now")
+        return
+
+    from embedder import embedder
+    queries = [query for query, _ in decisions]
+    # Served from the embedding cache for queries that went through retrieval
+    vectors = embedder.embed(queries, "search_query")
+    features = np.stack([route_features(q, v) for q, v in zip(queries, vectors)])
+    labels = np.array([ROUTES.index(route) for _, route in decisions])
+
+    order = np.random.default_rng(0).permutation(len(labels))
+    split = int(len(labels) * (1 - args.holdout))
+    train, test = order[:split], order[split:]
+    weights, bias = fit(features[train], labels[train])
+    probabilities = _softmax(features[test] @ weights + bias)
+    predicted, confidence = probabilities.argmax(axis=1), probabilities.max(axis=1)
+    confident = confidence >= args.confidence
+    print(f"{len(labels)} decisions ({dict(zip(ROUTES, np.bincount(labels, minlength=len(ROUTES)).tolist()))})")
+    print(f"Holdout accuracy {np.mean(predicted == labels[test]):.3f}")
+    print(
+        f"At confidence {args.confidence}: {confident.mean():.1%} routed locally, "
+        f"{np.mean(predicted[confident] == labels[test][confident]) if confident.any() else float('nan'):.3f} accurate"
+    )
+
+    weights, bias = fit(features, labels)
+    np.savez(args.model, weights=weights, bias=bias)
+    print(f"Saved router to {args.model}")
+
+if __name__ == "__main__":
+    main()
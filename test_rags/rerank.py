@@ -0,0 +1,124 @@
+import os
+import numpy as np
+from dotenv import load_dotenv
+from typing import Dict, List, Tuple
+from langchain_core.documents import Document
+
+load_dotenv()
+
+# Weight of relevance against novelty in MMR (1.0 = plain relevance order)
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Shortest shared span taken as splitter overlap rather than coincidence
+MIN_OVERLAP_CHARS = 40
+
+
+def mmr_select(relevance: np.ndarray, vectors: np.ndarray, k: int, lambda_mult: float = MMR_LAMBDA) -> np.ndarray:
+    """Indices of up to k candidates in maximal-marginal-relevance order.
+
+    Pairwise similarities come from a single matrix product; each greedy
+    step is then one vectorized update of every candidate's similarity to
+    its closest already-selected neighbour.
+    """
+    k = min(k, len(relevance))
+    if k == 0:
+        return np.empty(0, dtype=int)
+    similarity = vectors @ vectors.T
+    redundancy = np.zeros(len(relevance), dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+    selected = []
+    for step in range(k):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = similarity[best] if step == 0 else np.maximum(redundancy, similarity[best])
+    return np.array(selected)
+
+
+def overlap_length(first: str, second: str, min_chars: int = MIN_OVERLAP_CHARS) -> int:
+    """Length of the longest suffix of `first` that is a prefix of `second`"""
+    probe = second[:min_chars]
+    if len(probe) < min_chars:
+        return 0
+    position = first.find(probe)
+    while position != -1:
+        # The leftmost match that runs to the end of `first` is the longest overlap
+        if second.startswith(first[position:]):
+            return len(first) - position
+        position = first.find(probe, position + 1)
+    return 0
+
+
+def _merge(first: str, second: str) -> str:
+    """Join two windows of the same page if they overlap or nest, else None"""
+    if second in first:
+        return first
+    if first in second:
+        return second
+    overlap = overlap_length(first, second)
+    if overlap:
+        return first + second[overlap:]
+    overlap = overlap_length(second, first)
+    if overlap:
+        return second + first[overlap:]
+    return None
+
+
+def overlapping_spans(documents: List[Document]) -> List[Tuple[str, List[int]]]:
+    """Group windows of the same page that overlap or nest into merged spans.
+
+    Returns (span text, member indices) per span, ordered by each span's
+    first member, so spans keep the order of the input. Windows are matched
+    on shared text (the splitter overlaps neighbours by up to chunk_overlap
+    characters); chunks carry no offsets, so neighbours that the splitter
+    cut without any overlap stay separate spans.
+    """
+    spans: List[Dict] = []
+    for i, doc in enumerate(documents):
+        page = (doc.metadata.get("source"), doc.metadata.get("page"))
+        span = {"page": page, "text": doc.page_content, "members": [i]}
+        # Merging can make two earlier spans adjacent, so keep joining until nothing changes
+        merged = True
+        while merged:
+            merged = False
+            for other in spans:
+                if other["page"] != page:
+                    continue
+                text = _merge(other["text"], span["text"])
+                if text is not None:
+                    spans.remove(other)
+                    span = {"page": page, "text": text, "members": other["members"] + span["members"]}
+                    merged = True
+                    break
+        spans.append(span)
+    spans.sort(key=lambda span: min(span["members"]))
+    return [(span["text"], span["members"]) for span in spans]
+
+
+def collapse_overlaps(
+    documents: List[Document],
+    vectors: np.ndarray,
+    relevance: np.ndarray
+) -> Tuple[List[Document], np.ndarray, np.ndarray]:
+    """Merge overlapping windows of the same page into single spans.
+
+    A merged span keeps the metadata of its most relevant window, the
+    highest relevance among them and the normalized mean of their vectors.
+    """
+    spans = overlapping_spans(documents)
+    merged_documents, merged_vectors, merged_relevance = [], [], []
+    for text, members in spans:
+        lead = max(members, key=lambda i: relevance[i])
+        metadata = dict(documents[lead].metadata)
+        if len(members) > 1:
+            metadata["merged_chunks"] = len(members)
+        merged_documents.append(Document(page_content=text, metadata=metadata))
+        vector = vectors[members].mean(axis=0)
+        merged_vectors.append(vector / max(float(np.linalg.norm(vector)), 1e-12))
+        merged_relevance.append(relevance[members].max())
+    return (
+        merged_documents,
+        np.asarray(merged_vectors, dtype=np.float32).reshape(len(spans), vectors.shape[1]),
+        np.asarray(merged_relevance, dtype=np.float32)
+    )
@@ -0,0 +1,248 @@
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+from dotenv import load_dotenv
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from corpus_store import CorpusWriter, open_corpus
+from embedder import EMBED_MODEL, embedder
+from embed_n_retrieve import DocumentRetriever
+from lexical_index import LexicalIndex
+from vector_index import ExactIndex, HNSWIndex, QuantizedIndex, VectorIndex, LOCAL_CORPUS_PATH
+
+load_dotenv()
+
+BENCHMARK_QUERIES_PATH = Path(__file__).parent / "retrieval_queries.json"
+# The labelled queries' embeddings, kept next to them so a run makes no API calls
+QUERY_EMBEDDINGS_PATH = Path(__file__).parent / "retrieval_queries.npz"
+GUIDE_PATH = Path(__file__).parent / "guides" / "HPguide.pdf"
+
+BACKENDS = {
+    "exact": ExactIndex,
+    "hnsw": HNSWIndex,
+    "int8": lambda corpus: QuantizedIndex(corpus, "int8"),
+    "binary": lambda corpus: QuantizedIndex(corpus, "binary")
+}
+# Retrieval pipelines on top of the vector index: (hybrid, diversify)
+MODES = {
+    "dense": (False, False),
+    "hybrid": (True, False),
+    "mmr": (False, True),
+    "hybrid+mmr": (True, True)
+}
+# BM25 alone: the keyword side of hybrid, and the only mode that needs no query embeddings
+LEXICAL_MODE = "lexical"
+
+
+def load_queries(path: Path = BENCHMARK_QUERIES_PATH) -> List[Dict[str, Any]]:
+    """Labelled queries: each has the guide pages that answer it"""
+    with open(path) as f:
+        return json.load(f)["queries"]
+
+
+def load_query_vectors(texts: List[str], path: Path = QUERY_EMBEDDINGS_PATH) -> Optional[np.ndarray]:
+    """The stored embeddings of `texts`, in order, or None if there are none for them"""
+    if not path.exists():
+        print(f"{path.name} not found (create it with --embed-queries)")
+        return None
+    with np.load(path) as stored:
+        if str(stored["model"]) != EMBED_MODEL or list(stored["queries"]) != texts:
+            print(f"{path.name} does not match the queries or {EMBED_MODEL} (recreate it with --embed-queries)")
+            return None
+        return stored["vectors"].astype(np.float32)
+
+
+def embed_queries(texts: List[str], path: Path = QUERY_EMBEDDINGS_PATH) -> None:
+    """Embed the labelled queries and store them, after the query set or model changes"""
+    vectors = embedder.embed(texts, "search_query")
+    np.savez(path, queries=np.array(texts), vectors=vectors.astype(np.float32), model=np.array(EMBED_MODEL))
+    print(f"Wrote {len(texts)} query embeddings to {path.name}")
+
+
+def chunked_corpus(chunk_size: int, guide: Path = GUIDE_PATH) -> Path:
+    """Binary corpus of the guide split at `chunk_size`, built on first use.
+
+    Split like embed_n_store (20% overlap) and embedded through the cached
+    embedder, so only the first build of each size calls the API.
+    """
+    path = Path(__file__).parent / f"{guide.stem}-{chunk_size}.corpus"
+    if path.exists():
+        return path
+
+    from langchain_community.document_loaders import PyPDFLoader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_size // 5,
+        separators=["\n\n", "\n", " ", ""]
+    )
+    pages = PyPDFLoader(str(guide)).load()
+    chunks = [chunk for page in pages for chunk in splitter.split_documents([page])]
+    embeddings = embedder.embed([chunk.page_content for chunk in chunks], "search_document")
+
+    writer = CorpusWriter(path, embeddings.shape[1], metadata={"chunk_size": chunk_size})
+    document = writer.add_document(str(guide), len(pages), {"source": str(guide)})
+    for chunk, embedding in zip(chunks, embeddings):
+        writer.append(document, chunk.page_content, chunk.metadata, embedding)
+    writer.close()
+    print(f"Built {path.name}: {len(chunks)} chunks")
+    return path
+
+
+def recall_and_rank(results: List[List[Document]], labels: List[List[int]]) -> Dict[str, float]:
+    """Share of labelled pages found, and mean reciprocal rank of the first relevant result"""
+    recall, reciprocal_ranks = [], []
+    for documents, pages in zip(results, labels):
+        found = [doc.metadata.get("page") for doc in documents]
+        recall.append(len(set(found) & set(pages)) / len(pages))
+        first = next((rank for rank, page in enumerate(found, start=1) if page in pages), None)
+        reciprocal_ranks.append(1.0 / first if first else 0.0)
+    return {"recall": float(np.mean(recall)), "mrr": float(np.mean(reciprocal_ranks))}
+
+
+async def _timed_search(
+    retriever: DocumentRetriever,
+    queries: List[str],
+    query_vectors: np.ndarray,
+    top_k: int
+) -> Tuple[List[List[Document]], np.ndarray]:
+    """Search one query at a time, as the chat path does, timing each"""
+    results, latencies = [], []
+    for query, vector in zip(queries, query_vectors):
+        start = time.perf_counter()
+        documents = (await retriever.asearch_embedded([query], vector[None], top_k))[0]
+        latencies.append(time.perf_counter() - start)
+        results.append(documents)
+    return results, np.array(latencies) * 1000
+
+
+async def _timed_lexical_search(
+    lexical: LexicalIndex,
+    queries: List[str],
+    top_k: int
+) -> Tuple[List[List[Document]], np.ndarray]:
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        documents = await lexical.asearch(query, top_k)
+        latencies.append(time.perf_counter() - start)
+        results.append(documents)
+    return results, np.array(latencies) * 1000
+
+
+def _row(corpus_name, corpus, backend, mode, top_k, results, labels, latencies, memory_bytes, build_seconds):
+    return {
+        "corpus": corpus_name,
+        "chunks": len(corpus),
+        "backend": backend,
+        "mode": mode,
+        "top_k": top_k,
+        **recall_and_rank(results, labels),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "memory_mb": memory_bytes / 1e6,
+        "build_s": build_seconds
+    }
+
+
+def run(
+    corpora: Dict[str, Path],
+    backends: List[str],
+    modes: List[str],
+    top_ks: List[int],
+    queries: List[Dict[str, Any]],
+    query_vectors: Optional[np.ndarray]
+) -> List[Dict[str, Any]]:
+    """Benchmark rows per corpus, backend, mode and top_k; vector modes are skipped without query_vectors"""
+    texts = [item["query"] for item in queries]
+    labels = [item["pages"] for item in queries]
+
+    rows = []
+    for corpus_name, corpus_path in corpora.items():
+        corpus = open_corpus(corpus_path)
+        lexical = LexicalIndex(Path(":memory:"))
+        lexical.add_many(
+            [f"corpus#{i}" for i in range(len(corpus))],
+            [Document(page_content=corpus.text(i), metadata=corpus.metadata(i)) for i in range(len(corpus))]
+        )
+        if LEXICAL_MODE in modes:
+            for top_k in top_ks:
+                results, latencies = asyncio.run(_timed_lexical_search(lexical, texts, top_k))
+                rows.append(_row(corpus_name, corpus, "bm25", LEXICAL_MODE, top_k, results, labels, latencies, 0, 0.0))
+        vector_modes = [mode for mode in modes if mode in MODES] if query_vectors is not None else []
+        for backend in backends if vector_modes else []:
+            start = time.perf_counter()
+            index: VectorIndex = BACKENDS[backend](corpus)
+            build_seconds = time.perf_counter() - start
+            for mode in vector_modes:
+                hybrid, diversify = MODES[mode]
+                retriever = DocumentRetriever(
+                    backend, embedder, hybrid=hybrid, diversify=diversify, retriever=index, lexical=lexical
+                )
+                for top_k in top_ks:
+                    results, latencies = asyncio.run(_timed_search(retriever, texts, query_vectors, top_k))
+                    rows.append(_row(
+                        corpus_name, corpus, backend, mode, top_k, results, labels, latencies,
+                        index.memory_bytes, build_seconds
+                    ))
+        lexical.close()
+    return rows
+
+
+def print_table(rows: List[Dict[str, Any]]) -> None:
+    header = f"{'corpus':<16}{'backend':<8}{'mode':<12}{'k':>3}{'recall':>8}{'MRR':>7}{'p50 ms':>9}{'p95 ms':>9}{'mem MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(
+            f"{row['corpus']:<16}{row['backend']:<8}{row['mode']:<12}{row['top_k']:>3}"
+            f"{row['recall']:>8.3f}{row['mrr']:>7.3f}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}"
+            f"{row['memory_mb']:>9.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Offline retrieval benchmark: labelled guide queries against each backend and setting"
+    )
+    parser.add_argument("--queries", type=Path, default=BENCHMARK_QUERIES_PATH)
+    parser.add_argument("--corpus", type=Path, default=LOCAL_CORPUS_PATH,
+                        help="Pre-embedded corpus benchmarked as 'bundled'")
+    parser.add_argument("--chunk-sizes", type=int, nargs="*", default=[],
+                        help="Also re-split the guide at these chunk sizes (embedded once, then cached)")
+    parser.add_argument("--backends", nargs="+", choices=list(BACKENDS), default=list(BACKENDS))
+    parser.add_argument("--modes", nargs="+", choices=[LEXICAL_MODE] + list(MODES),
+                        default=[LEXICAL_MODE, "dense", "hybrid"])
+    parser.add_argument("--top-k", type=int, nargs="+", default=[1, 4, 10])
+    parser.add_argument("--output", type=Path, help="Also write the results as JSON, e.g. to compare runs")
+    parser.add_argument("--query-embeddings", type=Path, default=QUERY_EMBEDDINGS_PATH)
+    parser.add_argument("--embed-queries", action="store_true",
+                        help="(Re)create the stored query embeddings through the API, then exit")
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    texts = [item["query"] for item in queries]
+    if args.embed_queries:
+        embed_queries(texts, args.query_embeddings)
+        return
+    query_vectors = load_query_vectors(texts, args.query_embeddings)
+    if query_vectors is None:
+        print(f"Benchmarking the {LEXICAL_MODE} mode only; vector modes need the query embeddings\n")
+
+    corpora = {"bundled": args.corpus}
+    for chunk_size in args.chunk_sizes:
+        corpora[f"chunks-{chunk_size}"] = chunked_corpus(chunk_size)
+
+    rows = run(corpora, args.backends, args.modes, args.top_k, queries, query_vectors)
+    print(f"{len(queries)} labelled queries\n")
+    print_table(rows)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(rows, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import asyncio
+import os
+import uuid
+from dotenv import load_dotenv
+from typing import Any, Awaitable, Dict, Optional
+
+load_dotenv()
+
+# Start retrieval while the LLM is still choosing the route
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "true").lower() == "true"
+# How long a finished speculation waits to be claimed before it is dropped
+SPECULATION_TTL_SECONDS = float(os.getenv("SPECULATION_TTL_SECONDS", "30"))
+
+
+class SpeculativeSearches:
+    """Work started before it is known to be needed, claimed or discarded by key.
+
+    Keys travel through graph state (tasks themselves cannot be
+    checkpointed). Counters record how often a speculation was used (hit),
+    thrown away because another branch won (miss), already finished when
+    claimed, i.e. fully hidden behind the routing call (overlapped), failed
+    so the caller had to do the work itself, or was never claimed: a run
+    that ends early (client gone, routing failed) neither claims nor
+    discards, so finished work is dropped after `ttl_seconds`.
+    """
+
+    def __init__(self, ttl_seconds: float = SPECULATION_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.overlapped = 0
+        self.failed = 0
+        self.expired = 0
+
+    def start(self, work: Awaitable) -> str:
+        key = str(uuid.uuid4())
+        task = asyncio.ensure_future(work)
+        # A discarded task's failure is of no interest; don't let asyncio log it
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        task.add_done_callback(lambda t: t.get_loop().call_later(self.ttl_seconds, self._expire, key))
+        self._tasks[key] = task
+        self.started += 1
+        return key
+
+    def _expire(self, key: str) -> None:
+        if self._tasks.pop(key, None) is not None:
+            self.expired += 1
+
+    async def claim(self, key: Optional[str]) -> Optional[Any]:
+        """Result of the speculation under `key`, or None if there is none or it failed"""
+        task = self._tasks.pop(key, None) if key else None
+        if task is None:
+            return None
+        finished = task.done()
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise  # the caller itself was cancelled
+            result = None
+        except Exception as e:
+            # Speculation only saves time; the caller searches again
+            print(f"Speculative work failed, redoing it: {e}")
+            result = None
+        if result is None:
+            self.failed += 1
+        else:
+            self.hits += 1
+            self.overlapped += finished
+        return result
+
+    def discard(self, key: Optional[str]) -> None:
+        task = self._tasks.pop(key, None) if key else None
+        if task is None:
+            return
+        task.cancel()
+        self.misses += 1
+
+    def stats(self) -> Dict[str, Any]:
+        resolved = self.hits + self.misses
+        return {
+            "started": self.started,
+            "hits": self.hits,
+            "misses": self.misses,
+            "failed": self.failed,
+            "expired": self.expired,
+            "pending": len(self._tasks),
+            "hit_rate": self.hits / resolved if resolved else 0.0,
+            "overlap_rate": self.overlapped / self.hits if self.hits else 0.0
+        }
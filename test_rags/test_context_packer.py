@@ -0,0 +1,63 @@
+from langchain_core.documents import Document
+from context_packer import MIN_PARTIAL_TOKENS, SEPARATOR, pack_context
+
+SENTENCES = " ".join(f"Check valve {i} before restarting the pump." for i in range(60))
+
+
+def _doc(text: str, page: int = 1) -> Document:
+    return Document(page_content=text, metadata={"source": "pump.pdf", "page": page})
+
+
+def _pack(documents, budget):
+    # One token per character keeps the arithmetic exact
+    return pack_context(documents, budget=budget, count=len)
+
+
+def test_everything_fits_in_relevance_order():
+    packed = _pack([_doc("a" * 50, page=1), _doc("b" * 30, page=2)], budget=200)
+
+    assert packed.text == "a" * 50 + SEPARATOR + "b" * 30
+    assert packed.tokens == 50 + len(SEPARATOR) + 30
+    assert [doc.metadata["page"] for doc in packed.included] == [1, 2]
+    assert packed.dropped == []
+
+
+def test_span_that_does_not_fit_is_dropped_and_smaller_ones_still_fill_the_budget():
+    documents = [_doc("a" * 60, page=1), _doc("b" * 50, page=2), _doc("c" * 20, page=3)]
+
+    packed = _pack(documents, budget=85)
+
+    assert packed.text == "a" * 60 + SEPARATOR + "c" * 20
+    assert packed.tokens == 82
+    assert packed.dropped == [{"source": "pump.pdf", "page": 2, "tokens": 50, "reason": "over budget"}]
+
+
+def test_span_is_cut_at_a_sentence_when_enough_budget_remains():
+    budget = MIN_PARTIAL_TOKENS + 150
+
+    packed = _pack([_doc(SENTENCES)], budget=budget)
+
+    (cut,) = packed.included
+    assert cut.metadata["truncated"]
+    assert SENTENCES.startswith(cut.page_content)
+    assert cut.page_content.endswith("pump.")
+    assert budget - len("Check valve 10 before restarting the pump. ") < packed.tokens <= budget
+    assert packed.dropped[0]["reason"] == "truncated"
+    assert packed.dropped[0]["tokens"] == len(SENTENCES) - len(cut.page_content)
+
+
+def test_too_little_room_to_cut_drops_the_span():
+    packed = _pack([_doc("a" * 60, page=1), _doc(SENTENCES, page=2)], budget=60 + MIN_PARTIAL_TOKENS)
+
+    assert packed.text == "a" * 60
+    assert packed.dropped[0]["reason"] == "over budget"
+
+
+def test_overlapping_windows_of_a_page_are_paid_for_once():
+    documents = [_doc(SENTENCES[:300]), _doc(SENTENCES[200:500]), _doc(SENTENCES[200:500], page=2)]
+
+    packed = _pack(documents, budget=2000)
+
+    assert packed.text == SENTENCES[:500] + SEPARATOR + SENTENCES[200:500]
+    assert packed.included[0].metadata["merged_chunks"] == 2
+    assert packed.tokens == 500 + len(SEPARATOR) + 300
@@ -0,0 +1,77 @@
+import asyncio
+import numpy as np
+from langchain_core.documents import Document
+from embed_n_retrieve import DocumentRetriever
+from vector_index import Retriever
+
+
+class _Retriever(Retriever):
+    """Fixed vector hits, and stored vectors for the ids in `stored`"""
+
+    def __init__(self, hits, stored=None):
+        self.hits = hits
+        self.stored = stored or {}
+        self.fetched = []
+
+    def search_with_vectors(self, query_vector, top_k=4, search_filter=None):
+        documents = [Document(page_content=text, metadata={"score": score}) for text, score, _ in self.hits]
+        return documents[:top_k], np.array([vector for _, _, vector in self.hits], dtype=np.float32)[:top_k]
+
+    def vectors_for(self, chunk_ids):
+        self.fetched.extend(chunk_ids)
+        return {chunk_id: self.stored[chunk_id] for chunk_id in chunk_ids if chunk_id in self.stored}
+
+
+class _Lexical:
+    def __init__(self, hits):
+        self.hits = hits
+
+    async def asearch(self, query, top_k=4, search_filter=None):
+        return [Document(page_content=text, metadata={"chunk_id": chunk_id}) for chunk_id, text in self.hits][:top_k]
+
+
+class _NoEmbedder:
+    dimension = 3
+
+    async def aembed(self, texts, input_type):
+        raise AssertionError("candidates must not be embedded at query time")
+
+
+def _search(retriever, lexical, top_k, mmr_lambda=0.7):
+    searcher = DocumentRetriever(
+        "exact", _NoEmbedder(), hybrid=True, diversify=True, mmr_lambda=mmr_lambda,
+        retriever=retriever, lexical=lexical
+    )
+    query_vector = np.array([[1.0, 0.0, 0.0]], dtype=np.float32)
+    return asyncio.run(searcher.asearch_embedded(["reset the router"], query_vector, top_k))[0]
+
+
+# Two near-identical vector hits, so MMR has a redundant candidate to skip
+_HITS = [
+    ("Hold the reset button for ten seconds.", 0.9, [1.0, 0.0, 0.0]),
+    ("Hold the reset button for 10 seconds.", 0.89, [0.99, 0.14, 0.0])
+]
+
+
+def test_keyword_only_hit_without_a_stored_vector_survives_mmr():
+    retriever = _Retriever(_HITS)
+    lexical = _Lexical([("manual#7", "Router model RT-200: reset procedure")])
+
+    results = _search(retriever, lexical, top_k=2)
+
+    assert "Router model RT-200: reset procedure" in [doc.page_content for doc in results]
+    assert retriever.fetched == ["manual#7"]
+
+
+def test_keyword_only_hit_uses_its_stored_vector():
+    # The keyword hit fuses level with the top hit, but its stored vector
+    # duplicates it, so a novelty-weighted MMR takes the other vector hit
+    retriever = _Retriever(_HITS[:1] + [("Unplug the router first.", 0.5, [0.0, 1.0, 0.0])],
+                           stored={"manual#7": np.array([1.0, 0.0, 0.0], dtype=np.float32)})
+    lexical = _Lexical([("manual#7", "Hold reset: ten seconds.")])
+
+    results = _search(retriever, lexical, top_k=2, mmr_lambda=0.3)
+
+    texts = [doc.page_content for doc in results]
+    assert texts[0] == "Hold the reset button for ten seconds."
+    assert "Unplug the router first." in texts
@@ -0,0 +1,109 @@
+import asyncio
+import numpy as np
+from langchain_core.documents import Document
+import embed_n_store
+from embed_n_store import corpus_chunk_ids, document_key, embed_chunk_diff
+
+
+class _Corpus:
+    """The parts of corpus_store.Corpus that corpus_chunk_ids reads"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def text(self, i):
+        return self.chunks[i].page_content
+
+    def metadata(self, i):
+        return self.chunks[i].metadata
+
+
+def _embed_nothing(monkeypatch):
+    monkeypatch.setattr(embed_n_store, "embed_chunks_cohere", lambda chunks: np.zeros((len(chunks), 4)))
+
+
+def test_corpus_chunk_ids_are_the_vector_ids(monkeypatch):
+    _embed_nothing(monkeypatch)
+    chunks = [
+        Document(page_content="Open Disk Defragmenter", metadata={"page": 5}),
+        Document(page_content="Schedule Disk Cleanup", metadata={"page": 5}),
+        Document(page_content="Open Disk Defragmenter", metadata={"page": 7})
+    ]
+    result = embed_chunk_diff(embed_n_store.GUIDES_DIR / "manual.pdf", 8, chunks)
+    corpus = _Corpus([
+        Document(page_content=chunk.page_content, metadata={**chunk.metadata, "source": "guides/manual.pdf"})
+        for chunk in chunks
+    ])
+
+    ids = corpus_chunk_ids(corpus, {})
+
+    assert list(ids) == result["vector_ids"]
+    assert ids == {result["vector_ids"][0]: 0, result["vector_ids"][1]: 1}
+
+
+def test_corpus_chunk_ids_follow_the_manifest_key_after_a_rename():
+    corpus = _Corpus([Document(page_content="text", metadata={"source": "guides/new.pdf"})])
+    manifest = {"guides/new.pdf": {"key": document_key("guides/old.pdf"), "fingerprints": {}}}
+
+    (chunk_id,) = corpus_chunk_ids(corpus, manifest)
+
+    assert chunk_id.split("#")[0] == document_key("guides/old.pdf")
+
+
+class _LoopEmbedder:
+    """Embeds on the caller's loop only; the blocking path must not be used"""
+
+    def __init__(self):
+        self.loops = set()
+        self.opened = False
+
+    async def open(self):
+        self.opened = True
+
+    async def aclose(self):
+        self.opened = False
+
+    async def aembed(self, texts, input_type):
+        assert self.opened
+        self.loops.add(asyncio.get_running_loop())
+        return np.zeros((len(texts), 4), dtype=np.float32)
+
+    def embed(self, texts, input_type):
+        raise AssertionError("parallel ingestion must not start its own event loop")
+
+
+def test_parallel_ingestion_embeds_on_one_loop(monkeypatch):
+    fake = _LoopEmbedder()
+    monkeypatch.setattr(embed_n_store, "embedder", fake)
+    guide = embed_n_store.GUIDES_DIR / "HPguide.pdf"
+
+    async def run():
+        results = await embed_n_store.process_all_pdfs_parallel(
+            [guide], {}, workers=1, embed_concurrency=2, current={"guides/HPguide.pdf"}, claimed=set()
+        )
+        return results, asyncio.get_running_loop()
+
+    (result,), loop = asyncio.run(run())
+
+    assert fake.loops == {loop}
+    assert len(result["vector_ids"]) == len(result["fingerprints"]) > 0
+    assert not fake.opened
+
+
+def test_a_live_document_is_never_taken_for_a_rename():
+    chunks = [Document(page_content=f"chunk {i}", metadata={"page": 0}) for i in range(4)]
+    fingerprints = {embed_n_store.chunk_fingerprint(chunk): 0 for chunk in chunks}
+    manifest = {
+        "guides/live.pdf": {"key": document_key("guides/live.pdf"), "fingerprints": fingerprints},
+        "guides/gone.pdf": {"key": document_key("guides/gone.pdf"), "fingerprints": fingerprints}
+    }
+    current = {"guides/live.pdf", "guides/copy.pdf"}
+    claimed = set()
+
+    previous = embed_n_store.previous_entry(manifest, "guides/copy.pdf", chunks, current, claimed)
+
+    assert previous["identity"] == "guides/gone.pdf"
+    assert embed_n_store.previous_entry(manifest, "guides/other.pdf", chunks, current, claimed) is None
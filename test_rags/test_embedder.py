@@ -0,0 +1,72 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import pytest
+from embedder import BatchedEmbedder
+
+
+class _Provider:
+    """Fake embed endpoint that records its peak concurrency; the first `throttle` requests get a 429"""
+
+    def __init__(self, throttle: int = 0):
+        self.throttle = throttle
+        self.requests = 0
+        self.in_flight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        with self._lock:
+            self.requests += 1
+            throttled = self.requests <= self.throttle
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(0.01)
+        with self._lock:
+            self.in_flight -= 1
+        if throttled:
+            return httpx.Response(429, headers={"Retry-After": "0"})
+        texts = json.loads(request.content)["texts"]
+        return httpx.Response(200, json={"embeddings": [[1.0, 0.0]] * len(texts)})
+
+
+def _embedder(provider: _Provider, max_concurrency: int) -> BatchedEmbedder:
+    embedder = BatchedEmbedder(
+        api_key="test", dimension=2, max_batch_items=1, max_concurrency=max_concurrency, backoff_seconds=0
+    )
+    embedder._new_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(provider))
+    return embedder
+
+
+def test_blocking_calls_from_many_threads_share_one_limit():
+    provider = _Provider()
+    embedder = _embedder(provider, max_concurrency=2)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda i: embedder.embed([f"text {i}-{j}" for j in range(6)], "search_document"), range(4)))
+
+    assert [result.shape for result in results] == [(6, 2)] * 4
+    assert provider.peak <= 2
+
+
+def test_throttling_seen_by_one_caller_lowers_the_shared_limit():
+    provider = _Provider(throttle=1)
+    embedder = _embedder(provider, max_concurrency=4)
+
+    embedder.embed(["only text"], "search_query")
+
+    # One 429 halved the limit and the one success grew it back by one
+    assert embedder._limit.limit == 3
+    assert embedder._limit.in_flight == 0
+
+
+def test_embed_refuses_to_run_inside_an_event_loop():
+    embedder = _embedder(_Provider(), max_concurrency=2)
+
+    async def call():
+        embedder.embed(["text"], "search_query")
+
+    with pytest.raises(RuntimeError, match="aembed"):
+        asyncio.run(call())
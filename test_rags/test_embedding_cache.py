@@ -0,0 +1,92 @@
+import sqlite3
+import threading
+import time
+import numpy as np
+from embedding_cache import EmbeddingCache
+
+
+def _vectors(*values: float) -> np.ndarray:
+    return np.array([[value, value] for value in values], dtype=np.float32)
+
+
+def _cache(tmp_path, capacity: int = 2) -> EmbeddingCache:
+    return EmbeddingCache(path=str(tmp_path), capacity=capacity, dimension=2)
+
+
+def _write_lock(cache: EmbeddingCache) -> sqlite3.Connection:
+    """A second connection holding the index's write lock, as another process mid-put_many would"""
+    db = sqlite3.connect(cache._index_path, check_same_thread=False, timeout=30)
+    db.execute("BEGIN IMMEDIATE")
+    return db
+
+
+def test_get_many_returns_hits_and_reports_misses(tmp_path):
+    cache = _cache(tmp_path)
+    cache.put_many("model", "search_document", ["a", "b"], _vectors(1, 2))
+
+    found, missing = cache.get_many("model", "search_document", ["b", "c", "a"])
+
+    assert missing == [1]
+    assert found[0].tolist() == [2, 2]
+    assert found[2].tolist() == [1, 1]
+    # Same text under another input type is a different entry
+    assert cache.get_many("model", "search_query", ["a"])[1] == [0]
+    cache.close()
+
+
+def test_put_many_evicts_the_least_recently_used_entry(tmp_path):
+    cache = _cache(tmp_path)
+    cache.put_many("model", "search_document", ["a"], _vectors(1))
+    cache.put_many("model", "search_document", ["b"], _vectors(2))
+    # Reading "a" makes "b" the least recently used
+    cache.get_many("model", "search_document", ["a"])
+
+    cache.put_many("model", "search_document", ["c"], _vectors(3))
+
+    found, missing = cache.get_many("model", "search_document", ["a", "b", "c"])
+    assert missing == [1]
+    assert found[0].tolist() == [1, 1]
+    assert found[2].tolist() == [3, 3]
+    cache.close()
+
+
+def test_misses_are_served_while_another_writer_holds_the_lock(tmp_path):
+    cache = _cache(tmp_path)
+    cache.put_many("model", "search_document", ["a"], _vectors(1))
+    writer = _write_lock(cache)
+    result = []
+    reader = threading.Thread(target=lambda: result.append(cache.get_many("model", "search_document", ["x"])))
+
+    reader.start()
+    reader.join(timeout=2)
+
+    assert not reader.is_alive()
+    assert result[0][1] == [0]
+    writer.rollback()
+    writer.close()
+    cache.close()
+
+
+def test_hit_whose_slot_is_recycled_during_the_read_becomes_a_miss(tmp_path):
+    cache = _cache(tmp_path, capacity=1)
+    cache.put_many("model", "search_document", ["a"], _vectors(1))
+    # Another process has started recycling the slot of "a" for "b"
+    writer = _write_lock(cache)
+    cache.vectors[0] = _vectors(2)[0]
+    result = []
+    reader = threading.Thread(target=lambda: result.append(cache.get_many("model", "search_document", ["a"])))
+
+    reader.start()
+    # The reader copies the slot from its snapshot, then waits for the lock to mark the hit
+    time.sleep(0.2)
+    writer.execute("DELETE FROM entries WHERE key = ?", (cache.key("model", "search_document", "a"),))
+    writer.execute(
+        "INSERT INTO entries (key, slot, last_used) VALUES (?, 0, ?)",
+        (cache.key("model", "search_document", "b"), time.time_ns())
+    )
+    writer.commit()
+    reader.join(timeout=5)
+
+    assert result[0][1] == [0]
+    writer.close()
+    cache.close()
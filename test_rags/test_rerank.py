@@ -0,0 +1,56 @@
+import numpy as np
+from langchain_core.documents import Document
+from rerank import collapse_overlaps, mmr_select, overlap_length, overlapping_spans
+
+PAGE = " ".join(f"step{i} of the pump maintenance procedure." for i in range(40))
+
+
+def _window(start: int, end: int, page: int = 1, **metadata) -> Document:
+    return Document(page_content=PAGE[start:end], metadata={"source": "pump.pdf", "page": page, **metadata})
+
+
+def test_overlap_length_needs_a_long_enough_shared_span():
+    assert overlap_length(PAGE[:300], PAGE[200:500]) == 100
+    assert overlap_length(PAGE[:300], PAGE[280:500]) == 0
+    assert overlap_length(PAGE[:300], PAGE[400:500]) == 0
+
+
+def test_overlapping_spans_merges_windows_of_the_same_page():
+    documents = [
+        _window(0, 300),
+        _window(600, 900),
+        _window(0, 300, page=2),
+        # Bridges the first two once both are seen
+        _window(250, 650),
+        _window(100, 200)
+    ]
+
+    spans = overlapping_spans(documents)
+
+    assert [(text, sorted(members)) for text, members in spans] == [(PAGE[0:900], [0, 1, 3, 4]), (PAGE[0:300], [2])]
+
+
+def test_collapse_overlaps_keeps_the_lead_window_and_best_relevance():
+    documents = [_window(0, 300, rank="a"), _window(200, 500, rank="b"), _window(0, 300, page=2, rank="c")]
+    vectors = np.array([[1, 0], [0, 1], [1, 0]], dtype=np.float32)
+    relevance = np.array([0.2, 0.9, 0.5], dtype=np.float32)
+
+    merged, merged_vectors, merged_relevance = collapse_overlaps(documents, vectors, relevance)
+
+    assert [doc.page_content for doc in merged] == [PAGE[0:500], PAGE[0:300]]
+    assert merged[0].metadata["rank"] == "b"
+    assert merged[0].metadata["merged_chunks"] == 2
+    assert "merged_chunks" not in merged[1].metadata
+    assert merged_relevance.tolist() == [np.float32(0.9), np.float32(0.5)]
+    np.testing.assert_allclose(merged_vectors[0], [2 ** -0.5, 2 ** -0.5], rtol=1e-6)
+
+
+def test_mmr_select_trades_relevance_for_novelty():
+    relevance = np.array([1.0, 0.95, 0.6], dtype=np.float32)
+    # The second candidate repeats the first; the third says something else
+    vectors = np.array([[1, 0], [1, 0], [0, 1]], dtype=np.float32)
+
+    assert mmr_select(relevance, vectors, 3, lambda_mult=1.0).tolist() == [0, 1, 2]
+    assert mmr_select(relevance, vectors, 2, lambda_mult=0.5).tolist() == [0, 2]
+    assert mmr_select(relevance, vectors, 10, lambda_mult=0.5).tolist() == [0, 2, 1]
+    assert mmr_select(relevance[:0], vectors[:0], 3).tolist() == []
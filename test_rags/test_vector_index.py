@@ -0,0 +1,62 @@
+import hashlib
+import numpy as np
+from corpus_store import CorpusWriter, open_corpus
+from vector_index import ExactIndex, SearchFilter
+
+
+def test_shared_only_pinecone_filter():
+    search_filter = SearchFilter()
+    assert search_filter.to_pinecone() == {"shared": {"$eq": True}}
+
+
+def test_own_only_pinecone_filter():
+    search_filter = SearchFilter(
+        content_hashes=frozenset({"b" * 64, "a" * 64}),
+        document_ids=frozenset({7, 3}),
+        include_shared=False
+    )
+    assert search_filter.to_pinecone() == {"$or": [
+        {"content_hash": {"$in": ["a" * 64, "b" * 64]}},
+        {"document_id": {"$in": [3, 7]}}
+    ]}
+
+
+def test_mixed_pinecone_filter():
+    search_filter = SearchFilter(content_hashes=frozenset({"a" * 64}))
+    assert search_filter.to_pinecone() == {"$or": [
+        {"content_hash": {"$in": ["a" * 64]}},
+        {"shared": {"$eq": True}}
+    ]}
+
+
+def test_pinecone_filters_never_contain_exists_operator():
+    for search_filter in (
+        SearchFilter(),
+        SearchFilter(document_ids=frozenset({1}), include_shared=False),
+        SearchFilter(content_hashes=frozenset({"a" * 64}), document_ids=frozenset({1}))
+    ):
+        assert "$exists" not in repr(search_filter.to_pinecone())
+
+
+def test_matches_agrees_with_pinecone_filter():
+    search_filter = SearchFilter(content_hashes=frozenset({"a" * 64}), include_shared=False)
+    assert search_filter.matches({"document_id": 1, "content_hash": "a" * 64})
+    assert not search_filter.matches({"document_id": 2, "content_hash": "b" * 64})
+    assert not search_filter.matches({"shared": True, "source": "guides/manual.pdf"})
+    assert SearchFilter().matches({"shared": True, "source": "guides/manual.pdf"})
+
+
+def test_local_index_finds_stored_vectors_by_chunk_id(tmp_path):
+    writer = CorpusWriter(tmp_path / "manuals.corpus", 3)
+    document = writer.add_document("guides/manual.pdf", 1, {"source": "guides/manual.pdf"})
+    writer.append(document, "first chunk", {"page": 0}, [1.0, 0.0, 0.0])
+    writer.append(document, "second chunk", {"page": 0}, [0.0, 1.0, 0.0])
+    writer.close()
+    index = ExactIndex(open_corpus(tmp_path / "manuals.corpus"))
+    fingerprint = hashlib.sha256("second chunk".encode("utf-8")).hexdigest()
+
+    found = index.vectors_for([f"0123abcd#{fingerprint}", "corpus#0", "corpus#9", "0123abcd#unknown"])
+
+    assert set(found) == {f"0123abcd#{fingerprint}", "corpus#0"}
+    assert np.allclose(found[f"0123abcd#{fingerprint}"], [0.0, 1.0, 0.0])
+    assert np.allclose(found["corpus#0"], [1.0, 0.0, 0.0])
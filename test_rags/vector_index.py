@@ -0,0 +1,803 @@
+import argparse
+import asyncio
+import hashlib
+import heapq
+import math
+import os
+import time
+import numpy as np
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+from langchain_core.documents import Document
+from corpus_store import Corpus, open_corpus
+
+load_dotenv()
+
+PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+PINECONE_INDEX_NAME = "tech-docs-index"
+# "pinecone" (default), "exact", "hnsw", "int8" or "binary"
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "pinecone")
+LOCAL_CORPUS_PATH = Path(os.getenv(
+    "LOCAL_CORPUS_PATH", Path(__file__).parent / "cohere_embedded_docs.json"
+))
+# Candidates rescored at full precision per requested result in quantized
+# indexes; sign bits lose far more than int8 so binary needs a wider net
+QUANTIZED_RESCORE_FACTORS = {"int8": 4, "binary": 32}
+# Filters leaving less than this share of an HNSW index visible are answered
+# by scoring the visible rows directly instead of walking the graph
+HNSW_FILTER_SCAN_RATIO = 0.1
+# Concurrent Pinecone queries served by one retriever's connection pool
+PINECONE_POOL_THREADS = int(os.getenv("PINECONE_POOL_THREADS", "8"))
+# Most ids Pinecone accepts in one fetch request
+PINECONE_FETCH_BATCH = 1000
+# Largest query-by-row score matrix a batched search holds at once (float32 cells)
+BATCH_SCORE_CELLS = 1 << 24
+
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """The chunks a query may see: those of the listed documents, plus shared manuals.
+
+    Identical uploads share one vector set keyed by content hash, so a
+    document's chunks are matched by content_hash, or by document_id for
+    documents stored before hashing. Shared manuals are ingested by
+    embed_n_store for everyone with `shared: true` and pass when
+    include_shared is set; Pinecone filters on that marker, since
+    `$exists` is not reliably supported by serverless indexes. Local
+    corpora built before the marker existed have chunks without a
+    document_id, which are treated as shared too.
+    """
+    content_hashes: FrozenSet[str] = frozenset()
+    document_ids: FrozenSet[int] = frozenset()
+    include_shared: bool = True
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.content_hashes or self.document_ids or self.include_shared)
+
+    @property
+    def key(self) -> str:
+        """Stable string identifying the visible set, e.g. to partition caches"""
+        return "|".join([
+            ",".join(sorted(self.content_hashes)),
+            ",".join(str(i) for i in sorted(self.document_ids)),
+            "shared" if self.include_shared else ""
+        ])
+
+    def matches(self, metadata: Dict[str, Any]) -> bool:
+        if metadata.get("shared") or "document_id" not in metadata:
+            return self.include_shared
+        return metadata.get("content_hash") in self.content_hashes or metadata["document_id"] in self.document_ids
+
+    def to_pinecone(self) -> Dict[str, Any]:
+        """The same condition as a Pinecone metadata filter"""
+        clauses = []
+        if self.content_hashes:
+            clauses.append({"content_hash": {"$in": sorted(self.content_hashes)}})
+        if self.document_ids:
+            clauses.append({"document_id": {"$in": sorted(self.document_ids)}})
+        if self.include_shared:
+            clauses.append({"shared": {"$eq": True}})
+        return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+class Retriever(ABC):
+    """Searches indexed chunks by query embedding.
+
+    A `search_filter` is applied by the index while it searches, so only
+    the visible chunks are scored and top_k results are always returned
+    when that many are visible.
+    """
+
+    @abstractmethod
+    def search_with_vectors(
+        self,
+        query_vector: np.ndarray,
+        top_k: int = 4,
+        search_filter: Optional[SearchFilter] = None
+    ) -> Tuple[List[Document], np.ndarray]:
+        """Search, also returning the matches' embeddings (one row per document)"""
+
+    def search(
+        self,
+        query_vector: np.ndarray,
+        top_k: int = 4,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Document]:
+        return self.search_with_vectors(query_vector, top_k, search_filter)[0]
+
+    async def asearch(
+        self,
+        query_vector: np.ndarray,
+        top_k: int = 4,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Document]:
+        """Search without blocking the event loop"""
+        return await asyncio.to_thread(self.search, query_vector, top_k, search_filter)
+
+    async def asearch_with_vectors(
+        self,
+        query_vector: np.ndarray,
+        top_k: int = 4,
+        search_filter: Optional[SearchFilter] = None
+    ) -> Tuple[List[Document], np.ndarray]:
+        return await asyncio.to_thread(self.search_with_vectors, query_vector, top_k, search_filter)
+
+    def search_many_with_vectors(
+        self,
+        query_vectors: np.ndarray,
+        top_k: int = 4,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Tuple[List[Document], np.ndarray]]:
+        """search_with_vectors for each row of `query_vectors`.
+
+        Backends override this to search the whole batch at once; the
+        default runs the queries one after another.
+        """
+        return [self.search_with_vectors(query, top_k, search_filter) for query in query_vectors]
+
+    def search_many(
+        self,
+        query_vectors: np.ndarray,
+        top_k: int = 4,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[List[Document]]:
+        return [documents for documents, _ in self.search_many_with_vectors(query_vectors, top_k, search_filter)]
+
+    def vectors_for(self, chunk_ids: List[str]) -> Dict[str, np.ndarray]:
+        """Stored embeddings of the chunks with these ids; ids the index does not hold are left out"""
+        return {}
+
+
+class PineconeRetriever(Retriever):
+    """Searches the hosted Pinecone index.
+
+    The client and index handle are created once; queries reuse the
+    index's pooled connections.
+    """
+
+    def __init__(
+        self,
+        api_key: str = PINECONE_API_KEY,
+        index_name: str = PINECONE_INDEX_NAME,
+        pool_threads: int = PINECONE_POOL_THREADS
+    ):
+        from pinecone import Pinecone
+
+        self.index = Pinecone(api_key=api_key).Index(index_name, pool_threads=pool_threads)
+
+    def _request(
+        self,
+        query_vector: np.ndarray,
+        top_k: int,
+        search_filter: Optional[SearchFilter],
+        include_values: bool,
+        async_req: bool = False
+    ):
+        return self.index.query(
+            vector=np.asarray(query_vector).tolist(),
+            top_k=top_k,
+            filter=search_filter.to_pinecone() if search_filter is not None else None,
+            include_metadata=True,
+            include_values=include_values,
+            async_req=async_req
+        )
+
+    def _query(
+        self,
+        query_vector: np.ndarray,
+        top_k: int,
+        search_filter: Optional[SearchFilter],
+        include_values: bool
+    ) -> Tuple[List[Document], np.ndarray]:
+        if search_filter is not None and search_filter.is_empty:
+            return [], np.empty((0, len(query_vector)), dtype=np.float32)
+        return self._parse(self._request(query_vector, top_k, search_filter, include_values), include_values)
+
+    @staticmethod
+    def _parse(response, include_values: bool) -> Tuple[List[Document], np.ndarray]:
+        documents, vectors = [], []
+        for match in response.matches:
+            # Chunk text is stored under "text", as PineconeVectorStore expects
+            metadata = dict(match.metadata or {})
+            text = metadata.pop("text", "")
+            documents.append(Document(page_content=text, metadata={**metadata, "score": match.score}))
+            vectors.append(match.values)
+        if not include_values:
+            return documents, None
+        return documents, np.asarray(vectors, dtype=np.float32).reshape(len(documents), -1)
+
+    def search_with_vectors(
+        self,
+        query_vector: np.ndarray,
+        top_k: int = 4,
+        search_filter: Optional[SearchFilter] = None
+    ) -> Tuple[List[Document], np.ndarray]:
+        return self._query(query_vector, top_k, search_filter, include_values=True)
+
+    def search(
+        self,
+        query_vector: np.ndarray,
+        top_k: int = 4,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Document]:
+        return self._query(query_vector, top_k, search_filter, include_values=False)[0]
+
+    def _query_many(
+        self,
+        query_vectors: np.ndarray,
+        top_k: int,
+        search_filter: Optional[SearchFilter],
+        include_values: bool
+    ) -> List[Tuple[List[Document], np.ndarray]]:
+        if search_filter is not None and search_filter.is_empty:
+            return [self._query(query, top_k, search_filter, include_values) for query in query_vectors]
+        # Pinecone has no multi-vector query; issue them all on the index's
+        # connection pool and collect the responses in order
+        pending = [
+            self._request(query, top_k, search_filter, include_values, async_req=True)
+            for query in query_vectors
+        ]
+        return [self._parse(request.get(), include_values) for request in pending]
+
+    def search_many_with_vectors(
+        self,
+        query_vectors: np.ndarray,
+        top_k: int = 4,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Tuple[List[Document], np.ndarray]]:
+        return self._query_many(query_vectors, top_k, search_filter, include_values=True)
+
+    def search_many(
+        self,
+        query_vectors: np.ndarray,
+        top_k: int = 4,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[List[Document]]:
+        return [documents for documents, _ in self._query_many(query_vectors, top_k, search_filter, include_values=False)]
+
+    def vectors_for(self, chunk_ids: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        # Chunk ids are the vector ids (see embed_n_store and the backend pipeline)
+        for start in range(0, len(chunk_ids), PINECONE_FETCH_BATCH):
+            response = self.index.fetch(ids=chunk_ids[start:start + PINECONE_FETCH_BATCH])
+            for vector_id, vector in response.vectors.items():
+                found[vector_id] = np.asarray(vector.values, dtype=np.float32)
+        return found
+
+
+class VectorIndex(Retriever):
+    """In-process index over a binary corpus, scored by cosine similarity"""
+
+    def __init__(self, corpus: Corpus):
+        self.corpus = corpus
+        self._filter_rows: Dict[SearchFilter, np.ndarray] = {}
+        self._rows_by_fingerprint: Optional[Dict[str, int]] = None
+
+    def _rows(self, search_filter: Optional[SearchFilter]) -> Optional[np.ndarray]:
+        """Rows visible through a filter (None for all), worked out per corpus document"""
+        if search_filter is None:
+            return None
+        rows = self._filter_rows.get(search_filter)
+        if rows is None:
+            visible = np.array(
+                [search_filter.matches(document["metadata"]) for document in self.corpus.documents],
+                dtype=bool
+            )
+            rows = np.flatnonzero(visible[self.corpus.document_index]) if len(visible) else np.empty(0, dtype=int)
+            if len(self._filter_rows) >= 256:
+                self._filter_rows.clear()
+            self._filter_rows[search_filter] = rows
+        return rows
+
+    @staticmethod
+    def _normalize(query_vector: np.ndarray) -> np.ndarray:
+        query = np.asarray(query_vector, dtype=np.float32)
+        return query / max(float(np.linalg.norm(query)), 1e-12)
+
+    @staticmethod
+    def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    @property
+    def memory_bytes(self) -> int:
+        """Resident size of the searchable vectors"""
+        return self.vectors.nbytes
+
+    @abstractmethod
+    def search_ids(
+        self,
+        query_vector: np.ndarray,
+        top_k: int,
+        rows: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the row ids and scores of the best matches among `rows` (default all), best first"""
+
+    def search_ids_many(
+        self,
+        query_vectors: np.ndarray,
+        top_k: int,
+        rows: Optional[np.ndarray] = None
+    ) -> Tuple[Sequence[np.ndarray], Sequence[np.ndarray]]:
+        """search_ids for each row of `query_vectors`: per-query ids and scores"""
+        results = [self.search_ids(query, top_k, rows) for query in query_vectors]
+        return [ids for ids, _ in results], [scores for _, scores in results]
+
+    def search_with_vectors(
+        self,
+        query_vector: np.ndarray,
+        top_k: int = 4,
+        search_filter: Optional[SearchFilter] = None
+    ) -> Tuple[List[Document], np.ndarray]:
+        ids, scores = self.search_ids(query_vector, top_k, self._rows(search_filter))
+        return self._results(ids, scores)
+
+    def search_many_with_vectors(
+        self,
+        query_vectors: np.ndarray,
+        top_k: int = 4,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Tuple[List[Document], np.ndarray]]:
+        ids_many, scores_many = self.search_ids_many(
+            np.asarray(query_vectors, dtype=np.float32), top_k, self._rows(search_filter)
+        )
+        return [self._results(ids, scores) for ids, scores in zip(ids_many, scores_many)]
+
+    def vectors_for(self, chunk_ids: List[str]) -> Dict[str, np.ndarray]:
+        # Keyword indexes key corpus chunks like their vectors, "<document key>#<text
+        # fingerprint>" (see embed_n_store), or by row as "corpus#<row>" (benchmarks)
+        found = {}
+        for chunk_id in chunk_ids:
+            prefix, _, suffix = chunk_id.partition("#")
+            if prefix == "corpus" and suffix.isdigit():
+                row = int(suffix) if int(suffix) < len(self.corpus) else None
+            else:
+                row = self._fingerprint_rows().get(suffix)
+            if row is not None:
+                found[chunk_id] = np.asarray(self.corpus.embeddings[row], dtype=np.float32)
+        return found
+
+    def _fingerprint_rows(self) -> Dict[str, int]:
+        """Corpus row of each chunk text's SHA-256, worked out on first use"""
+        if self._rows_by_fingerprint is None:
+            self._rows_by_fingerprint = {}
+            for i in range(len(self.corpus)):
+                fingerprint = hashlib.sha256(self.corpus.text(i).encode("utf-8")).hexdigest()
+                self._rows_by_fingerprint.setdefault(fingerprint, i)
+        return self._rows_by_fingerprint
+
+    def _results(self, ids: np.ndarray, scores: np.ndarray) -> Tuple[List[Document], np.ndarray]:
+        documents = [
+            Document(
+                page_content=self.corpus.text(i),
+                metadata={**self.corpus.metadata(i), "score": float(score)}
+            )
+            for i, score in zip(ids, scores)
+        ]
+        # Full-precision rows from the corpus, whichever codes were searched
+        return documents, self._normalize_rows(self.corpus.embeddings[ids])
+
+
+class ExactIndex(VectorIndex):
+    """Brute-force search: one matrix-vector product over the whole corpus"""
+
+    def __init__(self, corpus: Corpus):
+        super().__init__(corpus)
+        self.vectors = self._normalize_rows(corpus.embeddings)
+
+    def search_ids(
+        self,
+        query_vector: np.ndarray,
+        top_k: int,
+        rows: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        query = self._normalize(query_vector)
+        if rows is None:
+            scores = self.vectors @ query
+            ids = _top(scores, top_k)
+            return ids, scores[ids]
+        # Only the visible rows are scored
+        scores = self.vectors[rows] @ query
+        best = _top(scores, top_k)
+        return rows[best], scores[best]
+
+    def search_ids_many(
+        self,
+        query_vectors: np.ndarray,
+        top_k: int,
+        rows: Optional[np.ndarray] = None
+    ) -> Tuple[Sequence[np.ndarray], Sequence[np.ndarray]]:
+        """Score a block of queries against the corpus with one matrix product"""
+        queries = self._normalize_rows(query_vectors)
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        ids, scores = [], []
+        for block in _query_blocks(len(queries), len(vectors)):
+            block_scores = queries[block] @ vectors.T
+            best = _top_rows(block_scores, top_k)
+            ids.extend(best if rows is None else rows[best])
+            scores.extend(np.take_along_axis(block_scores, best, axis=1))
+        return ids, scores
+
+
+class HNSWIndex(VectorIndex):
+    """Approximate search over a hierarchical navigable small-world graph.
+
+    Each chunk is a node linked to its nearest neighbours on layer 0 and,
+    with geometrically falling probability, on sparser upper layers. A query
+    descends greedily from the top layer, then runs a best-first search of
+    width `ef_search` on layer 0, visiting a small fraction of the corpus.
+    Neighbour lists keep the closest candidates (no pruning heuristic).
+    """
+
+    def __init__(
+        self,
+        corpus: Corpus,
+        m: int = 16,
+        ef_construction: int = 100,
+        ef_search: int = 64,
+        seed: int = 0
+    ):
+        super().__init__(corpus)
+        self.vectors = self._normalize_rows(corpus.embeddings)
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        rng = np.random.default_rng(seed)
+        uniform = 1.0 - rng.random(len(self.vectors))
+        self.levels = np.floor(-np.log(uniform) / math.log(m)).astype(int)
+        self.layers: List[Dict[int, List[int]]] = []
+        self.entry_point = None
+        for node in range(len(self.vectors)):
+            self._insert(node)
+
+    def _max_neighbours(self, layer: int) -> int:
+        return self.m * 2 if layer == 0 else self.m
+
+    def _search_layer(
+        self,
+        query: np.ndarray,
+        entry_points: List[int],
+        ef: int,
+        layer: int,
+        allowed: Optional[np.ndarray] = None
+    ) -> List[Tuple[float, int]]:
+        """Best-first search on one layer; returns up to ef (score, node), best first.
+
+        With an `allowed` mask the walk still passes through hidden nodes
+        but only visible ones enter the results.
+        """
+        graph = self.layers[layer]
+        visited = set(entry_points)
+        scores = self.vectors[entry_points] @ query
+        candidates = [(-s, n) for s, n in zip(scores, entry_points)]
+        heapq.heapify(candidates)
+        results = [(s, n) for s, n in zip(scores, entry_points) if allowed is None or allowed[n]]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            neg_score, node = heapq.heappop(candidates)
+            if len(results) >= ef and -neg_score < results[0][0]:
+                break
+            neighbours = [n for n in graph.get(node, ()) if n not in visited]
+            if not neighbours:
+                continue
+            visited.update(neighbours)
+            for score, neighbour in zip(self.vectors[neighbours] @ query, neighbours):
+                if len(results) < ef or score > results[0][0]:
+                    heapq.heappush(candidates, (-score, neighbour))
+                    if allowed is None or allowed[neighbour]:
+                        heapq.heappush(results, (score, neighbour))
+                        if len(results) > ef:
+                            heapq.heappop(results)
+        return sorted(results, reverse=True)
+
+    def _descend(self, query: np.ndarray, down_to: int) -> int:
+        """Greedy walk from the entry point through the layers above `down_to`"""
+        node = self.entry_point
+        for layer in range(len(self.layers) - 1, down_to, -1):
+            node = self._search_layer(query, [node], 1, layer)[0][1]
+        return node
+
+    def _insert(self, node: int):
+        level = int(self.levels[node])
+        while len(self.layers) <= level:
+            self.layers.append({})
+        if self.entry_point is None:
+            for layer in range(level + 1):
+                self.layers[layer][node] = []
+            self.entry_point = node
+            return
+
+        top_level = int(self.levels[self.entry_point])
+        query = self.vectors[node]
+        entry = [self._descend(query, level)]
+        for layer in range(min(level, top_level), -1, -1):
+            found = self._search_layer(query, entry, self.ef_construction, layer)
+            neighbours = [n for _, n in found[:self.m]]
+            graph = self.layers[layer]
+            graph[node] = neighbours
+            limit = self._max_neighbours(layer)
+            for neighbour in neighbours:
+                links = graph.setdefault(neighbour, [])
+                links.append(node)
+                if len(links) > limit:
+                    scores = self.vectors[links] @ self.vectors[neighbour]
+                    graph[neighbour] = [links[i] for i in np.argsort(-scores)[:limit]]
+            entry = [n for _, n in found]
+        for layer in range(top_level + 1, level + 1):
+            self.layers[layer][node] = []
+        if level > top_level:
+            self.entry_point = node
+
+    def search_ids(
+        self,
+        query_vector: np.ndarray,
+        top_k: int,
+        rows: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        if self.entry_point is None or (rows is not None and not len(rows)):
+            return np.empty(0, dtype=int), np.empty(0, dtype=np.float32)
+        query = self._normalize(query_vector)
+        allowed = None
+        if rows is not None:
+            if len(rows) < len(self.vectors) * HNSW_FILTER_SCAN_RATIO:
+                # A narrow filter would send the walk across most of the
+                # graph; scoring the few visible rows directly is cheaper
+                scores = self.vectors[rows] @ query
+                best = _top(scores, top_k)
+                return rows[best], scores[best]
+            allowed = np.zeros(len(self.vectors), dtype=bool)
+            allowed[rows] = True
+        entry = self._descend(query, 0)
+        found = self._search_layer(query, [entry], max(self.ef_search, top_k), 0, allowed)[:top_k]
+        return (
+            np.array([n for _, n in found], dtype=int),
+            np.array([s for s, _ in found], dtype=np.float32)
+        )
+
+
+def _top(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first"""
+    k = min(k, len(scores))
+    ids = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    return ids[np.argsort(-scores[ids])]
+
+
+def _top_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """_top for each row of a (queries, candidates) score matrix"""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((len(scores), 0), dtype=int)
+    ids = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < scores.shape[1] else np.tile(
+        np.arange(scores.shape[1]), (len(scores), 1)
+    )
+    order = np.argsort(-np.take_along_axis(scores, ids, axis=1), axis=1)
+    return np.take_along_axis(ids, order, axis=1)
+
+
+def _query_blocks(queries: int, rows: int) -> List[slice]:
+    """Slices of a query batch whose score matrices stay within BATCH_SCORE_CELLS"""
+    size = max(1, BATCH_SCORE_CELLS // max(rows, 1))
+    return [slice(start, start + size) for start in range(0, queries, size)]
+
+
+# Set bits in every byte value, for Hamming distances over packed codes
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint16)
+
+
+class QuantizedIndex(VectorIndex):
+    """Search over compressed codes, then rescore the best candidates exactly.
+
+    "int8" keeps one signed byte per dimension (4x smaller than float32),
+    scaled per dimension to the corpus's range. "binary" keeps one sign bit
+    per dimension (32x smaller) and ranks candidates by Hamming distance.
+    Only the codes stay in memory: the top `top_k * rescore_factor`
+    candidates are rescored against the full-precision embeddings read from
+    the memory-mapped corpus.
+    """
+
+    def __init__(
+        self,
+        corpus: Corpus,
+        mode: str = "int8",
+        rescore_factor: Optional[int] = None,
+        block_rows: int = 8192
+    ):
+        if mode not in ("int8", "binary"):
+            raise ValueError(f"Unknown quantization mode: {mode}")
+        super().__init__(corpus)
+        self.mode = mode
+        self.rescore_factor = rescore_factor or QUANTIZED_RESCORE_FACTORS[mode]
+        self.block_rows = block_rows
+
+        # Encode block by block so the float matrix is never fully resident
+        embeddings = corpus.embeddings
+        blocks = range(0, len(embeddings), block_rows)
+        if mode == "int8":
+            max_abs = np.zeros(embeddings.shape[1], dtype=np.float32)
+            for start in blocks:
+                block = self._normalize_rows(embeddings[start:start + block_rows])
+                max_abs = np.maximum(max_abs, np.abs(block).max(axis=0))
+            self.scale = np.maximum(max_abs, 1e-12) / 127
+            self.codes = np.empty(embeddings.shape, dtype=np.int8)
+            for start in blocks:
+                block = self._normalize_rows(embeddings[start:start + block_rows])
+                self.codes[start:start + block_rows] = np.clip(np.rint(block / self.scale), -127, 127)
+        else:
+            self.codes = np.empty((len(embeddings), (embeddings.shape[1] + 7) // 8), dtype=np.uint8)
+            for start in blocks:
+                self.codes[start:start + block_rows] = np.packbits(
+                    np.asarray(embeddings[start:start + block_rows]) > 0, axis=1
+                )
+
+    @property
+    def memory_bytes(self) -> int:
+        return self.codes.nbytes
+
+    def _approximate_scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        count = len(self.codes) if rows is None else len(rows)
+        scores = np.empty(count, dtype=np.float32)
+        if self.mode == "int8":
+            scaled_query = query * self.scale
+            for start in range(0, count, self.block_rows):
+                block = self._block(start, rows)
+                scores[start:start + len(block)] = block.astype(np.float32) @ scaled_query
+        else:
+            query_bits = np.packbits(query > 0)
+            for start in range(0, count, self.block_rows):
+                block = self._block(start, rows)
+                # Fewer differing bits is better
+                hamming = _POPCOUNT[block ^ query_bits].sum(axis=1, dtype=np.int32)
+                scores[start:start + len(block)] = -hamming
+        return scores
+
+    def _block(self, start: int, rows: Optional[np.ndarray]) -> np.ndarray:
+        if rows is None:
+            return self.codes[start:start + self.block_rows]
+        return self.codes[rows[start:start + self.block_rows]]
+
+    def search_ids(
+        self,
+        query_vector: np.ndarray,
+        top_k: int,
+        rows: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        query = self._normalize(query_vector)
+        return self._rescore(query, self._approximate_scores(query, rows), top_k, rows)
+
+    def _rescore(
+        self,
+        query: np.ndarray,
+        approximate: np.ndarray,
+        top_k: int,
+        rows: Optional[np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        candidates = _top(approximate, top_k * self.rescore_factor)
+        candidates = np.sort(candidates if rows is None else rows[candidates])
+        exact = self._normalize_rows(self.corpus.embeddings[candidates]) @ query
+        best = _top(exact, top_k)
+        return candidates[best], exact[best]
+
+    def search_ids_many(
+        self,
+        query_vectors: np.ndarray,
+        top_k: int,
+        rows: Optional[np.ndarray] = None
+    ) -> Tuple[Sequence[np.ndarray], Sequence[np.ndarray]]:
+        if self.mode != "int8":
+            # Hamming distances are taken per query code; batching saves nothing
+            return super().search_ids_many(query_vectors, top_k, rows)
+        queries = self._normalize_rows(query_vectors)
+        count = len(self.codes) if rows is None else len(rows)
+        ids, scores = [], []
+        for block in _query_blocks(len(queries), count):
+            # Each block of codes is widened once and scored against every query
+            scaled = (queries[block] * self.scale).T
+            approximate = np.empty((count, scaled.shape[1]), dtype=np.float32)
+            for start in range(0, count, self.block_rows):
+                codes = self._block(start, rows)
+                approximate[start:start + len(codes)] = codes.astype(np.float32) @ scaled
+            for column, query in enumerate(queries[block]):
+                found, found_scores = self._rescore(query, approximate[:, column], top_k, rows)
+                ids.append(found)
+                scores.append(found_scores)
+        return ids, scores
+
+
+def build_retriever(backend: str = RETRIEVER_BACKEND, corpus_path: Path = LOCAL_CORPUS_PATH) -> Retriever:
+    if backend == "pinecone":
+        return PineconeRetriever()
+    if backend == "exact":
+        return ExactIndex(open_corpus(corpus_path))
+    if backend == "hnsw":
+        return HNSWIndex(open_corpus(corpus_path))
+    if backend in ("int8", "binary"):
+        return QuantizedIndex(open_corpus(corpus_path), mode=backend)
+    raise ValueError(f"Unknown retriever backend: {backend}")
+
+
+def recall_at_k(found: List[List[str]], expected: List[List[str]]) -> float:
+    hits = sum(len(set(f) & set(e)) for f, e in zip(found, expected))
+    return hits / max(sum(len(e) for e in expected), 1)
+
+
+def _benchmark(retriever: Retriever, queries: np.ndarray, top_k: int) -> Tuple[List[List[str]], np.ndarray]:
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        docs = retriever.search(query, top_k)
+        latencies.append(time.perf_counter() - start)
+        results.append([doc.page_content for doc in docs])
+    return results, np.array(latencies) * 1000
+
+
+SAMPLE_QUERIES = [
+    "What was said about 'Turning Off Your PC'?",
+    "How do I set up my computer for the first time?",
+    "How do I connect to the Internet?",
+    "What should I do if the computer does not start?",
+    "How do I adjust the monitor display settings?",
+    "Where can I find safety and comfort information?",
+    "How do I use the recovery tools?",
+    "How do I install additional memory?"
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare retriever backends on latency and recall@k")
+    parser.add_argument("--corpus", type=Path, default=LOCAL_CORPUS_PATH)
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--sample", type=int, default=0,
+                        help="Use N corpus embeddings as queries instead of embedding SAMPLE_QUERIES")
+    parser.add_argument("--pinecone", action="store_true", help="Include the hosted Pinecone index")
+    args = parser.parse_args()
+
+    corpus = open_corpus(args.corpus)
+    if args.sample:
+        rows = np.random.default_rng(0).choice(len(corpus), min(args.sample, len(corpus)), replace=False)
+        queries = np.asarray(corpus.embeddings[np.sort(rows)], dtype=np.float32)
+    else:
+        from embedder import embedder
+        queries = embedder.embed(SAMPLE_QUERIES, "search_query")
+
+    retrievers = {}
+    for name, build in [
+        ("exact", ExactIndex),
+        ("hnsw", HNSWIndex),
+        ("int8", lambda c: QuantizedIndex(c, "int8")),
+        ("binary", lambda c: QuantizedIndex(c, "binary"))
+    ]:
+        start = time.perf_counter()
+        retrievers[name] = build(corpus)
+        print(
+            f"Built {name} index over {len(corpus)} chunks in {time.perf_counter() - start:.2f}s "
+            f"({retrievers[name].memory_bytes / 1e6:.2f} MB of vectors in memory)"
+        )
+    if args.pinecone:
+        retrievers["pinecone"] = PineconeRetriever()
+
+    # Exact search is the ground truth every backend is measured against
+    expected, _ = _benchmark(retrievers["exact"], queries, args.top_k)
+    print(f"\n{len(queries)} queries, top_k={args.top_k}:")
+    for name, retriever in retrievers.items():
+        found, latencies = _benchmark(retriever, queries, args.top_k)
+        start = time.perf_counter()
+        retriever.search_many(queries, args.top_k)
+        batch_seconds = time.perf_counter() - start
+        print(
+            f"- {name}: p50 {np.percentile(latencies, 50):.2f} ms, "
+            f"p95 {np.percentile(latencies, 95):.2f} ms, "
+            f"recall@{args.top_k} {recall_at_k(found, expected):.3f}, "
+            f"batched {len(queries) / batch_seconds:.0f} queries/s "
+            f"(one by one {len(queries) / (latencies.sum() / 1000):.0f})"
+        )
+
+if __name__ == "__main__":
+    main()